@@ -0,0 +1,32 @@
+from __future__ import annotations
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# Lazily created on the first batch so single /optimize calls never pay for it.
+_process_pool: ProcessPoolExecutor | None = None
+
+
+def available_cpus() -> int:
+    """CPUs this process may run on (respects affinity/cgroup pinning where exposed)."""
+    try:
+        return max(1, len(os.sched_getaffinity(0)))
+    except AttributeError:  # pragma: no cover - not available on macOS/Windows
+        return max(1, os.cpu_count() or 1)
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """Process pool for batch solves, sized by OPTIMIZE_BATCH_WORKERS or the available CPUs."""
+    global _process_pool
+    if _process_pool is None:
+        workers = int(os.getenv("OPTIMIZE_BATCH_WORKERS") or available_cpus())
+        _process_pool = ProcessPoolExecutor(max_workers=max(1, workers))
+    return _process_pool
+
+
+def shutdown_process_pool() -> None:
+    global _process_pool
+    pool = _process_pool
+    _process_pool = None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
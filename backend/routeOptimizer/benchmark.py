@@ -0,0 +1,384 @@
+"""Optimizer benchmarks: runtime, peak memory and tour quality per solver.
+
+    python -m backend.routeOptimizer.benchmark --output bench.json
+    python -m backend.routeOptimizer.benchmark --compare bench.json
+
+Instances are seeded, so two runs on the same code produce the same tours and
+only the timings differ. Results are one JSON document; `--compare` checks a
+run against an earlier one and exits with status 1 on a regression.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import platform
+import sys
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Callable
+
+import numpy as np
+
+try:
+    from .batch import available_cpus, get_process_pool
+    from .catalog_matrix import resolve_destinations_json_path
+    from .construction import CONSTRUCTIONS
+    from .exact import HELD_KARP_MAX_N, held_karp
+    from .multistart import parallel_multistart
+    from .optimizer import build_distance_matrix_array, path_length, solve_order_from_cost_matrix
+except ImportError:  # pragma: no cover
+    from batch import available_cpus, get_process_pool
+    from catalog_matrix import resolve_destinations_json_path
+    from construction import CONSTRUCTIONS
+    from exact import HELD_KARP_MAX_N, held_karp
+    from multistart import parallel_multistart
+    from optimizer import build_distance_matrix_array, path_length, solve_order_from_cost_matrix
+
+# (lat, lng) bounding box of Sri Lanka.
+SRI_LANKA_BOUNDS = ((5.92, 79.70), (9.83, 81.88))
+# Central highlands, where roads wind and traffic instances drive slower.
+_HILL_COUNTRY = ((6.70, 80.40), (7.45, 81.10))
+
+DEFAULT_SIZES = (5, 10, 13, 20, 50, 100, 200, 500)
+FAMILIES = ("uniform", "catalog", "traffic")
+
+
+@dataclass
+class Instance:
+    name: str
+    family: str
+    n: int
+    seed: int
+    coords: np.ndarray
+    cost: np.ndarray
+
+
+def _uniform_coords(n: int, rng: np.random.Generator) -> np.ndarray:
+    (lat0, lng0), (lat1, lng1) = SRI_LANKA_BOUNDS
+    return np.column_stack((rng.uniform(lat0, lat1, n), rng.uniform(lng0, lng1, n)))
+
+
+def _traffic_matrix(coords: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """Asymmetric driving minutes: haversine km with a road detour factor,
+    slower legs into the hill country and per-direction congestion noise."""
+    km = build_distance_matrix_array(coords)
+    (lat0, lng0), (lat1, lng1) = _HILL_COUNTRY
+    hilly = (coords[:, 0] >= lat0) & (coords[:, 0] <= lat1) & (coords[:, 1] >= lng0) & (coords[:, 1] <= lng1)
+    speed_kmh = np.where(hilly[:, None] | hilly[None, :], 25.0, 45.0)
+    congestion = rng.lognormal(mean=0.0, sigma=0.25, size=km.shape)
+    minutes = km * 1.3 / speed_kmh * 60.0 * congestion
+    np.fill_diagonal(minutes, 0.0)
+    return minutes
+
+
+def _catalog_coords(n: int, rng: np.random.Generator, catalog: np.ndarray | None) -> np.ndarray | None:
+    if catalog is None or len(catalog) < n:
+        return None
+    return catalog[np.sort(rng.choice(len(catalog), size=n, replace=False))]
+
+
+def load_catalog_coords(path: Path | None = None) -> np.ndarray | None:
+    """(lat, lng) of every catalog destination, or None without a catalog."""
+    path = path or resolve_destinations_json_path()
+    if not path.exists():
+        return None
+    raw = json.loads(path.read_text(encoding="utf-8"))
+    return np.array([(float(d["latitude"]), float(d["longitude"])) for d in raw], dtype=np.float64)
+
+
+def make_instances(
+    sizes: tuple[int, ...] = DEFAULT_SIZES,
+    *,
+    families: tuple[str, ...] = FAMILIES,
+    seeds: tuple[int, ...] = (0,),
+    catalog: np.ndarray | None = None,
+) -> list[Instance]:
+    """Seeded benchmark instances. Catalog instances are skipped for sizes
+    larger than the catalog (or without one)."""
+    out: list[Instance] = []
+    for family in families:
+        for n in sizes:
+            for seed in seeds:
+                # One stream per (family, n, seed), so adding a size or family
+                # leaves the other instances unchanged.
+                rng = np.random.default_rng([FAMILIES.index(family), n, seed])
+                if family == "catalog":
+                    coords = _catalog_coords(n, rng, catalog)
+                    if coords is None:
+                        continue
+                else:
+                    coords = _uniform_coords(n, rng)
+                cost = _traffic_matrix(coords, rng) if family == "traffic" else build_distance_matrix_array(coords)
+                out.append(Instance(f"{family}-n{n}-s{seed}", family, n, seed, coords, cost))
+    return out
+
+
+# A solver returns (order, local-search moves, timed out).
+Solver = Callable[[Instance, bool, "float | None"], tuple[list[int], int, bool]]
+
+
+def _exact(inst: Instance, return_to_start: bool, time_budget_ms: float | None) -> tuple[list[int], int, bool]:
+    return held_karp(inst.cost, return_to_start=return_to_start), 0, False
+
+
+def _heuristic(construction: str, improvement: str = "2opt") -> Solver:
+    def solve(inst: Instance, return_to_start: bool, time_budget_ms: float | None) -> tuple[list[int], int, bool]:
+        result = solve_order_from_cost_matrix(
+            inst.cost,
+            return_to_start=return_to_start,
+            try_all_starts=True,
+            exact_max_n=0,
+            construction=construction,
+            coords=inst.coords,
+            time_budget_ms=time_budget_ms,
+            improvement=improvement,
+        )
+        return result.order, result.iterations, result.timed_out
+
+    return solve
+
+
+def _multistart(inst: Instance, return_to_start: bool, time_budget_ms: float | None) -> tuple[list[int], int, bool]:
+    # Peak memory covers this process only, not the workers.
+    result = parallel_multistart(
+        inst.cost,
+        pool=get_process_pool(),
+        workers=available_cpus(),
+        return_to_start=return_to_start,
+        try_all_starts=True,
+        coords=inst.coords,
+        time_budget_ms=time_budget_ms,
+    )
+    return result.order, result.iterations, result.timed_out
+
+
+SOLVERS: dict[str, Solver] = {"held_karp": _exact}
+SOLVERS.update({c: _heuristic(c) for c in CONSTRUCTIONS})
+# The neighbour-list engines, from the default and the cheapest construction.
+SOLVERS.update(
+    {f"{c}+{m}": _heuristic(c, m) for c in ("nearest_neighbor", "space_filling_curve") for m in ("or_opt", "lk")}
+)
+SOLVERS["multistart"] = _multistart
+
+
+@dataclass
+class BenchResult:
+    instance: str
+    family: str
+    n: int
+    seed: int
+    return_to_start: bool
+    solver: str
+    cost: float
+    # Exact optimum (n <= HELD_KARP_MAX_N) or the best cost any solver found.
+    reference: float
+    reference_kind: str
+    # cost / reference - 1.
+    gap: float
+    # Fastest of the timed repeats.
+    runtime_ms: float
+    # Peak Python/NumPy allocation during one solve (tracemalloc).
+    peak_memory_bytes: int
+    iterations: int
+    timed_out: bool
+
+
+def _check_order(order: list[int], n: int) -> None:
+    if sorted(order) != list(range(n)):
+        raise AssertionError(f"solver returned an invalid order of {n} stops")
+
+
+def run_benchmarks(
+    instances: list[Instance],
+    *,
+    solvers: tuple[str, ...] | None = None,
+    return_to_start: bool = False,
+    repeats: int = 3,
+    time_budget_ms: float | None = None,
+    best_known: dict[str, float] | None = None,
+) -> list[BenchResult]:
+    """Run every solver on every instance. Held-Karp only runs up to
+    HELD_KARP_MAX_N stops; its optimum is the reference wherever it applies."""
+    names = solvers or tuple(SOLVERS)
+    best_known = best_known if best_known is not None else {}
+    results: list[BenchResult] = []
+    for inst in instances:
+        rows: list[dict[str, Any]] = []
+        for name in names:
+            if name == "held_karp" and inst.n > HELD_KARP_MAX_N:
+                continue
+            solver = SOLVERS[name]
+            runtimes = []
+            for _ in range(max(repeats, 1)):
+                started = time.perf_counter()
+                order, iterations, timed_out = solver(inst, return_to_start, time_budget_ms)
+                runtimes.append((time.perf_counter() - started) * 1000.0)
+            _check_order(order, inst.n)
+            # tracemalloc slows interpreted code, so memory gets its own run.
+            tracemalloc.start()
+            try:
+                solver(inst, return_to_start, time_budget_ms)
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            rows.append(
+                {
+                    "solver": name,
+                    "cost": path_length(inst.cost, order, return_to_start),
+                    "runtime_ms": min(runtimes),
+                    "peak_memory_bytes": int(peak),
+                    "iterations": iterations,
+                    "timed_out": timed_out,
+                }
+            )
+
+        key = f"{inst.name}-{'cycle' if return_to_start else 'path'}"
+        if inst.n <= HELD_KARP_MAX_N:
+            exact_rows = [r for r in rows if r["solver"] == "held_karp"]
+            if exact_rows:
+                reference = exact_rows[0]["cost"]
+            else:
+                reference = path_length(inst.cost, held_karp(inst.cost, return_to_start=return_to_start), return_to_start)
+            kind = "exact"
+        else:
+            reference = min([r["cost"] for r in rows] + ([best_known[key]] if key in best_known else []))
+            kind = "best_known"
+        best_known[key] = min(reference, best_known.get(key, math.inf))
+
+        for r in rows:
+            gap = r["cost"] / reference - 1.0 if reference > 0 else 0.0
+            results.append(
+                BenchResult(
+                    instance=inst.name,
+                    family=inst.family,
+                    n=inst.n,
+                    seed=inst.seed,
+                    return_to_start=return_to_start,
+                    reference=reference,
+                    reference_kind=kind,
+                    gap=max(gap, 0.0),
+                    **r,
+                )
+            )
+    return results
+
+
+def compare(
+    current: list[dict[str, Any]],
+    baseline: list[dict[str, Any]],
+    *,
+    max_gap_increase: float = 0.005,
+    max_slowdown: float = 1.5,
+    min_runtime_ms: float = 5.0,
+) -> list[str]:
+    """Regressions of `current` against `baseline` (rows of `BenchResult`).
+
+    Quality regresses if the gap grew by more than `max_gap_increase`; speed if
+    the runtime grew by more than `max_slowdown` times, ignoring runs faster
+    than `min_runtime_ms` where timer noise dominates.
+    """
+
+    def key(row: dict[str, Any]) -> tuple[str, bool, str]:
+        return row["instance"], row["return_to_start"], row["solver"]
+
+    before = {key(r): r for r in baseline}
+    problems: list[str] = []
+    for row in current:
+        old = before.get(key(row))
+        if old is None:
+            continue
+        label = f"{row['solver']} on {row['instance']}"
+        if row["gap"] > old["gap"] + max_gap_increase:
+            problems.append(f"{label}: gap {old['gap']:.2%} -> {row['gap']:.2%}")
+        if row["runtime_ms"] > max(old["runtime_ms"], min_runtime_ms) * max_slowdown:
+            problems.append(f"{label}: runtime {old['runtime_ms']:.1f} ms -> {row['runtime_ms']:.1f} ms")
+    return problems
+
+
+def _summary(results: list[BenchResult]) -> str:
+    lines = [f"{'instance':<22} {'solver':<26} {'cost':>12} {'gap':>8} {'ms':>10} {'peak KiB':>10}"]
+    for r in results:
+        lines.append(
+            f"{r.instance:<22} {r.solver:<26} {r.cost:>12.2f} {r.gap:>8.2%} "
+            f"{r.runtime_ms:>10.2f} {r.peak_memory_bytes / 1024:>10.0f}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the route optimizer solvers.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    parser.add_argument("--families", nargs="+", choices=FAMILIES, default=list(FAMILIES))
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0])
+    parser.add_argument("--solvers", nargs="+", choices=sorted(SOLVERS), default=None)
+    parser.add_argument("--return-to-start", action="store_true")
+    parser.add_argument("--repeats", type=int, default=3, help="timed runs per solver (the fastest is reported)")
+    parser.add_argument("--time-budget-ms", type=float, default=None)
+    parser.add_argument("--catalog", type=Path, default=None, help="destinations.json (default: auto-detected)")
+    parser.add_argument("--best-known", type=Path, default=None, help="JSON of best costs per instance; updated")
+    parser.add_argument("--output", type=Path, default=None, help="results JSON (default: stdout)")
+    parser.add_argument("--compare", type=Path, default=None, help="earlier results JSON to check against")
+    parser.add_argument("--max-gap-increase", type=float, default=0.005)
+    parser.add_argument("--max-slowdown", type=float, default=1.5)
+    args = parser.parse_args(argv)
+
+    instances = make_instances(
+        tuple(args.sizes),
+        families=tuple(args.families),
+        seeds=tuple(args.seeds),
+        catalog=load_catalog_coords(args.catalog) if "catalog" in args.families else None,
+    )
+    best_known: dict[str, float] = {}
+    if args.best_known and args.best_known.exists():
+        best_known = json.loads(args.best_known.read_text(encoding="utf-8"))
+
+    results = run_benchmarks(
+        instances,
+        solvers=tuple(args.solvers) if args.solvers else None,
+        return_to_start=args.return_to_start,
+        repeats=args.repeats,
+        time_budget_ms=args.time_budget_ms,
+        best_known=best_known,
+    )
+    if args.best_known:
+        args.best_known.write_text(json.dumps(best_known, indent=2, sort_keys=True), encoding="utf-8")
+
+    document = {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "repeats": args.repeats,
+            "time_budget_ms": args.time_budget_ms,
+        },
+        "results": [asdict(r) for r in results],
+    }
+    text = json.dumps(document, indent=1)
+    if args.output:
+        args.output.write_text(text, encoding="utf-8")
+    else:
+        print(text)
+    print(_summary(results), file=sys.stderr)
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text(encoding="utf-8"))["results"]
+        problems = compare(
+            document["results"],
+            baseline,
+            max_gap_increase=args.max_gap_increase,
+            max_slowdown=args.max_slowdown,
+        )
+        for p in problems:
+            print(f"REGRESSION {p}", file=sys.stderr)
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,245 @@
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Sequence
+
+import numpy as np
+
+try:
+    from .google_matrix import fetch_distance_matrix
+    from .optimizer import build_distance_matrix_array
+except ImportError:  # pragma: no cover
+    from google_matrix import fetch_distance_matrix
+    from optimizer import build_distance_matrix_array
+
+logger = logging.getLogger(__name__)
+
+# Layers of the (layers, N, N) array, in file order. Road layers are only
+# present when the build fetched them.
+HAVERSINE_LAYER = "haversine_km"
+ROAD_LAYERS = ("distance_km", "duration_s", "duration_in_traffic_s")
+
+
+def resolve_destinations_json_path() -> Path:
+    """The catalog: DESTINATIONS_JSON_PATH, a file next to this module, or the
+    frontend dataset of a monorepo checkout."""
+    configured = (os.getenv("DESTINATIONS_JSON_PATH") or "").strip()
+    if configured and Path(configured).exists():
+        return Path(configured)
+
+    here = Path(__file__).resolve().parent
+    candidates = [here / "destinations.json", here / "data" / "destinations.json"]
+    for parent in here.parents:
+        candidates.append(parent / "frontend" / "src" / "dataset" / "destinations.json")
+    for candidate in candidates:
+        if candidate.exists():
+            return candidate
+    return Path("/app/destinations.json")
+
+
+def default_matrix_path() -> Path:
+    """CATALOG_MATRIX_PATH, or catalog_matrix.npy next to this module."""
+    configured = (os.getenv("CATALOG_MATRIX_PATH") or "").strip()
+    return Path(configured) if configured else Path(__file__).resolve().parent / "catalog_matrix.npy"
+
+
+def _index_path(matrix_path: Path) -> Path:
+    return matrix_path.with_suffix(".json")
+
+
+def _catalog_entry(raw: dict[str, Any]) -> dict[str, Any]:
+    """The fields `/optimize/catalog` needs to build an itinerary entry."""
+    crowd_info = raw.get("crowd_info") or {}
+    return {
+        "id": str(raw["id"]),
+        "name": str(raw.get("name") or raw["id"]),
+        "lat": float(raw["latitude"]),
+        "lng": float(raw["longitude"]),
+        "description": raw.get("description") or None,
+        "opening_hours": raw.get("opening_hours") or None,
+        "best_time_to_visit": crowd_info.get("best_time_to_visit") or None,
+    }
+
+
+@dataclass
+class CatalogMatrix:
+    """Pairwise matrices of the whole destination catalog.
+
+    Layers loaded from disk are read-only memory maps, so every worker
+    process on the host shares the same pages of the file.
+    """
+
+    ids: list[str]
+    index: dict[str, int]
+    destinations: list[dict[str, Any]]
+    layers: dict[str, np.ndarray]
+    # SHA-256 of the destinations.json the file was built from, if recorded.
+    source_sha256: str | None = None
+
+    def indices(self, ids: Sequence[str]) -> np.ndarray:
+        """Matrix rows of `ids`; raises KeyError listing every unknown id."""
+        missing = [i for i in ids if i not in self.index]
+        if missing:
+            raise KeyError(missing)
+        return np.fromiter((self.index[i] for i in ids), dtype=np.intp, count=len(ids))
+
+    def submatrix(self, layer: str, idx: np.ndarray) -> np.ndarray:
+        """`layer` restricted to `idx` (in that order), as a small in-memory copy."""
+        return np.array(self.layers[layer][np.ix_(idx, idx)], dtype=np.float64)
+
+    def has_road(self) -> bool:
+        return all(name in self.layers for name in ROAD_LAYERS)
+
+
+def build_catalog_matrix(
+    destinations: list[dict[str, Any]],
+    output: Path,
+    *,
+    road: dict[str, np.ndarray] | None = None,
+    source_sha256: str | None = None,
+) -> Path:
+    """Write the matrices of `destinations` (raw catalog entries) to `output`
+    (.npy, float64, shape (layers, N, N)) plus an index file next to it.
+
+    Files are written under temporary names and renamed into place, so
+    running workers keep their old mapping until they reload.
+    """
+    entries = [_catalog_entry(d) for d in destinations]
+    coords = [(e["lat"], e["lng"]) for e in entries]
+    names = [HAVERSINE_LAYER] + (list(ROAD_LAYERS) if road is not None else [])
+    n = len(entries)
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    tmp_matrix = output.with_name(output.stem + ".tmp.npy")
+    data = np.lib.format.open_memmap(tmp_matrix, mode="w+", dtype=np.float64, shape=(len(names), n, n))
+    data[0] = build_distance_matrix_array(coords)
+    for k, name in enumerate(names[1:], start=1):
+        data[k] = road[name]  # type: ignore[index]
+    data.flush()
+    del data
+
+    index = {
+        "version": 1,
+        "layers": names,
+        "ids": [e["id"] for e in entries],
+        "destinations": entries,
+        "source_sha256": source_sha256,
+    }
+    tmp_index = _index_path(output).with_suffix(".tmp.json")
+    tmp_index.write_text(json.dumps(index, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp_matrix, output)
+    os.replace(tmp_index, _index_path(output))
+    return output
+
+
+def open_catalog_matrix(path: Path) -> CatalogMatrix:
+    """Memory-map a file written by `build_catalog_matrix`."""
+    index = json.loads(_index_path(path).read_text(encoding="utf-8"))
+    data = np.load(path, mmap_mode="r")
+    ids = [str(i) for i in index["ids"]]
+    if data.shape[1:] != (len(ids), len(ids)):
+        raise ValueError(f"{path} does not match its index ({data.shape} for {len(ids)} ids)")
+    return CatalogMatrix(
+        ids=ids,
+        index={i: k for k, i in enumerate(ids)},
+        destinations=index["destinations"],
+        layers={name: data[k] for k, name in enumerate(index["layers"])},
+        source_sha256=index.get("source_sha256"),
+    )
+
+
+def _read_catalog(path: Path) -> tuple[list[dict[str, Any]], str]:
+    raw = path.read_bytes()
+    return json.loads(raw), hashlib.sha256(raw).hexdigest()
+
+
+def load_catalog_entries() -> list[dict[str, Any]] | None:
+    """Entries of the current destinations.json (see `_catalog_entry`), or
+    None if there is no catalog. Needs no matrix file."""
+    source = resolve_destinations_json_path()
+    if not source.exists():
+        return None
+    destinations, _ = _read_catalog(source)
+    return [_catalog_entry(d) for d in destinations]
+
+
+@lru_cache(maxsize=1)
+def get_catalog_matrix() -> CatalogMatrix | None:
+    """Process-wide catalog matrix.
+
+    Uses the prebuilt file when present. Otherwise the haversine layer is
+    computed in memory from the catalog once per process (logged, since
+    workers then no longer share it); None if there is no catalog at all,
+    or if the prebuilt file was built from another destinations.json than
+    the current one (its rows would not match the catalog ids).
+    """
+    path = default_matrix_path()
+    source = resolve_destinations_json_path()
+    if path.exists() and _index_path(path).exists():
+        catalog = open_catalog_matrix(path)
+        if catalog.source_sha256 is not None and source.exists():
+            _, digest = _read_catalog(source)
+            if digest != catalog.source_sha256:
+                logger.error(
+                    "Catalog matrix %s is stale: %s changed since it was built. Rebuild it with "
+                    "`python -m backend.routeOptimizer.catalog_matrix`.",
+                    path,
+                    source,
+                )
+                return None
+        return catalog
+
+    if not source.exists():
+        logger.error("No catalog matrix at %s and no destinations.json at %s", path, source)
+        return None
+    logger.warning(
+        "Catalog matrix %s not found; computing it in memory. Run `python -m backend.routeOptimizer.catalog_matrix` "
+        "to build it once for all workers.",
+        path,
+    )
+    entries = load_catalog_entries() or []
+    ids = [e["id"] for e in entries]
+    return CatalogMatrix(
+        ids=ids,
+        index={i: k for k, i in enumerate(ids)},
+        destinations=entries,
+        layers={HAVERSINE_LAYER: build_distance_matrix_array([(e["lat"], e["lng"]) for e in entries])},
+    )
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Precompute the destination catalog distance matrices.")
+    parser.add_argument("--source", type=Path, default=None, help="destinations.json (default: auto-detected)")
+    parser.add_argument("--output", type=Path, default=None, help="matrix file (default: CATALOG_MATRIX_PATH)")
+    parser.add_argument(
+        "--road",
+        action="store_true",
+        help="also store Google road distance/duration layers (uses the matrix cache, fetches missing pairs)",
+    )
+    args = parser.parse_args(argv)
+
+    source = args.source or resolve_destinations_json_path()
+    output = args.output or default_matrix_path()
+    destinations, digest = _read_catalog(source)
+
+    road = None
+    if args.road:
+        coords = [(float(d["latitude"]), float(d["longitude"])) for d in destinations]
+        road = fetch_distance_matrix(coords)
+        if road["failed"].any():
+            logger.warning("%d catalog pairs could not be fetched and are stored as unreachable", int(road["failed"].sum()))
+
+    build_catalog_matrix(destinations, output, road=road, source_sha256=digest)
+    print(f"Wrote {len(destinations)} destinations to {output}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
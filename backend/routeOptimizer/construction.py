@@ -0,0 +1,267 @@
+from __future__ import annotations
+
+from typing import Sequence
+
+import numpy as np
+
+try:
+    from .local_search import deadline_passed
+except ImportError:  # pragma: no cover
+    from local_search import deadline_passed
+
+# Construction heuristics selectable per request. Every one of them is followed
+# by local search, so cheaper seeds trade a little quality for speed at large N.
+CONSTRUCTIONS = ("nearest_neighbor", "greedy_edge", "christofides", "space_filling_curve")
+# Edges scanned between deadline checks in the greedy loops.
+_DEADLINE_CHECK_EVERY = 4096
+
+
+def nearest_neighbor_multistart(
+    cost: Sequence[Sequence[float]],
+    *,
+    starts: Sequence[int] | np.ndarray | None = None,
+    deadline: float | None = None,
+) -> np.ndarray | None:
+    """Run nearest-neighbour from every start node (or just `starts`) at once.
+
+    All walks advance in lockstep: each step gathers the current row of every
+    walk and takes a masked argmin, so the whole stage is N vectorized steps
+    instead of N^2 interpreted `min()` scans. Ties go to the lowest index, the
+    same as `optimizer.greedy_nearest_neighbor`.
+
+    Returns an array whose row `k` is the walk starting at `starts[k]`, or
+    None if `deadline` passed before the walks were complete.
+    """
+    c = np.asarray(cost, dtype=np.float64)
+    n = len(c)
+    starts = np.arange(n) if starts is None else np.asarray(starts, dtype=np.intp)
+    m = len(starts)
+    walks = np.empty((m, n), dtype=np.intp)
+    if n == 0 or m == 0:
+        return walks
+
+    lanes = np.arange(m)
+    visited = np.zeros((m, n), dtype=bool)
+    visited[lanes, starts] = True
+    walks[:, 0] = starts
+    current = starts
+    for step in range(1, n):
+        if deadline_passed(deadline):
+            return None
+        rows = np.where(visited, np.inf, c[current])
+        nxt = rows.argmin(axis=1)
+        # A row of all-inf costs would pick a visited node; fall back to the
+        # first unvisited one instead.
+        stuck = visited[lanes, nxt]
+        if stuck.any():
+            nxt[stuck] = (~visited[stuck]).argmax(axis=1)
+        visited[lanes, nxt] = True
+        walks[:, step] = nxt
+        current = nxt
+    return walks
+
+
+def walk_lengths(cost: Sequence[Sequence[float]], walks: np.ndarray) -> np.ndarray:
+    """Open-path length of every row in `walks`, summed sequentially."""
+    c = np.asarray(cost, dtype=np.float64)
+    if walks.shape[1] < 2:
+        return np.zeros(len(walks))
+    return np.cumsum(c[walks[:, :-1], walks[:, 1:]], axis=1)[:, -1]
+
+
+def greedy_edge(
+    cost: Sequence[Sequence[float]], *, start: int | None = None, deadline: float | None = None
+) -> list[int] | None:
+    """Greedy edge matching: take the cheapest directed edges that keep every
+    node at in/out-degree <= 1 and close no cycle, until one path remains.
+
+    With `start` set, no edge may enter that node, so the path begins there.
+    Returns None if `deadline` passes first.
+    """
+    c = np.asarray(cost, dtype=np.float64)
+    n = len(c)
+    if n <= 1:
+        return list(range(n))
+
+    succ = [-1] * n
+    has_pred = [False] * n
+    if start is not None:
+        has_pred[start] = True
+    root = list(range(n))
+
+    def find(x: int) -> int:
+        while root[x] != x:
+            root[x] = root[root[x]]
+            x = root[x]
+        return x
+
+    flat = c.copy()
+    np.fill_diagonal(flat, np.inf)
+    added = 0
+    ranked = np.argsort(flat, axis=None, kind="stable").tolist()
+    for k, e in enumerate(ranked):
+        if k % _DEADLINE_CHECK_EVERY == 0 and deadline_passed(deadline):
+            return None
+        i, j = divmod(e, n)
+        if i == j or succ[i] != -1 or has_pred[j]:
+            continue
+        ri = find(i)
+        rj = find(j)
+        if ri == rj:
+            continue
+        succ[i] = j
+        has_pred[j] = True
+        root[ri] = rj
+        added += 1
+        if added == n - 1:
+            break
+
+    head = has_pred.index(False) if start is None else start
+    order = [head]
+    while succ[order[-1]] != -1:
+        order.append(succ[order[-1]])
+    return order
+
+
+def _minimum_spanning_tree(sym: np.ndarray, deadline: float | None = None) -> list[tuple[int, int]] | None:
+    """Prim's algorithm on a dense symmetric matrix, O(N^2) with vector steps.
+    None if `deadline` passes first."""
+    n = len(sym)
+    in_tree = np.zeros(n, dtype=bool)
+    in_tree[0] = True
+    best = sym[0].copy()
+    link = np.zeros(n, dtype=np.intp)
+    edges: list[tuple[int, int]] = []
+    for _ in range(n - 1):
+        if deadline_passed(deadline):
+            return None
+        candidates = np.where(in_tree, np.inf, best)
+        v = int(candidates.argmin())
+        edges.append((int(link[v]), v))
+        in_tree[v] = True
+        closer = sym[v] < best
+        best = np.where(closer, sym[v], best)
+        link = np.where(closer, v, link)
+    return edges
+
+
+def christofides_like(
+    cost: Sequence[Sequence[float]], *, start: int = 0, deadline: float | None = None
+) -> list[int] | None:
+    """Christofides-style tour: MST + greedy matching of odd-degree nodes,
+    Euler circuit, then shortcut repeated nodes.
+
+    The exact minimum-weight matching is replaced by a greedy one, and
+    asymmetric matrices are symmetrized first, so there is no 1.5x guarantee;
+    it is a fast, structurally good seed for local search. Returns a cyclic
+    order beginning at `start`, or None if `deadline` passes first.
+    """
+    c = np.asarray(cost, dtype=np.float64)
+    n = len(c)
+    if n <= 2:
+        return list(range(start, n)) + list(range(start))
+    sym = (c + c.T) / 2.0
+
+    tree = _minimum_spanning_tree(sym, deadline)
+    if tree is None:
+        return None
+    adjacency: list[list[int]] = [[] for _ in range(n)]
+    for u, v in tree:
+        adjacency[u].append(v)
+        adjacency[v].append(u)
+
+    odd = np.array([v for v in range(n) if len(adjacency[v]) % 2 == 1], dtype=np.intp)
+    if len(odd):
+        pair_cost = sym[np.ix_(odd, odd)]
+        iu, ju = np.triu_indices(len(odd), k=1)
+        matched = np.zeros(len(odd), dtype=bool)
+        for k, p in enumerate(np.argsort(pair_cost[iu, ju], kind="stable").tolist()):
+            if k % _DEADLINE_CHECK_EVERY == 0 and deadline_passed(deadline):
+                return None
+            a = int(iu[p])
+            b = int(ju[p])
+            if matched[a] or matched[b]:
+                continue
+            matched[a] = matched[b] = True
+            adjacency[int(odd[a])].append(int(odd[b]))
+            adjacency[int(odd[b])].append(int(odd[a]))
+
+    # Hierholzer's algorithm; every node has even degree now.
+    remaining = [list(adj) for adj in adjacency]
+    stack = [start]
+    circuit: list[int] = []
+    while stack:
+        v = stack[-1]
+        if remaining[v]:
+            u = remaining[v].pop()
+            remaining[u].remove(v)
+            stack.append(u)
+        else:
+            circuit.append(stack.pop())
+
+    seen = [False] * n
+    order: list[int] = []
+    for v in reversed(circuit):
+        if not seen[v]:
+            seen[v] = True
+            order.append(v)
+    return order
+
+
+def hilbert_index(coords: Sequence[tuple[float, float]] | np.ndarray, *, bits: int = 16) -> np.ndarray:
+    """Position of each (lat, lng) along a Hilbert curve over their bounding box."""
+    pts = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    side = (1 << bits) - 1
+    lo = pts.min(axis=0)
+    span = np.maximum(pts.max(axis=0) - lo, 1e-12)
+    grid = np.rint((pts - lo) / span.max() * side).astype(np.int64)
+    x = grid[:, 1].copy()
+    y = grid[:, 0].copy()
+
+    d = np.zeros(len(pts), dtype=np.int64)
+    s = 1 << (bits - 1)
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        d += s * s * ((3 * rx) ^ ry)
+        # Rotate the quadrant so the curve stays continuous.
+        flip = ~ry
+        mirror = flip & rx
+        x = np.where(mirror, side - x, x)
+        y = np.where(mirror, side - y, y)
+        x, y = np.where(flip, y, x), np.where(flip, x, y)
+        s >>= 1
+    return d
+
+
+def space_filling_curve(coords: Sequence[tuple[float, float]] | np.ndarray) -> list[int]:
+    """Cyclic order of the stops along a Hilbert curve; O(N log N)."""
+    return np.argsort(hilbert_index(coords), kind="stable").tolist()
+
+
+def cycle_to_route(
+    cost: Sequence[Sequence[float]],
+    cycle: list[int],
+    *,
+    return_to_start: bool,
+    start: int | None,
+) -> list[int]:
+    """Turn a cyclic order into the requested route shape.
+
+    A pinned `start` rotates the cycle to begin there. Open paths with free
+    endpoints drop the most expensive edge of the cycle instead.
+    """
+    n = len(cycle)
+    if n <= 1:
+        return list(cycle)
+    if start is not None:
+        k = cycle.index(start)
+        return cycle[k:] + cycle[:k]
+    if return_to_start:
+        return list(cycle)
+
+    c = np.asarray(cost, dtype=np.float64)
+    idx = np.asarray(cycle, dtype=np.intp)
+    edge_costs = c[idx, np.roll(idx, -1)]
+    k = int(edge_costs.argmax()) + 1
+    return cycle[k:] + cycle[:k]
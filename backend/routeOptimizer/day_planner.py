@@ -0,0 +1,310 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, replace
+
+import numpy as np
+
+try:
+    from .local_search import two_opt
+except ImportError:  # pragma: no cover
+    from local_search import two_opt
+
+# Loads within this relative tolerance of the busiest day count as equal when
+# the second pass minimizes total cost.
+_LOAD_TOLERANCE = 1e-9
+
+
+@dataclass
+class DayPlan:
+    # Itinerary indices visited this day, in order.
+    stops: list[int]
+    # Index into the overnight bases the day starts from / ends at, if any.
+    start_base: int | None
+    end_base: int | None
+    # Matrix nodes driven from before the first stop / to after the last one
+    # (a base, the previous day's last stop, or the trip start on return).
+    start_node: int | None
+    end_node: int | None
+    # Driving of the day, including the legs to and from the bases.
+    distance_km: float
+    drive_s: float
+    # True if the day exceeds a daily limit (a single stop that cannot be
+    # reached within the limit still gets a day of its own).
+    over_limit: bool
+
+
+def _segment_matrix(
+    m: np.ndarray,
+    tour: np.ndarray,
+    night_nodes: np.ndarray | None,
+    *,
+    return_to_start: bool,
+) -> np.ndarray:
+    """`out[a, b]`: driving of a day that visits tour positions a..b.
+
+    Built from prefix sums along the tour, so every split is priced in O(1)
+    and the whole table in one vectorized O(n^2) step. Entries with a > b are
+    inf. Without bases, a day starts by driving from the previous day's last
+    stop; with bases, from the base of the previous night.
+    """
+    n = len(tour)
+    legs = m[tour[:-1], tour[1:]]
+    prefix = np.concatenate(([0.0], np.cumsum(legs)))
+
+    start = np.zeros(n)
+    end = np.zeros(n)
+    if n > 1:
+        if night_nodes is None:
+            start[1:] = legs
+        else:
+            start[1:] = m[night_nodes, tour[1:]]
+            end[:-1] = m[tour[:-1], night_nodes]
+    if return_to_start:
+        end[-1] = m[tour[-1], tour[0]]
+
+    out = start[:, None] + (prefix[None, :] - prefix[:, None]) + end[None, :]
+    out[np.tril_indices(n, k=-1)] = np.inf
+    return out
+
+
+def _split_layer(
+    prev: np.ndarray,
+    weight: np.ndarray,
+    *,
+    bottleneck: bool,
+) -> tuple[np.ndarray, np.ndarray]:
+    """One layer of the DP over the number of days.
+
+    `prev[j]` is the best value of splitting the first j tour positions into
+    k - 1 days; the result holds the same for k days, plus the start position
+    of the last day. Day weights combine as a maximum (`bottleneck`) or a sum;
+    disallowed days have weight inf.
+    """
+    n = len(weight)
+    cand = np.maximum(prev[:n, None], weight) if bottleneck else prev[:n, None] + weight
+    parent = cand.argmin(axis=0)
+    cur = np.full(n + 1, np.inf)
+    cur[1:] = cand[parent, np.arange(n)]
+    return cur, parent
+
+
+def _no_days(n: int) -> np.ndarray:
+    prev = np.full(n + 1, np.inf)
+    prev[0] = 0.0
+    return prev
+
+
+def _walk(m: np.ndarray, nodes: list[int]) -> float:
+    idx = np.asarray(nodes, dtype=np.intp)
+    return float(m[idx[:-1], idx[1:]].sum()) if len(idx) > 1 else 0.0
+
+
+def split_into_days(
+    tour: list[int],
+    *,
+    cost: np.ndarray,
+    distance_km: np.ndarray,
+    drive_s: np.ndarray,
+    n_bases: int = 0,
+    days: int | None = None,
+    max_drive_s: float | None = None,
+    max_distance_km: float | None = None,
+    return_to_start: bool = False,
+    visit_s: np.ndarray | None = None,
+) -> list[DayPlan]:
+    """Cut an optimized tour into days (route-first, cluster-second).
+
+    The matrices cover the itinerary followed by `n_bases` overnight bases.
+    Each night is spent at the base that adds the least detour between the
+    last stop of the day and the first stop of the next, or at the last stop
+    itself when there are no bases.
+
+    The tour is split optimally along its order: first the busiest day is made
+    as light as possible, then total cost is minimized among such splits. Both
+    are layered DPs over a table of all day costs, so nothing is re-solved per
+    day. With `days` the plan uses that many days when the limits allow it,
+    otherwise the fewest days that meet them. Each day is then repaired with
+    2-opt between its fixed endpoints.
+
+    `visit_s` (seconds spent at each node) is added to the daily driving
+    time when balancing days, but not when checking the driving limit.
+    """
+    n = len(tour)
+    if n == 0:
+        return []
+    t = np.asarray(tour, dtype=np.intp)
+    n_nodes = len(cost)
+    bases = np.arange(n_nodes - n_bases, n_nodes, dtype=np.intp)
+
+    night_nodes: np.ndarray | None = None
+    night_base = np.full(max(n - 1, 0), -1, dtype=np.intp)
+    if n_bases and n > 1:
+        detour = cost[t[:-1]][:, bases] + cost[bases][:, t[1:]].T
+        night_base = detour.argmin(axis=1)
+        night_nodes = bases[night_base]
+
+    seg_cost = _segment_matrix(cost, t, night_nodes, return_to_start=return_to_start)
+    seg_km = _segment_matrix(distance_km, t, night_nodes, return_to_start=return_to_start)
+    seg_drive = _segment_matrix(drive_s, t, night_nodes, return_to_start=return_to_start)
+
+    allowed = np.isfinite(seg_cost)
+    if max_drive_s is not None:
+        allowed &= seg_drive <= max_drive_s
+    if max_distance_km is not None:
+        allowed &= seg_km <= max_distance_km
+    # A single stop always fits in a day, even if it breaks the limits.
+    allowed[np.diag_indices(n)] = True
+
+    # Balance on what is limited: distance if only distance is capped,
+    # otherwise driving time.
+    if max_distance_km is not None and max_drive_s is None:
+        load = seg_km
+    elif visit_s is not None:
+        visits = np.concatenate(([0.0], np.cumsum(np.asarray(visit_s, dtype=np.float64)[t])))
+        load = seg_drive + (visits[None, 1:] - visits[:-1, None])
+    else:
+        load = seg_drive
+
+    target = min(days, n) if days is not None else None
+    # Busiest-day load of the best split into k days, for k = 1, 2, ...
+    busiest: list[float] = []
+    prev = _no_days(n)
+    bounded_load = np.where(allowed, load, np.inf)
+    while len(busiest) < n:
+        prev, _ = _split_layer(prev, bounded_load, bottleneck=True)
+        busiest.append(float(prev[-1]))
+        feasible = [k for k, v in enumerate(busiest, start=1) if np.isfinite(v)]
+        if feasible and (target is None or len(busiest) >= target):
+            break
+    at_most = [k for k in feasible if target is not None and k <= target]
+    k = at_most[-1] if at_most else feasible[0]
+
+    limit = busiest[k - 1] * (1 + _LOAD_TOLERANCE) + _LOAD_TOLERANCE
+    within = np.where(allowed & (load <= limit), seg_cost, np.inf)
+    parents: list[np.ndarray] = []
+    prev = _no_days(n)
+    for _ in range(k):
+        prev, parent = _split_layer(prev, within, bottleneck=False)
+        parents.append(parent)
+    cuts: list[tuple[int, int]] = []
+    j = n
+    for parent in reversed(parents):
+        a = int(parent[j - 1])
+        cuts.append((a, j - 1))
+        j = a
+    cuts.reverse()
+
+    plans: list[DayPlan] = []
+    for a, b in cuts:
+        start_base = int(night_base[a - 1]) if night_nodes is not None and a > 0 else None
+        end_base = int(night_base[b]) if night_nodes is not None and b < n - 1 else None
+        stops = t[a : b + 1].tolist()
+
+        head: list[int] = []
+        if start_base is not None:
+            head = [int(bases[start_base])]
+        elif a > 0:
+            head = [int(t[a - 1])]
+        tail: list[int] = []
+        if end_base is not None:
+            tail = [int(bases[end_base])]
+        elif b == n - 1 and return_to_start and n > 1:
+            tail = [int(t[0])]
+
+        stops = _repair_day(
+            stops,
+            head=head,
+            tail=tail,
+            # The last stop is where the next day starts when there is no
+            # base, so it must stay put.
+            pin_last=bool(tail) or (night_nodes is None and b < n - 1),
+            cost=cost,
+            distance_km=distance_km,
+            drive_s=drive_s,
+            max_drive_s=max_drive_s,
+            max_distance_km=max_distance_km,
+        )
+        plan = DayPlan(
+            stops=[],
+            start_base=start_base,
+            end_base=end_base,
+            start_node=head[0] if head else None,
+            end_node=tail[0] if tail else None,
+            distance_km=0.0,
+            drive_s=0.0,
+            over_limit=False,
+        )
+        plans.append(
+            with_stops(
+                plan,
+                stops,
+                distance_km=distance_km,
+                drive_s=drive_s,
+                max_drive_s=max_drive_s,
+                max_distance_km=max_distance_km,
+            )
+        )
+    return plans
+
+
+def with_stops(
+    plan: DayPlan,
+    stops: list[int],
+    *,
+    start_node: int | None = None,
+    distance_km: np.ndarray,
+    drive_s: np.ndarray,
+    max_drive_s: float | None = None,
+    max_distance_km: float | None = None,
+) -> DayPlan:
+    """Copy of `plan` visiting `stops`, with driving totals and the limit flag
+    recomputed. `start_node` overrides where the day starts from."""
+    start = start_node if start_node is not None else plan.start_node
+    nodes = ([start] if start is not None else []) + stops
+    if plan.end_node is not None:
+        nodes.append(plan.end_node)
+    km = _walk(distance_km, nodes)
+    drive = _walk(drive_s, nodes)
+    over = (max_drive_s is not None and drive > max_drive_s) or (
+        max_distance_km is not None and km > max_distance_km
+    )
+    return replace(plan, stops=stops, start_node=start, distance_km=km, drive_s=drive, over_limit=bool(over))
+
+
+def _repair_day(
+    stops: list[int],
+    *,
+    head: list[int],
+    tail: list[int],
+    pin_last: bool,
+    cost: np.ndarray,
+    distance_km: np.ndarray,
+    drive_s: np.ndarray,
+    max_drive_s: float | None,
+    max_distance_km: float | None,
+) -> list[int]:
+    """2-opt over one day with its first stop (or start node) and end fixed.
+
+    A free last stop is modelled with a zero-cost dummy end node. The repaired
+    order is kept only if it still meets the limits the original order met.
+    """
+    if len(stops) < 3:
+        return stops
+    nodes = head + stops + tail
+    idx = np.asarray(nodes, dtype=np.intp)
+    sub = cost[np.ix_(idx, idx)]
+    if not pin_last:
+        sub = np.pad(sub, ((0, 1), (0, 1)))
+    local = two_opt(sub, list(range(len(sub))))
+    local = [i for i in local if i < len(nodes)]
+    repaired = [nodes[i] for i in local[len(head) : len(head) + len(stops)]]
+
+    def within(order: list[int]) -> bool:
+        walk = head + order + tail
+        return (max_drive_s is None or _walk(drive_s, walk) <= max_drive_s) and (
+            max_distance_km is None or _walk(distance_km, walk) <= max_distance_km
+        )
+
+    if within(stops) and not within(repaired):
+        return stops
+    return repaired
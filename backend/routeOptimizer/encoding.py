@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import struct
+from typing import Any, Sequence
+
+import numpy as np
+
+try:
+    from .models import OptimizeResponse
+except ImportError:  # pragma: no cover
+    from models import OptimizeResponse
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+MATRIX_BLOB = "application/octet-stream"
+
+# Matrix blob header: magic, version, dtype (1 = float32 little-endian),
+# reserved, rows, columns. The row-major values follow directly.
+_BLOB_HEADER = struct.Struct("<4sBBHII")
+_BLOB_MAGIC = b"RMTX"
+_BLOB_VERSION = 1
+_BLOB_FLOAT32 = 1
+
+
+def negotiate(accept: str | None, offered: Sequence[str]) -> str:
+    """The media type in `offered` that the `Accept` header ranks highest.
+
+    Ties go to the earlier offered type, and so does a header that matches
+    nothing, so clients that do not ask get the first (JSON) encoding.
+    """
+    ranges: list[tuple[str, float]] = []
+    for part in (accept or "").split(","):
+        media, _, params = part.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if media:
+            ranges.append((media.strip().lower(), q))
+
+    def quality(media_type: str) -> float:
+        # The most specific matching range decides.
+        kind = media_type.split("/")[0]
+        for pattern in (media_type, f"{kind}/*", "*/*"):
+            matches = [q for r, q in ranges if r == pattern]
+            if matches:
+                return max(matches)
+        return 0.0
+
+    best, best_q = offered[0], 0.0
+    for media_type in offered:
+        q = quality(media_type)
+        if q > best_q:
+            best, best_q = media_type, q
+    return best
+
+
+def matrix_blob(matrix: np.ndarray) -> bytes:
+    """16-byte header + row-major float32 little-endian values."""
+    values = np.ascontiguousarray(matrix, dtype="<f4")
+    rows, cols = values.shape
+    return _BLOB_HEADER.pack(_BLOB_MAGIC, _BLOB_VERSION, _BLOB_FLOAT32, 0, rows, cols) + values.tobytes()
+
+
+def read_matrix_blob(data: bytes) -> np.ndarray:
+    """Inverse of `matrix_blob`."""
+    magic, version, dtype, _, rows, cols = _BLOB_HEADER.unpack_from(data)
+    if magic != _BLOB_MAGIC or version != _BLOB_VERSION or dtype != _BLOB_FLOAT32:
+        raise ValueError("not a version 1 float32 matrix blob")
+    return np.frombuffer(data, dtype="<f4", count=rows * cols, offset=_BLOB_HEADER.size).reshape(rows, cols)
+
+
+def compact_response(result: OptimizeResponse) -> dict[str, Any]:
+    """An `OptimizeResponse` without the repeated itinerary entries (clients
+    already have them; `optimized_order` indexes their itinerary) and with
+    segments as one array per field instead of one object per leg."""
+    data = result.model_dump(mode="json", exclude={"optimized_itinerary", "segments"})
+    fields = ("from_index", "to_index", "distance_km", "duration_seconds", "duration_in_traffic_seconds")
+    data["segments"] = {name: [getattr(s, name) for s in result.segments] for name in fields}
+    return data
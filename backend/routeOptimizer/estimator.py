@@ -0,0 +1,506 @@
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Iterable, Sequence
+
+import numpy as np
+
+try:
+    from .optimizer import build_distance_matrix_array
+except ImportError:  # pragma: no cover
+    from optimizer import build_distance_matrix_array
+
+logger = logging.getLogger(__name__)
+
+# Sri Lanka is UTC+05:30 all year; hours of day are local.
+LOCAL_UTC_OFFSET_S = 5.5 * 3600
+# Region buckets: grid cells of this many degrees (about 28 km), small
+# enough to separate the hill country from the coastal plain.
+DEFAULT_CELL_DEG = 0.25
+# Cells seen less often than this in training share the base coefficients.
+MIN_CELL_SAMPLES = 20
+# L2 penalty on the region and hour coefficients.
+DEFAULT_RIDGE = 1.0
+# Shortest straight-line distance the model is fitted/evaluated on (km);
+# shorter pairs are predicted as if they were this far apart.
+MIN_KM = 0.05
+# Fraction of origin/destination pairs held out for the accuracy report.
+HOLDOUT_FRACTION = 0.2
+
+# Baseline the report compares against: haversine with a fixed detour
+# factor at a fixed speed (the `average_speed_kmh` default).
+_BASELINE_DETOUR = 1.3
+_BASELINE_KMH = 40.0
+
+# Google's unreachable penalty (see google_matrix.UNREACHABLE); such pairs
+# are not observations.
+_UNREACHABLE_BELOW = 1e8
+
+FILE_VERSION = 1
+
+
+def default_model_path() -> Path:
+    """ESTIMATOR_MODEL_PATH, or estimator_model.json next to this module."""
+    configured = (os.getenv("ESTIMATOR_MODEL_PATH") or "").strip()
+    return Path(configured) if configured else Path(__file__).resolve().parent / "estimator_model.json"
+
+
+@dataclass
+class Observations:
+    """Past Distance Matrix elements, one row per origin/destination pair."""
+
+    origin: np.ndarray  # (m, 2) lat, lng
+    destination: np.ndarray  # (m, 2) lat, lng
+    departure_epoch: np.ndarray  # (m,) seconds
+    distance_km: np.ndarray
+    duration_s: np.ndarray
+    duration_in_traffic_s: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.distance_km)
+
+    def subset(self, mask: np.ndarray) -> Observations:
+        return Observations(*(getattr(self, f)[mask] for f in self.__dataclass_fields__))
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[tuple[float, ...]]) -> Observations:
+        """Rows of (o_lat, o_lng, d_lat, d_lng, epoch, km, s, traffic s);
+        unreachable and degenerate elements are dropped."""
+        data = np.array(list(rows), dtype=np.float64).reshape(-1, 8)
+        ok = (data[:, 5] > 0) & (data[:, 6] > 0) & (data[:, 7] > 0) & (data[:, 5:8] < _UNREACHABLE_BELOW).all(axis=1)
+        data = data[ok]
+        return cls(data[:, 0:2], data[:, 2:4], data[:, 4], data[:, 5], data[:, 6], data[:, 7])
+
+    @classmethod
+    def concat(cls, parts: Sequence[Observations]) -> Observations:
+        fields = list(cls.__dataclass_fields__)
+        return cls(*(np.concatenate([getattr(p, f) for p in parts]) for f in fields))
+
+
+_log_lock = threading.Lock()
+
+
+def observation_log_path() -> str | None:
+    """MATRIX_OBSERVATIONS_PATH, or None when fetched elements are not logged."""
+    return (os.getenv("MATRIX_OBSERVATIONS_PATH") or "").strip() or None
+
+
+def record_observations(rows: Sequence[tuple[float, ...]]) -> None:
+    """Append fetched elements, as (o_lat, o_lng, d_lat, d_lng, epoch, km,
+    s, traffic s) rows, to the observation log (JSON lines), the training
+    data for `refit`. Does nothing when the log is not configured."""
+    path = observation_log_path()
+    if not path or not rows:
+        return
+    lines = "".join(json.dumps([round(v, 6) for v in row]) + "\n" for row in rows)
+    try:
+        with _log_lock, open(path, "a", encoding="utf-8") as f:
+            f.write(lines)
+    except OSError:
+        logger.exception("Could not append matrix observations to %s", path)
+
+
+def load_observation_log(path: Path) -> Observations:
+    """Rows written by `record_observations`."""
+    with open(path, encoding="utf-8") as f:
+        return Observations.from_rows(json.loads(line) for line in f if line.strip())
+
+
+def load_sqlite_cache(path: Path, *, bucket_s: float | None = None) -> Observations:
+    """Every element of a SQLite matrix cache file, expired ones included.
+    Departure times are the start of each entry's cache bucket."""
+    if bucket_s is None:
+        bucket_s = float(os.getenv("MATRIX_CACHE_BUCKET_S", "900"))
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        cursor = conn.execute("SELECT key, distance_km, duration_s, duration_in_traffic_s FROM matrix_pairs")
+        rows = []
+        for key, km, s, traffic_s in cursor:
+            # mode|traffic_model|bucket|lat,lng|lat,lng (see PairMatrixCache.pair_key)
+            mode, _, bucket, origin, destination = key.split("|")
+            if mode != "driving":
+                continue
+            o_lat, o_lng = map(float, origin.split(","))
+            d_lat, d_lng = map(float, destination.split(","))
+            rows.append((o_lat, o_lng, d_lat, d_lng, int(bucket) * bucket_s, km, s, traffic_s))
+    finally:
+        conn.close()
+    return Observations.from_rows(rows)
+
+
+def _pairwise_km(origin: np.ndarray, destination: np.ndarray) -> np.ndarray:
+    lat1, lng1 = np.radians(origin[:, 0]), np.radians(origin[:, 1])
+    lat2, lng2 = np.radians(destination[:, 0]), np.radians(destination[:, 1])
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2.0 * 6371.0088 * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def local_hour(epoch: np.ndarray | float) -> np.ndarray:
+    return ((np.asarray(epoch, dtype=np.float64) + LOCAL_UTC_OFFSET_S) // 3600 % 24).astype(np.intp)
+
+
+@dataclass
+class _Target:
+    """log(target) = intercept + slope * log(km) + origin cell + destination cell + hour."""
+
+    intercept: float
+    slope: float
+    origin: np.ndarray  # per known cell
+    destination: np.ndarray
+    hour: np.ndarray  # (24,)
+
+    def to_json(self) -> dict[str, Any]:
+        return {
+            "intercept": self.intercept,
+            "slope": self.slope,
+            "origin": self.origin.tolist(),
+            "destination": self.destination.tolist(),
+            "hour": self.hour.tolist(),
+        }
+
+    @classmethod
+    def from_json(cls, raw: dict[str, Any]) -> _Target:
+        return cls(
+            float(raw["intercept"]),
+            float(raw["slope"]),
+            np.asarray(raw["origin"], dtype=np.float64),
+            np.asarray(raw["destination"], dtype=np.float64),
+            np.asarray(raw["hour"], dtype=np.float64),
+        )
+
+
+class TravelTimeEstimator:
+    """Predicts Distance Matrix results from straight-line distance, region
+    and time of day, with no outside call.
+
+    Three log-linear models are chained: road distance as a detour factor
+    over the haversine distance, free-flow duration as seconds per road km,
+    and traffic duration as a factor over free flow. Each has a term for the
+    origin's and the destination's grid cell (terrain: hill-country roads
+    wind more and are slower) and for the hour of day. A prediction is a few
+    vector operations over the whole matrix.
+    """
+
+    def __init__(
+        self,
+        *,
+        cell_deg: float,
+        cells: list[tuple[int, int]],
+        detour: _Target,
+        pace: _Target,
+        traffic: _Target,
+        samples: int = 0,
+        report: dict[str, Any] | None = None,
+    ) -> None:
+        self.cell_deg = cell_deg
+        self.cells = cells
+        self._cell_index = {cell: k for k, cell in enumerate(cells)}
+        self.detour = detour
+        self.pace = pace
+        self.traffic = traffic
+        self.samples = samples
+        self.report = report or {}
+
+    def cell_ids(self, points: np.ndarray) -> np.ndarray:
+        """Index of each point's cell in `cells`, or -1 for cells not fitted."""
+        grid = np.floor(np.asarray(points, dtype=np.float64).reshape(-1, 2) / self.cell_deg).astype(np.int64)
+        return np.fromiter(
+            (self._cell_index.get((int(a), int(b)), -1) for a, b in grid), dtype=np.intp, count=len(grid)
+        )
+
+    @staticmethod
+    def _cell_term(coefficients: np.ndarray, cells: np.ndarray) -> Any:
+        if not len(coefficients):
+            return 0.0
+        return np.where(cells >= 0, coefficients[cells], 0.0)
+
+    def _term(self, target: _Target, origin_cells: np.ndarray, destination_cells: np.ndarray, hour: np.ndarray) -> Any:
+        """Everything but the slope term of `target`."""
+        origin = self._cell_term(target.origin, origin_cells)
+        destination = self._cell_term(target.destination, destination_cells)
+        return target.intercept + origin + destination + target.hour[hour]
+
+    def predict(
+        self,
+        km: np.ndarray,
+        origin_cells: np.ndarray,
+        destination_cells: np.ndarray,
+        hour: np.ndarray | int,
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(distance_km, duration_s, duration_in_traffic_s) for straight-line
+        distances `km`; cells and hours broadcast against `km`."""
+        log_km = np.log(np.maximum(km, MIN_KM))
+        hour = np.asarray(hour)
+        cells = (origin_cells, destination_cells, hour)
+        distance = np.exp(log_km + self.detour.slope * log_km + self._term(self.detour, *cells))
+        log_road = np.log(np.maximum(distance, MIN_KM))
+        duration = distance * np.exp(self.pace.slope * log_road + self._term(self.pace, *cells))
+        traffic = duration * np.exp(self.traffic.slope * log_road + self._term(self.traffic, *cells))
+        return distance, duration, traffic
+
+    def predict_observations(self, obs: Observations) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        km = _pairwise_km(obs.origin, obs.destination)
+        hour = local_hour(obs.departure_epoch)
+        return self.predict(km, self.cell_ids(obs.origin), self.cell_ids(obs.destination), hour)
+
+    def matrix(
+        self, coords: Sequence[tuple[float, float]], *, departure_epoch: float | None = None
+    ) -> dict[str, np.ndarray]:
+        """Predicted matrices between `coords`, keyed like `fetch_distance_matrix`."""
+        points = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        km = build_distance_matrix_array(points)
+        cells = self.cell_ids(points)
+        hour = int(local_hour(time.time() if departure_epoch is None else departure_epoch))
+        distance, duration, traffic = self.predict(km, cells[:, None], cells[None, :], hour)
+        for m in (distance, duration, traffic):
+            np.fill_diagonal(m, 0.0)
+        return {
+            "distance_km": distance,
+            "duration_s": duration,
+            "duration_in_traffic_s": traffic,
+            "failed": np.zeros(km.shape, dtype=bool),
+        }
+
+    def to_json(self) -> dict[str, Any]:
+        return {
+            "version": FILE_VERSION,
+            "cell_deg": self.cell_deg,
+            "cells": [list(c) for c in self.cells],
+            "detour": self.detour.to_json(),
+            "pace": self.pace.to_json(),
+            "traffic": self.traffic.to_json(),
+            "samples": self.samples,
+            "report": self.report,
+        }
+
+    @classmethod
+    def from_json(cls, raw: dict[str, Any]) -> TravelTimeEstimator:
+        if raw.get("version") != FILE_VERSION:
+            raise ValueError(f"estimator model version {raw.get('version')}, expected {FILE_VERSION}; refit it")
+        return cls(
+            cell_deg=float(raw["cell_deg"]),
+            cells=[(int(a), int(b)) for a, b in raw["cells"]],
+            detour=_Target.from_json(raw["detour"]),
+            pace=_Target.from_json(raw["pace"]),
+            traffic=_Target.from_json(raw["traffic"]),
+            samples=int(raw.get("samples", 0)),
+            report=raw.get("report") or {},
+        )
+
+    def save(self, path: Path) -> Path:
+        tmp = path.with_name(path.stem + ".tmp.json")
+        tmp.write_text(json.dumps(self.to_json()), encoding="utf-8")
+        os.replace(tmp, path)
+        return path
+
+    @classmethod
+    def load(cls, path: Path) -> TravelTimeEstimator:
+        return cls.from_json(json.loads(path.read_text(encoding="utf-8")))
+
+
+def _ridge(
+    log_x: np.ndarray,
+    origin_cells: np.ndarray,
+    destination_cells: np.ndarray,
+    hour: np.ndarray,
+    y: np.ndarray,
+    n_cells: int,
+    ridge: float,
+) -> _Target:
+    """Least squares for one target; cell and hour terms are penalized, so
+    rare cells stay close to the base model."""
+    p = 2 + 2 * n_cells + 24
+    xtx = np.zeros((p, p))
+    xty = np.zeros(p)
+    # Accumulate the normal equations in chunks to bound memory.
+    for lo in range(0, len(y), 50_000):
+        hi = min(lo + 50_000, len(y))
+        x = np.zeros((hi - lo, p))
+        rows = np.arange(hi - lo)
+        x[:, 0] = 1.0
+        x[:, 1] = log_x[lo:hi]
+        o, d = origin_cells[lo:hi], destination_cells[lo:hi]
+        x[rows[o >= 0], 2 + o[o >= 0]] = 1.0
+        x[rows[d >= 0], 2 + n_cells + d[d >= 0]] = 1.0
+        x[rows, 2 + 2 * n_cells + hour[lo:hi]] = 1.0
+        xtx += x.T @ x
+        xty += x.T @ y[lo:hi]
+    penalty = np.full(p, ridge)
+    penalty[:2] = 0.0
+    coef = np.linalg.solve(xtx + np.diag(penalty) + 1e-9 * np.eye(p), xty)
+    return _Target(
+        intercept=float(coef[0]),
+        slope=float(coef[1]),
+        origin=coef[2 : 2 + n_cells],
+        destination=coef[2 + n_cells : 2 + 2 * n_cells],
+        hour=coef[2 + 2 * n_cells :],
+    )
+
+
+def fit(
+    obs: Observations,
+    *,
+    cell_deg: float = DEFAULT_CELL_DEG,
+    min_cell_samples: int = MIN_CELL_SAMPLES,
+    ridge: float = DEFAULT_RIDGE,
+) -> TravelTimeEstimator:
+    """Fit the three models of `TravelTimeEstimator` on `obs`."""
+    if len(obs) == 0:
+        raise ValueError("no observations to fit")
+    points = np.concatenate([obs.origin, obs.destination])
+    grid = np.floor(points / cell_deg).astype(np.int64)
+    unique, counts = np.unique(grid, axis=0, return_counts=True)
+    cells = [(int(a), int(b)) for (a, b), c in zip(unique, counts) if c >= min_cell_samples]
+    shell = TravelTimeEstimator(
+        cell_deg=cell_deg, cells=cells, detour=_empty(), pace=_empty(), traffic=_empty(), samples=len(obs)
+    )
+    o_cells, d_cells = shell.cell_ids(obs.origin), shell.cell_ids(obs.destination)
+    hour = local_hour(obs.departure_epoch)
+
+    log_km = np.log(np.maximum(_pairwise_km(obs.origin, obs.destination), MIN_KM))
+    log_road = np.log(np.maximum(obs.distance_km, MIN_KM))
+    args = (o_cells, d_cells, hour)
+    # Detour: log(road / straight) against log(straight).
+    shell.detour = _ridge(log_km, *args, log_road - log_km, len(cells), ridge)
+    # Pace: log(seconds per road km) against log(road km).
+    shell.pace = _ridge(log_road, *args, np.log(obs.duration_s) - log_road, len(cells), ridge)
+    # Traffic: log(traffic / free-flow) against log(road km).
+    shell.traffic = _ridge(log_road, *args, np.log(obs.duration_in_traffic_s / obs.duration_s), len(cells), ridge)
+    return shell
+
+
+def _empty() -> _Target:
+    return _Target(0.0, 0.0, np.zeros(0), np.zeros(0), np.zeros(24))
+
+
+def _errors(predicted: np.ndarray, actual: np.ndarray) -> dict[str, float]:
+    ape = np.abs(predicted - actual) / actual
+    return {
+        "mape": float(ape.mean()),
+        "median_ape": float(np.median(ape)),
+        "p90_ape": float(np.quantile(ape, 0.9)),
+        "bias": float(np.median(predicted / actual) - 1.0),
+    }
+
+
+def evaluate(model: TravelTimeEstimator, obs: Observations) -> dict[str, Any]:
+    """Absolute percentage errors of `model` on `obs`, next to the
+    haversine x 1.3 at 40 km/h baseline."""
+    distance, duration, traffic = model.predict_observations(obs)
+    base_km = _pairwise_km(obs.origin, obs.destination) * _BASELINE_DETOUR
+    base_s = base_km / _BASELINE_KMH * 3600.0
+    return {
+        "samples": len(obs),
+        "distance_km": _errors(distance, obs.distance_km),
+        "duration_s": _errors(duration, obs.duration_s),
+        "duration_in_traffic_s": _errors(traffic, obs.duration_in_traffic_s),
+        "baseline": {
+            "distance_km": _errors(base_km, obs.distance_km),
+            "duration_in_traffic_s": _errors(base_s, obs.duration_in_traffic_s),
+        },
+    }
+
+
+def holdout_mask(obs: Observations, fraction: float = HOLDOUT_FRACTION) -> np.ndarray:
+    """True for held-out rows. Split by pair (rounded to ~100 m), so every
+    observation of a held-out pair is unseen in training."""
+    keys = np.round(np.column_stack((obs.origin, obs.destination)), 3)
+    held = np.empty(len(obs), dtype=bool)
+    for k, row in enumerate(keys.tolist()):
+        digest = hashlib.blake2b(repr(row).encode(), digest_size=8).digest()
+        held[k] = int.from_bytes(digest, "big") / 2**64 < fraction
+    return held
+
+
+def refit(
+    obs: Observations,
+    *,
+    holdout: float = HOLDOUT_FRACTION,
+    cell_deg: float = DEFAULT_CELL_DEG,
+    ridge: float = DEFAULT_RIDGE,
+) -> TravelTimeEstimator:
+    """Fit on all but the held-out pairs, report accuracy on those, then fit
+    the served model on everything (the report describes the split model)."""
+    held = holdout_mask(obs, holdout) if holdout > 0 else np.zeros(len(obs), dtype=bool)
+    report: dict[str, Any] = {"fitted_at": int(time.time()), "holdout_fraction": holdout}
+    if held.any() and (~held).any():
+        split_model = fit(obs.subset(~held), cell_deg=cell_deg, ridge=ridge)
+        report["holdout"] = evaluate(split_model, obs.subset(held))
+    model = fit(obs, cell_deg=cell_deg, ridge=ridge)
+    model.report = report
+    return model
+
+
+@lru_cache(maxsize=1)
+def get_estimator() -> TravelTimeEstimator | None:
+    """Process-wide model loaded from `default_model_path()`, or None if it
+    has not been fitted."""
+    path = default_model_path()
+    if not path.exists():
+        logger.error(
+            "No travel-time model at %s; run `python -m backend.routeOptimizer.estimator refit` to fit it", path
+        )
+        return None
+    return TravelTimeEstimator.load(path)
+
+
+def _load_sources(logs: Sequence[Path], caches: Sequence[Path]) -> Observations:
+    parts = [load_observation_log(p) for p in logs] + [load_sqlite_cache(p) for p in caches]
+    if not parts:
+        raise SystemExit("give at least one --log or --sqlite source")
+    return Observations.concat(parts)
+
+
+def _format_report(report: dict[str, Any], what: str = "held-out observations") -> str:
+    lines = [f"{report['samples']} {what}"]
+    for name in ("distance_km", "duration_s", "duration_in_traffic_s"):
+        e = report[name]
+        lines.append(
+            f"  {name:<31} MAPE {e['mape']:6.1%}  median {e['median_ape']:6.1%}  p90 {e['p90_ape']:6.1%}"
+            f"  bias {e['bias']:+6.1%}"
+        )
+    for name, e in report["baseline"].items():
+        lines.append(f"  {'baseline ' + name:<31} MAPE {e['mape']:6.1%}  median {e['median_ape']:6.1%}")
+    return "\n".join(lines)
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Fit or evaluate the metric=estimated travel-time model.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name, help_text in (("refit", "fit a new model"), ("evaluate", "report a model's accuracy on data")):
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument("--log", type=Path, action="append", default=[], help="MATRIX_OBSERVATIONS_PATH file")
+        p.add_argument("--sqlite", type=Path, action="append", default=[], help="SQLite matrix cache file")
+        p.add_argument("--model", type=Path, default=None, help="model file (default: ESTIMATOR_MODEL_PATH)")
+    refit_parser = sub.choices["refit"]
+    refit_parser.add_argument("--holdout", type=float, default=HOLDOUT_FRACTION)
+    refit_parser.add_argument("--cell-deg", type=float, default=DEFAULT_CELL_DEG)
+    refit_parser.add_argument("--ridge", type=float, default=DEFAULT_RIDGE)
+    args = parser.parse_args(argv)
+
+    obs = _load_sources(args.log, args.sqlite)
+    path = args.model or default_model_path()
+    if args.command == "refit":
+        model = refit(obs, holdout=args.holdout, cell_deg=args.cell_deg, ridge=args.ridge)
+        model.save(path)
+        print(f"Fitted on {len(obs)} observations, {len(model.cells)} region cells; wrote {path}")
+        if "holdout" in model.report:
+            print(_format_report(model.report["holdout"]))
+    else:
+        print(_format_report(evaluate(TravelTimeEstimator.load(path), obs), "observations"))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
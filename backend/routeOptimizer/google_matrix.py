@@ -1,20 +1,56 @@
 from __future__ import annotations
 
+import asyncio
+import logging
+import math
 import os
+import time
 from typing import Any
 
 import httpx
+import numpy as np
+
+try:
+    from .estimator import observation_log_path, record_observations
+    from .matrix_cache import PairMatrixCache, PairValue, default_matrix_cache
+    from .metrics import GOOGLE_FAILURES, GOOGLE_REQUESTS
+except ImportError:  # pragma: no cover
+    from estimator import observation_log_path, record_observations
+    from matrix_cache import PairMatrixCache, PairValue, default_matrix_cache
+    from metrics import GOOGLE_FAILURES, GOOGLE_REQUESTS
+
+
+logger = logging.getLogger(__name__)
+
+DISTANCE_MATRIX_URL = "https://maps.googleapis.com/maps/api/distancematrix/json"
+
+# Google limits per server-side request.
+MAX_ORIGINS_PER_REQUEST = 25
+MAX_DESTINATIONS_PER_REQUEST = 25
+MAX_ELEMENTS_PER_REQUEST = 100
+
+# Penalty used for unreachable pairs and for tiles that could not be fetched.
+UNREACHABLE = 1e9
 
 
 class GoogleMatrixError(RuntimeError):
     pass
 
 
+class _RetryableMatrixError(GoogleMatrixError):
+    """Transient failure (network, 5xx/429, OVER_QUERY_LIMIT); the tile is retried."""
+
+
 def _format_latlng(lat: float, lng: float) -> str:
     return f"{lat},{lng}"
 
 
-def fetch_distance_matrix(
+def fetch_distance_matrix(coords: list[tuple[float, float]], **kwargs: Any) -> dict[str, np.ndarray]:
+    """Blocking wrapper around `fetch_distance_matrix_async` for sync callers."""
+    return asyncio.run(fetch_distance_matrix_async(coords, **kwargs))
+
+
+async def fetch_distance_matrix_async(
     coords: list[tuple[float, float]],
     *,
     api_key: str | None = None,
@@ -22,20 +58,38 @@ def fetch_distance_matrix(
     traffic_model: str = "best_guess",
     mode: str = "driving",
     timeout_s: float = 20.0,
-) -> dict[str, list[list[float]]]:
+    cache: PairMatrixCache | None = None,
+    use_cache: bool = True,
+    client: httpx.AsyncClient | None = None,
+    url: str | None = None,
+    max_concurrency: int = 8,
+    max_retries: int = 2,
+    retry_backoff_s: float = 0.5,
+) -> dict[str, np.ndarray]:
     """Fetch distance + duration matrices from Google Distance Matrix API.
 
     Returns:
       {
-        'distance_km': NxN (float),
-        'duration_s': NxN (float),
-        'duration_in_traffic_s': NxN (float)
+        'distance_km': NxN float64 array,
+        'duration_s': NxN float64 array,
+        'duration_in_traffic_s': NxN float64 array,
+        'failed': NxN bool array (pairs whose tile could not be fetched)
       }
 
     Notes:
     - API requires billing enabled.
     - duration_in_traffic is available for driving with departure_time.
     - Google may return asymmetric results; matrices here preserve direction.
+    - Elements are cached per origin/destination pair (see `matrix_cache`);
+      only pairs missing from `cache` (default: `default_matrix_cache()`) are
+      requested. Pass `use_cache=False` to always fetch the full grid.
+    - Requests are split into API-legal tiles (<= 25 origins, <= 25
+      destinations, <= 100 elements) and fetched concurrently, at most
+      `max_concurrency` at a time. Transient tile failures are retried with
+      exponential backoff; a tile that still fails is filled with the
+      unreachable penalty and marked in 'failed' instead of failing the whole
+      matrix. Configuration errors (e.g. REQUEST_DENIED), or every tile
+      failing, raise `GoogleMatrixError`.
     """
 
     if api_key is None:
@@ -52,19 +106,20 @@ def fetch_distance_matrix(
         )
 
     n = len(coords)
+    distance_km = np.zeros((n, n))
+    duration_s = np.zeros((n, n))
+    duration_in_traffic_s = np.zeros((n, n))
+    failed = np.zeros((n, n), dtype=bool)
+    result = {
+        "distance_km": distance_km,
+        "duration_s": duration_s,
+        "duration_in_traffic_s": duration_in_traffic_s,
+        "failed": failed,
+    }
     if n == 0:
-        return {
-            "distance_km": [],
-            "duration_s": [],
-            "duration_in_traffic_s": [],
-        }
-
-    origins = "|".join(_format_latlng(lat, lng) for lat, lng in coords)
-    destinations = origins
+        return result
 
     params = {
-        "origins": origins,
-        "destinations": destinations,
         "mode": mode,
         "units": "metric",
         "departure_time": departure_time,
@@ -72,16 +127,244 @@ def fetch_distance_matrix(
         "key": api_key,
     }
 
-    url = "https://maps.googleapis.com/maps/api/distancematrix/json"
+    if not use_cache:
+        cache = None
+    elif cache is None:
+        cache = default_matrix_cache()
+
+    keys: list[list[str]] = []
+    cached: dict[str, PairValue] = {}
+    if cache is not None:
+        bucket = cache.departure_bucket(departure_time)
+        keys = [
+            [
+                cache.pair_key(coords[i], coords[j], mode=mode, traffic_model=traffic_model, bucket=bucket)
+                for j in range(n)
+            ]
+            for i in range(n)
+        ]
+        # SQLite and Redis lookups block; run them on the default executor.
+        cached = await asyncio.get_running_loop().run_in_executor(
+            None, cache.get_many, [keys[i][j] for i in range(n) for j in range(n) if i != j]
+        )
+
+    # Missing destinations per origin. The diagonal is never needed.
+    missing: dict[int, list[int]] = {}
+    for i in range(n):
+        for j in range(n):
+            if i == j:
+                continue
+            hit = cached.get(keys[i][j]) if keys else None
+            if hit is None:
+                missing.setdefault(i, []).append(j)
+            else:
+                distance_km[i, j], duration_s[i, j], duration_in_traffic_s[i, j] = hit
+
+    if missing:
+        tiles = [
+            tile
+            for origin_idx, dest_idx in _group_missing_pairs(missing)
+            for tile in plan_tiles(origin_idx, dest_idx)
+        ]
+        owns_client = client is None
+        if client is None:
+            client = httpx.AsyncClient(timeout=timeout_s)
+        try:
+            blocks = await _fetch_tiles(
+                client,
+                url or DISTANCE_MATRIX_URL,
+                coords,
+                tiles,
+                params,
+                max_concurrency=max_concurrency,
+                max_retries=max_retries,
+                retry_backoff_s=retry_backoff_s,
+            )
+        finally:
+            if owns_client:
+                await client.aclose()
+
+        errors = [b for b in blocks if isinstance(b, Exception)]
+        if len(errors) == len(blocks):
+            raise GoogleMatrixError(f"Google Distance Matrix failed for every tile: {errors[-1]}")
+
+        fetched: dict[str, PairValue] = {}
+        # Training data for metric=estimated (see estimator.py), when enabled.
+        observed: list[tuple[float, ...]] = []
+        log_observations = observation_log_path() is not None
+        departure_epoch = time.time() if departure_time == "now" else float(departure_time)
+        for (origin_idx, dest_idx), block in zip(tiles, blocks):
+            rows = np.asarray(origin_idx)[:, None]
+            cols = np.asarray(dest_idx)[None, :]
+            if isinstance(block, Exception):
+                logger.warning(
+                    "Distance Matrix tile %dx%d failed, using unreachable penalty: %s",
+                    len(origin_idx),
+                    len(dest_idx),
+                    block,
+                )
+                distance_km[rows, cols] = UNREACHABLE
+                duration_s[rows, cols] = UNREACHABLE
+                duration_in_traffic_s[rows, cols] = UNREACHABLE
+                failed[rows, cols] = True
+                continue
+            distance_km[rows, cols] = block[0]
+            duration_s[rows, cols] = block[1]
+            duration_in_traffic_s[rows, cols] = block[2]
+            if keys:
+                for a, i in enumerate(origin_idx):
+                    for b, j in enumerate(dest_idx):
+                        if i != j:
+                            fetched[keys[i][j]] = (
+                                float(block[0][a, b]),
+                                float(block[1][a, b]),
+                                float(block[2][a, b]),
+                            )
+            if log_observations:
+                for a, i in enumerate(origin_idx):
+                    for b, j in enumerate(dest_idx):
+                        if i != j:
+                            observed.append(
+                                (
+                                    *coords[i],
+                                    *coords[j],
+                                    departure_epoch,
+                                    float(block[0][a, b]),
+                                    float(block[1][a, b]),
+                                    float(block[2][a, b]),
+                                )
+                            )
+        if cache is not None:
+            await asyncio.get_running_loop().run_in_executor(None, cache.set_many, fetched)
+        if observed:
+            # A file append; written on the default executor so neither the
+            # event loop nor this request waits for the disk.
+            asyncio.get_running_loop().run_in_executor(None, record_observations, observed)
+
+    np.fill_diagonal(distance_km, 0.0)
+    np.fill_diagonal(duration_s, 0.0)
+    np.fill_diagonal(duration_in_traffic_s, 0.0)
+    np.fill_diagonal(failed, False)
+    return result
 
-    with httpx.Client(timeout=timeout_s) as client:
-        resp = client.get(url, params=params)
-        resp.raise_for_status()
-        payload: dict[str, Any] = resp.json()
+
+def plan_tiles(origin_idx: list[int], dest_idx: list[int]) -> list[tuple[list[int], list[int]]]:
+    """Split an origins x destinations grid into API-legal blocks.
+
+    Picks the block shape (rows <= 25, cols <= 25, rows * cols <= 100) that
+    needs the fewest requests, e.g. 10x10 for a square 40-stop matrix and
+    4x25 for one origin row group against many destinations.
+    """
+    n_o = len(origin_idx)
+    n_d = len(dest_idx)
+    if n_o == 0 or n_d == 0:
+        return []
+
+    best: tuple[int, int, int] | None = None
+    for rows in range(1, min(MAX_ORIGINS_PER_REQUEST, n_o) + 1):
+        cols = min(MAX_DESTINATIONS_PER_REQUEST, n_d, MAX_ELEMENTS_PER_REQUEST // rows)
+        count = math.ceil(n_o / rows) * math.ceil(n_d / cols)
+        if best is None or count < best[0]:
+            best = (count, rows, cols)
+    assert best is not None
+    _, rows, cols = best
+
+    return [
+        (origin_idx[r : r + rows], dest_idx[c : c + cols])
+        for r in range(0, n_o, rows)
+        for c in range(0, n_d, cols)
+    ]
+
+
+def _group_missing_pairs(missing: dict[int, list[int]]) -> list[tuple[list[int], list[int]]]:
+    """Plan grid requests covering every missing (origin, destination) pair.
+
+    If one grid over all affected origins and destinations would only add
+    diagonal elements (e.g. a cold cache), send that. Otherwise group origins
+    that miss the same destinations, so no cached element is paid for twice:
+    adding a stop to a cached itinerary becomes two requests, the new origin
+    to every stop and every old origin to the new stop.
+    """
+    origins = sorted(missing)
+    dests = sorted({j for js in missing.values() for j in js})
+    n_missing = sum(len(js) for js in missing.values())
+    n_diagonal = len(set(origins) & set(dests))
+    if len(origins) * len(dests) - n_diagonal == n_missing:
+        return [(origins, dests)]
+
+    groups: dict[tuple[int, ...], list[int]] = {}
+    for origin, js in missing.items():
+        groups.setdefault(tuple(js), []).append(origin)
+    return [(group_origins, list(js)) for js, group_origins in groups.items()]
+
+
+async def _fetch_tiles(
+    client: httpx.AsyncClient,
+    url: str,
+    coords: list[tuple[float, float]],
+    tiles: list[tuple[list[int], list[int]]],
+    params: dict[str, str],
+    *,
+    max_concurrency: int,
+    max_retries: int,
+    retry_backoff_s: float,
+) -> list[tuple[np.ndarray, np.ndarray, np.ndarray] | Exception]:
+    """Fetch every tile concurrently; a failed tile yields its exception."""
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def fetch_one(origin_idx: list[int], dest_idx: list[int]):
+        origins = [coords[i] for i in origin_idx]
+        destinations = [coords[j] for j in dest_idx]
+        for attempt in range(max_retries + 1):
+            try:
+                async with semaphore:
+                    GOOGLE_REQUESTS.inc(api="distance_matrix")
+                    return await _request_tile(client, url, origins, destinations, params)
+            except _RetryableMatrixError as e:
+                GOOGLE_FAILURES.inc(api="distance_matrix", retryable="true")
+                if attempt == max_retries:
+                    return e
+                await asyncio.sleep(retry_backoff_s * (2**attempt))
+            except GoogleMatrixError:
+                GOOGLE_FAILURES.inc(api="distance_matrix", retryable="false")
+                raise
+
+    tasks = [fetch_one(origin_idx, dest_idx) for origin_idx, dest_idx in tiles]
+    # Non-retryable errors (bad key, invalid request) propagate and fail the call.
+    return list(await asyncio.gather(*tasks))
+
+
+async def _request_tile(
+    client: httpx.AsyncClient,
+    url: str,
+    origins: list[tuple[float, float]],
+    destinations: list[tuple[float, float]],
+    params: dict[str, str],
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """One Distance Matrix call; returns (distance_km, duration_s, duration_in_traffic_s)
+    arrays shaped (len(origins), len(destinations))."""
+
+    query = {
+        **params,
+        "origins": "|".join(_format_latlng(lat, lng) for lat, lng in origins),
+        "destinations": "|".join(_format_latlng(lat, lng) for lat, lng in destinations),
+    }
+
+    try:
+        resp = await client.get(url, params=query)
+    except httpx.TransportError as e:
+        raise _RetryableMatrixError(f"Google Distance Matrix request failed: {e}") from e
+    if resp.status_code == 429 or resp.status_code >= 500:
+        raise _RetryableMatrixError(f"Google Distance Matrix HTTP {resp.status_code}")
+    if resp.status_code >= 400:
+        raise GoogleMatrixError(f"Google Distance Matrix HTTP {resp.status_code}: {resp.text[:200]}")
+    payload: dict[str, Any] = resp.json()
 
     if payload.get("status") != "OK":
         status = payload.get("status")
         error_message = payload.get("error_message", "")
+        if status in ("OVER_QUERY_LIMIT", "UNKNOWN_ERROR"):
+            raise _RetryableMatrixError(f"Google Distance Matrix error: {status} {error_message}")
         if status == "REQUEST_DENIED" and "referer" in str(error_message).lower():
             raise GoogleMatrixError(
                 "Google Distance Matrix error: REQUEST_DENIED (referer restriction). "
@@ -90,38 +373,36 @@ def fetch_distance_matrix(
             )
         raise GoogleMatrixError(f"Google Distance Matrix error: {status} {error_message}")
 
+    n_rows = len(origins)
+    n_cols = len(destinations)
     rows = payload.get("rows", [])
-    if len(rows) != n:
+    if len(rows) != n_rows:
         raise GoogleMatrixError("Unexpected Distance Matrix response shape")
 
-    distance_km = [[0.0] * n for _ in range(n)]
-    duration_s = [[0.0] * n for _ in range(n)]
-    duration_in_traffic_s = [[0.0] * n for _ in range(n)]
+    distance_km = np.zeros((n_rows, n_cols))
+    duration_s = np.zeros((n_rows, n_cols))
+    duration_in_traffic_s = np.zeros((n_rows, n_cols))
 
-    for i in range(n):
+    for i in range(n_rows):
         elements = rows[i].get("elements", [])
-        if len(elements) != n:
+        if len(elements) != n_cols:
             raise GoogleMatrixError("Unexpected Distance Matrix response shape")
-        for j in range(n):
+        for j in range(n_cols):
             el = elements[j]
             status = el.get("status")
             if status != "OK":
                 # Keep large penalties for unreachable pairs
-                distance_km[i][j] = 1e9
-                duration_s[i][j] = 1e9
-                duration_in_traffic_s[i][j] = 1e9
+                distance_km[i, j] = UNREACHABLE
+                duration_s[i, j] = UNREACHABLE
+                duration_in_traffic_s[i, j] = UNREACHABLE
                 continue
 
             dist_m = float(el.get("distance", {}).get("value", 0.0))
             dur = float(el.get("duration", {}).get("value", 0.0))
             dur_traffic = float(el.get("duration_in_traffic", {}).get("value", dur))
 
-            distance_km[i][j] = dist_m / 1000.0
-            duration_s[i][j] = dur
-            duration_in_traffic_s[i][j] = dur_traffic
+            distance_km[i, j] = dist_m / 1000.0
+            duration_s[i, j] = dur
+            duration_in_traffic_s[i, j] = dur_traffic
 
-    return {
-        "distance_km": distance_km,
-        "duration_s": duration_s,
-        "duration_in_traffic_s": duration_in_traffic_s,
-    }
+    return distance_km, duration_s, duration_in_traffic_s
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import asyncio
 import os
 import re
 from datetime import datetime, timezone
@@ -8,6 +9,11 @@ from typing import Any
 
 import httpx
 
+try:
+    from .metrics import GOOGLE_FAILURES, GOOGLE_REQUESTS
+except ImportError:  # pragma: no cover
+    from metrics import GOOGLE_FAILURES, GOOGLE_REQUESTS
+
 
 class GoogleRoutesError(RuntimeError):
     pass
@@ -25,13 +31,19 @@ def _parse_duration_seconds(value: str | None) -> float | None:
     return float(m.group("secs"))
 
 
-def compute_traffic_route(
+def compute_traffic_route(**kwargs: Any) -> dict[str, Any]:
+    """Blocking wrapper around `compute_traffic_route_async` for sync callers."""
+    return asyncio.run(compute_traffic_route_async(**kwargs))
+
+
+async def compute_traffic_route_async(
     *,
     origin: tuple[float, float],
     destination: tuple[float, float],
     intermediates: list[tuple[float, float]] | None = None,
     travel_mode: str = "DRIVE",
     timeout_s: float = 20.0,
+    client: httpx.AsyncClient | None = None,
 ) -> dict[str, Any]:
     """Compute a traffic-aware route polyline with speed reading intervals.
 
@@ -41,6 +53,8 @@ def compute_traffic_route(
     Notes:
     - Requires billing and Routes API enabled.
     - Uses `GOOGLE_MAPS_API_KEY` from environment (server-side key).
+    - Pass the shared pooled `client` to reuse connections; without one a
+      short-lived client is opened for this call.
     """
 
     # Prefer a server-side key env var, but accept a few common aliases to
@@ -90,26 +104,36 @@ def compute_traffic_route(
 
     url = "https://routes.googleapis.com/directions/v2:computeRoutes"
 
-    with httpx.Client(timeout=timeout_s) as client:
-        resp = client.post(url, headers=headers, json=body)
-        if resp.status_code >= 400:
-            # Routes API errors are JSON, but keep a readable message.
-            try:
-                payload = resp.json()
-                message = payload.get("error", {}).get("message") or str(payload)
-            except Exception:
-                message = resp.text
-            # Common local-dev pitfall: using a browser-restricted key (HTTP referrers)
-            # for a server-side call. Server-side requests have no Referer header.
-            if resp.status_code == 403 and "referer <empty>" in message.lower():
-                raise GoogleRoutesError(
-                    "Google Routes error (403): requests from referer <empty> are blocked. "
-                    "This usually means your API key is restricted to HTTP referrers (browser key). "
-                    "For the backend, use a server key (Application restrictions: None or IP addresses), "
-                    "and restrict APIs to Routes API."
-                )
-            raise GoogleRoutesError(f"Google Routes error ({resp.status_code}): {message}")
-        payload = resp.json()
+    GOOGLE_REQUESTS.inc(api="routes")
+    try:
+        if client is None:
+            async with httpx.AsyncClient(timeout=timeout_s) as own_client:
+                resp = await own_client.post(url, headers=headers, json=body)
+        else:
+            resp = await client.post(url, headers=headers, json=body)
+    except httpx.TransportError:
+        GOOGLE_FAILURES.inc(api="routes", retryable="true")
+        raise
+
+    if resp.status_code >= 400:
+        GOOGLE_FAILURES.inc(api="routes", retryable=str(resp.status_code == 429 or resp.status_code >= 500).lower())
+        # Routes API errors are JSON, but keep a readable message.
+        try:
+            payload = resp.json()
+            message = payload.get("error", {}).get("message") or str(payload)
+        except Exception:
+            message = resp.text
+        # Common local-dev pitfall: using a browser-restricted key (HTTP referrers)
+        # for a server-side call. Server-side requests have no Referer header.
+        if resp.status_code == 403 and "referer <empty>" in message.lower():
+            raise GoogleRoutesError(
+                "Google Routes error (403): requests from referer <empty> are blocked. "
+                "This usually means your API key is restricted to HTTP referrers (browser key). "
+                "For the backend, use a server key (Application restrictions: None or IP addresses), "
+                "and restrict APIs to Routes API."
+            )
+        raise GoogleRoutesError(f"Google Routes error ({resp.status_code}): {message}")
+    payload = resp.json()
 
     routes = payload.get("routes") or []
     if not routes:
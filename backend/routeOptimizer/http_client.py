@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+import logging
+import os
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Process-wide client for Google APIs, opened and closed by the app lifespan.
+_google_client: httpx.AsyncClient | None = None
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # type: ignore  # noqa: F401
+    except Exception:
+        return False
+    return True
+
+
+def create_google_client() -> httpx.AsyncClient:
+    """Build the pooled client used for every Google call.
+
+    Configuration (environment):
+    - GOOGLE_HTTP_MAX_CONNECTIONS: pool size (default 20)
+    - GOOGLE_HTTP_MAX_KEEPALIVE: idle connections kept open (default 10)
+    - GOOGLE_HTTP_KEEPALIVE_EXPIRY_S: idle connection lifetime (default 30)
+    - GOOGLE_HTTP_TIMEOUT_S: per-request timeout (default 20)
+    - GOOGLE_HTTP2: set to 0 to disable HTTP/2 (needs the `h2` package)
+    """
+    limits = httpx.Limits(
+        max_connections=int(os.getenv("GOOGLE_HTTP_MAX_CONNECTIONS", "20")),
+        max_keepalive_connections=int(os.getenv("GOOGLE_HTTP_MAX_KEEPALIVE", "10")),
+        keepalive_expiry=float(os.getenv("GOOGLE_HTTP_KEEPALIVE_EXPIRY_S", "30")),
+    )
+    http2 = (os.getenv("GOOGLE_HTTP2") or "1").strip().lower() not in ("0", "false", "no")
+    if http2 and not _http2_available():
+        logger.warning("GOOGLE_HTTP2 is enabled but `h2` is not installed; using HTTP/1.1")
+        http2 = False
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=limits,
+        timeout=float(os.getenv("GOOGLE_HTTP_TIMEOUT_S", "20")),
+    )
+
+
+def get_google_client() -> httpx.AsyncClient | None:
+    """The shared client, or None outside the app lifespan (callers then open
+    a short-lived client of their own)."""
+    return _google_client
+
+
+async def open_google_client() -> httpx.AsyncClient:
+    global _google_client
+    if _google_client is None:
+        _google_client = create_google_client()
+    return _google_client
+
+
+async def close_google_client() -> None:
+    global _google_client
+    client = _google_client
+    _google_client = None
+    if client is not None:
+        await client.aclose()
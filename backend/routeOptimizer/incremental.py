@@ -0,0 +1,273 @@
+from __future__ import annotations
+
+import time
+from typing import Sequence
+
+import numpy as np
+
+try:
+    from .local_search import IMPROVEMENT_EPS, SearchStats, deadline_passed, two_opt
+    from .optimizer import SolveResult
+except ImportError:  # pragma: no cover
+    from local_search import IMPROVEMENT_EPS, SearchStats, deadline_passed, two_opt
+    from optimizer import SolveResult
+
+# Local search rounds (2-opt, then relocate) per repaired window.
+_MAX_REPAIR_ROUNDS = 10
+
+
+def remove_stops(order: Sequence[int], removed: Sequence[int], n: int) -> tuple[list[int], set[int]]:
+    """Drop `removed` (indices into an itinerary of `n` stops) from `order`.
+
+    Returns the order renumbered for the itinerary without those stops, and
+    the (renumbered) stops that became neighbours because of a removal.
+    """
+    gone = set(removed)
+    renumber = {}
+    for i in range(n):
+        if i not in gone:
+            renumber[i] = len(renumber)
+    kept: list[int] = []
+    touched: set[int] = set()
+    dropped_since_last = False
+    for v in order:
+        if v in gone:
+            dropped_since_last = True
+            continue
+        if dropped_since_last and kept:
+            touched.update((kept[-1], renumber[v]))
+        kept.append(renumber[v])
+        dropped_since_last = False
+    if dropped_since_last and kept:
+        touched.add(kept[-1])
+    if order and order[0] in gone and kept:
+        touched.add(kept[0])
+    return kept, touched
+
+
+def _insertion_costs(c: np.ndarray, tour: np.ndarray, v: int, *, return_to_start: bool, pin_start: bool) -> np.ndarray:
+    """Added cost of inserting `v` at each position 0..len(tour); inf where not allowed."""
+    m = len(tour)
+    out = np.full(m + 1, np.inf)
+    if m == 0:
+        out[0] = 0.0
+        return out
+    out[1:m] = c[tour[:-1], v] + c[v, tour[1:]] - c[tour[:-1], tour[1:]]
+    if return_to_start:
+        # Position 0 and the end are the same place on a cycle; use the end so
+        # the start stays put.
+        out[m] = c[tour[-1], v] + c[v, tour[0]] - (c[tour[-1], tour[0]] if m > 1 else 0.0)
+    else:
+        out[m] = c[tour[-1], v]
+        if not pin_start:
+            out[0] = c[v, tour[0]]
+    return out
+
+
+def cheapest_insertion(
+    cost: np.ndarray,
+    order: list[int],
+    nodes: Sequence[int],
+    *,
+    return_to_start: bool,
+    pin_start: bool,
+) -> list[int]:
+    """Insert `nodes` one at a time, always the (node, position) pair that adds
+    the least cost. Existing stops keep their relative order.
+
+    Every pending node keeps its cheapest slot, named by the stop it would
+    follow (-1: before the first stop). An insertion only replaces the slot
+    it used, by the slots on either side of the new stop, so pending nodes
+    are compared against those two and only the ones whose best slot was
+    used are rescanned: O(k*n + k^2) for k nodes instead of O(k^2 * n).
+    """
+    c = np.asarray(cost, dtype=np.float64)
+    tour = list(order)
+    pending = np.asarray(list(nodes), dtype=np.intp)
+    best_cost = np.empty(len(pending))
+    best_after = np.empty(len(pending), dtype=np.intp)
+    left = np.ones(len(pending), dtype=bool)
+
+    def rescan(ks: Sequence[int]) -> None:
+        t = np.asarray(tour, dtype=np.intp)
+        for k in ks:
+            costs = _insertion_costs(c, t, int(pending[k]), return_to_start=return_to_start, pin_start=pin_start)
+            p = int(costs.argmin())
+            best_cost[k] = costs[p]
+            best_after[k] = tour[p - 1] if p > 0 else -1
+
+    rescan(range(len(pending)))
+    for _ in range(len(pending)):
+        candidates = np.flatnonzero(left)
+        k = int(candidates[best_cost[candidates].argmin()])
+        v, a = int(pending[k]), int(best_after[k])
+        left[k] = False
+        p = tour.index(a) + 1 if a >= 0 else 0
+        # The stop after the new one; None at the end of an open path.
+        b = tour[p] if p < len(tour) else (tour[0] if return_to_start and tour else None)
+        was_empty = not tour
+        tour.insert(p, v)
+
+        rest = np.flatnonzero(left)
+        if was_empty:
+            rescan(rest.tolist())
+            continue
+        used = best_after[rest] == a
+        others = rest[~used]
+        u = pending[others]
+        # The used slot becomes a -> v (or the start, before v), then v -> b.
+        if a >= 0:
+            offers = [(c[a, u] + c[u, v] - c[a, v], a)]
+        elif not (pin_start or return_to_start):
+            offers = [(c[u, v], -1)]
+        else:
+            offers = []
+        offers.append((c[v, u] if b is None else c[v, u] + c[u, b] - c[v, b], v))
+        for added, after in offers:
+            better = added < best_cost[others]
+            best_cost[others[better]] = added[better]
+            best_after[others[better]] = after
+        rescan(rest[used].tolist())
+    return tour
+
+
+def _relocate(sub: np.ndarray, path: list[int], stats: SearchStats, deadline: float | None) -> bool:
+    """First-improvement single-stop relocation on `path`, whose first and last
+    entries stay put. Returns True if any move was applied."""
+    improved = False
+    i = 1
+    while i < len(path) - 1:
+        if deadline_passed(deadline):
+            stats.timed_out = True
+            return improved
+        p, v, s = path[i - 1], path[i], path[i + 1]
+        gain = sub[p, v] + sub[v, s] - sub[p, s]
+        rest = np.asarray(path[:i] + path[i + 1 :], dtype=np.intp)
+        # Re-inserting between rest[j] and rest[j + 1].
+        add = sub[rest[:-1], v] + sub[v, rest[1:]] - sub[rest[:-1], rest[1:]]
+        add[i - 1] = np.inf
+        j = int(add.argmin())
+        if add[j] - gain < -IMPROVEMENT_EPS:
+            path[:] = rest[: j + 1].tolist() + [v] + rest[j + 1 :].tolist()
+            stats.moves += 1
+            improved = True
+            continue
+        i += 1
+    return improved
+
+
+def repair_window(
+    cost: np.ndarray,
+    order: list[int],
+    lo: int,
+    hi: int,
+    *,
+    return_to_start: bool,
+    stats: SearchStats,
+    deadline: float | None = None,
+) -> list[int]:
+    """Local search over positions lo..hi of `order`; everything else, and the
+    stops just outside the window, stays where it is.
+
+    A window that reaches a free end of an open path gets a zero-cost dummy
+    end, so the stops at that end may change too.
+    """
+    n = len(order)
+    window = order[lo : hi + 1]
+    if len(window) < 2:
+        return order
+    nodes: list[int] = []
+    dummy_left = dummy_right = False
+    if lo > 0:
+        nodes.append(order[lo - 1])
+    else:
+        dummy_left = True
+    nodes += window
+    if hi < n - 1:
+        nodes.append(order[hi + 1])
+    elif return_to_start:
+        nodes.append(order[0])
+    else:
+        dummy_right = True
+
+    idx = np.asarray(nodes, dtype=np.intp)
+    sub = np.asarray(cost, dtype=np.float64)[np.ix_(idx, idx)]
+    # Dummy ends cost nothing to reach, so a free end can be anything.
+    pad = int(dummy_left) + int(dummy_right)
+    sub = np.pad(sub, ((0, pad), (0, pad)))
+    local = list(range(len(nodes)))
+    if dummy_left:
+        local = [len(nodes)] + local
+    if dummy_right:
+        local.append(len(nodes) + int(dummy_left))
+
+    for _ in range(_MAX_REPAIR_ROUNDS):
+        before = stats.moves
+        local = two_opt(sub, local, deadline=deadline, stats=stats)
+        _relocate(sub, local, stats, deadline)
+        if stats.moves == before or stats.timed_out:
+            break
+
+    repaired = [nodes[i] for i in local[1:-1]]
+    return order[:lo] + repaired + order[hi + 1 :]
+
+
+def _windows(positions: Sequence[int], radius: int, n: int, first: int) -> list[tuple[int, int]]:
+    """Merged [lo, hi] position ranges within `radius` of `positions`."""
+    spans: list[tuple[int, int]] = []
+    for p in sorted(positions):
+        lo, hi = max(p - radius, first), min(p + radius, n - 1)
+        if lo > hi:
+            continue
+        if spans and lo <= spans[-1][1] + 1:
+            spans[-1] = (spans[-1][0], max(spans[-1][1], hi))
+        else:
+            spans.append((lo, hi))
+    return spans
+
+
+def reoptimize(
+    cost: np.ndarray,
+    *,
+    order: list[int],
+    inserted: Sequence[int],
+    touched: Sequence[int] = (),
+    return_to_start: bool,
+    pin_start: bool,
+    radius: int = 3,
+    time_budget_ms: float | None = None,
+) -> SolveResult:
+    """Update an optimized `order` after an edit instead of solving again.
+
+    `order` visits the stops that were kept; `inserted` are the new stops and
+    `touched` the kept stops whose neighbours changed (see `remove_stops`).
+    New stops go in by cheapest insertion, then local search (2-opt and
+    single-stop relocation) runs only within `radius` positions of each
+    edit, so the rest of the route is left exactly as it was.
+    """
+    started = time.perf_counter()
+    deadline = started + time_budget_ms / 1000.0 if time_budget_ms is not None else None
+    tour = cheapest_insertion(cost, order, inserted, return_to_start=return_to_start, pin_start=pin_start)
+    inserted_at = time.perf_counter()
+
+    stats = SearchStats()
+    where = {v: p for p, v in enumerate(tour)}
+    edits = [where[v] for v in set(inserted) | set(touched) if v in where]
+    # The first stop of a pinned path or a cycle never moves.
+    first = 1 if pin_start or return_to_start else 0
+    for lo, hi in _windows(edits, radius, len(tour), first):
+        if deadline_passed(deadline):
+            stats.timed_out = True
+            break
+        tour = repair_window(cost, tour, lo, hi, return_to_start=return_to_start, stats=stats, deadline=deadline)
+
+    finished = time.perf_counter()
+    return SolveResult(
+        order=tour,
+        solver="incremental",
+        optimal=False,
+        elapsed_ms=(finished - started) * 1000.0,
+        iterations=stats.moves,
+        timed_out=stats.timed_out,
+        stages={"insert": (inserted_at - started) * 1000.0, "local_search": (finished - inserted_at) * 1000.0},
+    )
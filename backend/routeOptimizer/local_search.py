@@ -0,0 +1,451 @@
+from __future__ import annotations
+
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Sequence
+
+import numpy as np
+
+# Moves must improve the tour by more than this to be applied. Matches the
+# tolerance the original full-recompute 2-opt used, so results are identical.
+IMPROVEMENT_EPS = 1e-12
+
+
+@dataclass
+class SearchStats:
+    """Counters filled in by local search when a `stats` object is passed."""
+
+    # Improving moves applied.
+    moves: int = 0
+    # True if the search stopped at its deadline rather than a local optimum.
+    timed_out: bool = False
+
+
+def deadline_passed(deadline: float | None) -> bool:
+    """`deadline` is a `time.perf_counter()` timestamp, or None for no limit."""
+    return deadline is not None and time.perf_counter() >= deadline
+
+
+def is_symmetric(cost: Sequence[Sequence[float]]) -> bool:
+    if isinstance(cost, np.ndarray):
+        return bool(np.array_equal(cost, cost.T))
+    n = len(cost)
+    for i in range(n):
+        row = cost[i]
+        for j in range(i + 1, n):
+            if row[j] != cost[j][i]:
+                return False
+    return True
+
+
+def _segment_prefix_sums(cost: Sequence[Sequence[float]], order: list[int]) -> tuple[list[float], list[float]]:
+    """Prefix sums of edge costs along `order`, walked forwards and backwards.
+
+    `fwd[j]` is the cost of travelling order[0] -> ... -> order[j];
+    `bwd[j]` is the cost of the same edges traversed in reverse direction.
+    The cost of a reversed segment [a, b] is then `bwd[b] - bwd[a]`.
+    """
+    n = len(order)
+    fwd = [0.0] * n
+    bwd = [0.0] * n
+    for t in range(1, n):
+        u = order[t - 1]
+        v = order[t]
+        fwd[t] = fwd[t - 1] + cost[u][v]
+        bwd[t] = bwd[t - 1] + cost[v][u]
+    return fwd, bwd
+
+
+def two_opt(
+    cost: Sequence[Sequence[float]],
+    order: list[int],
+    *,
+    symmetric: bool | None = None,
+    deadline: float | None = None,
+    stats: SearchStats | None = None,
+) -> list[int]:
+    """Delta-evaluated 2-opt local search.
+
+    A move reverses positions [a, b] of the tour. Only the two boundary edges
+    change for symmetric matrices, so each move is scored in O(1). For
+    asymmetric matrices the reversed segment is also re-priced, which is O(1)
+    too using prefix sums that are refreshed only after an applied move.
+
+    The scan order and acceptance rule match the original implementation
+    (first improvement, keep scanning with the updated tour), so small inputs
+    produce exactly the same tours. Moves are applied in place on a copy of
+    `order`.
+
+    Reversals never touch the first or last position, so the same move set
+    serves open paths and closed tours (the closing edge is never changed).
+
+    The tour is valid after every move, so when `deadline` passes the search
+    stops and returns the best tour so far.
+    """
+    n = len(order)
+    if n < 4:
+        return order
+
+    if symmetric is None:
+        symmetric = is_symmetric(cost)
+    if stats is None:
+        stats = SearchStats()
+    if isinstance(cost, np.ndarray):
+        return _two_opt_array(cost, order, symmetric=symmetric, deadline=deadline, stats=stats)
+
+    tour = list(order)
+    fwd: list[float] = []
+    bwd: list[float] = []
+    if not symmetric:
+        fwd, bwd = _segment_prefix_sums(cost, tour)
+
+    improved = True
+    while improved:
+        improved = False
+        for a in range(1, n - 2):
+            if deadline_passed(deadline):
+                stats.timed_out = True
+                return tour
+            for b in range(a + 1, n - 1):
+                p = tour[a - 1]
+                s = tour[a]
+                e = tour[b]
+                q = tour[b + 1]
+                delta = cost[p][e] + cost[s][q] - cost[p][s] - cost[e][q]
+                if not symmetric:
+                    delta += (bwd[b] - bwd[a]) - (fwd[b] - fwd[a])
+                if delta < -IMPROVEMENT_EPS:
+                    tour[a : b + 1] = tour[a : b + 1][::-1]
+                    improved = True
+                    stats.moves += 1
+                    if not symmetric:
+                        fwd, bwd = _segment_prefix_sums(cost, tour)
+    return tour
+
+
+def _array_prefix_sums(cost: np.ndarray, tour: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    fwd = np.zeros(len(tour))
+    bwd = np.zeros(len(tour))
+    # cumsum is sequential, so these match `_segment_prefix_sums` exactly.
+    np.cumsum(cost[tour[:-1], tour[1:]], out=fwd[1:])
+    np.cumsum(cost[tour[1:], tour[:-1]], out=bwd[1:])
+    return fwd, bwd
+
+
+def _two_opt_array(
+    cost: np.ndarray,
+    order: list[int],
+    *,
+    symmetric: bool,
+    deadline: float | None,
+    stats: SearchStats,
+) -> list[int]:
+    """`two_opt` for NumPy matrices: all moves sharing a start position are
+    scored in one vector operation.
+
+    After a move is applied the scan resumes right after it, so the sequence
+    of applied moves is the same as the scalar loop.
+    """
+    c = np.asarray(cost, dtype=np.float64)
+    n = len(order)
+    tour = np.asarray(order, dtype=np.intp).copy()
+    fwd = bwd = np.empty(0)
+    if not symmetric:
+        fwd, bwd = _array_prefix_sums(c, tour)
+
+    improved = True
+    while improved:
+        improved = False
+        for a in range(1, n - 2):
+            if deadline_passed(deadline):
+                stats.timed_out = True
+                return tour.tolist()
+            b = a + 1
+            while b < n - 1:
+                p = tour[a - 1]
+                s = tour[a]
+                e = tour[b : n - 1]
+                q = tour[b + 1 : n]
+                delta = c[p, e] + c[s, q] - c[p, s] - c[e, q]
+                if not symmetric:
+                    delta += (bwd[b : n - 1] - bwd[a]) - (fwd[b : n - 1] - fwd[a])
+                hits = np.flatnonzero(delta < -IMPROVEMENT_EPS)
+                if hits.size == 0:
+                    break
+                b += int(hits[0])
+                tour[a : b + 1] = tour[a : b + 1][::-1].copy()
+                improved = True
+                stats.moves += 1
+                if not symmetric:
+                    fwd, bwd = _array_prefix_sums(c, tour)
+                b += 1
+    return tour.tolist()
+
+
+# Local search engines selectable per request: plain 2-opt, or the
+# neighbour-list engine with Or-opt moves, optionally with LK-style chains.
+IMPROVEMENTS = ("2opt", "or_opt", "lk")
+
+# Nearest candidates kept per stop for neighbour-list moves.
+DEFAULT_NEIGHBORS = 8
+# Longest run of consecutive stops an Or-opt move relocates.
+OR_OPT_MAX_SEGMENT = 3
+# Most 2-opt steps chained into one LK-style move.
+LK_MAX_DEPTH = 5
+
+
+def neighbor_lists(cost: np.ndarray, k: int = DEFAULT_NEIGHBORS) -> np.ndarray:
+    """The `k` closest other stops of every stop, nearest first.
+
+    Closeness is the cheaper of the two directions, so asymmetric matrices
+    get one list that serves both incoming and outgoing edges.
+    """
+    c = np.asarray(cost, dtype=np.float64)
+    n = len(c)
+    k = min(k, n - 1)
+    if k <= 0:
+        return np.empty((n, 0), dtype=np.intp)
+    near = np.minimum(c, c.T)
+    np.fill_diagonal(near, np.inf)
+    idx = np.argpartition(near, k - 1, axis=1)[:, :k]
+    by_cost = np.argsort(np.take_along_axis(near, idx, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(idx, by_cost, axis=1)
+
+
+class _Route:
+    """Tour with a position index. The first and last positions never move,
+    as in `two_opt`, so open paths and closed tours share the move set."""
+
+    def __init__(self, cost: np.ndarray, order: list[int], symmetric: bool) -> None:
+        self.d = cost.item
+        self.cost = cost
+        self.symmetric = symmetric
+        self.tour = list(order)
+        self.n = len(order)
+        self.pos = [0] * len(cost)
+        for p, v in enumerate(self.tour):
+            self.pos[v] = p
+        self.fwd: list[float] = []
+        self.bwd: list[float] = []
+        self._refresh(0, self.n - 1)
+
+    def _refresh(self, lo: int, hi: int) -> None:
+        for p in range(lo, hi + 1):
+            self.pos[self.tour[p]] = p
+        if not self.symmetric:
+            fwd, bwd = _array_prefix_sums(self.cost, np.asarray(self.tour, dtype=np.intp))
+            self.fwd, self.bwd = fwd.tolist(), bwd.tolist()
+
+    def reversal_extra(self, a: int, b: int) -> float:
+        """Change in the internal cost of positions a..b when they are reversed."""
+        if self.symmetric:
+            return 0.0
+        return (self.bwd[b] - self.bwd[a]) - (self.fwd[b] - self.fwd[a])
+
+    def reverse_delta(self, a: int, b: int) -> float:
+        t, d = self.tour, self.d
+        p, s, e, q = t[a - 1], t[a], t[b], t[b + 1]
+        return d(p, e) + d(s, q) - d(p, s) - d(e, q) + self.reversal_extra(a, b)
+
+    def reverse(self, a: int, b: int) -> None:
+        self.tour[a : b + 1] = self.tour[a : b + 1][::-1]
+        self._refresh(a, b)
+
+    def move_segment(self, s: int, e: int, j: int, reverse: bool) -> None:
+        """Move positions s..e between positions j and j + 1 (j outside s-1..e)."""
+        t = self.tour
+        seg = t[s : e + 1][::-1] if reverse else t[s : e + 1]
+        if j < s:
+            t[j + 1 : e + 1] = seg + t[j + 1 : s]
+            self._refresh(j + 1, e)
+        else:
+            t[s : j + 1] = t[e + 1 : j + 1] + seg
+            self._refresh(s, j)
+
+
+def _best_two_opt(r: _Route, v: int, near: list[int]) -> tuple[float, int, int]:
+    """Best reversal [a, b] that adds an edge between `v` and one of `near`."""
+    t, pos, d, last = r.tour, r.pos, r.d, r.n - 2
+    i = pos[v]
+    best = (-IMPROVEMENT_EPS, 0, 0)
+    for w in near:
+        j = pos[w]
+        # (a, b, added edge cost, removed edge cost) for each role v can take.
+        moves = []
+        if i + 1 < j <= last:  # v before the segment, w its last stop
+            moves.append((i + 1, j, d(v, w), d(v, t[i + 1])))
+        if 1 <= i < j - 1:  # v first in the segment, w after it
+            moves.append((i, j - 1, d(v, w), d(t[i - 1], v)))
+        if 1 <= j + 1 < i <= last:  # v last in the segment, w before it
+            moves.append((j + 1, i, d(w, v), d(v, t[i + 1])))
+        if 1 <= j < i - 1:  # v after the segment, w its first stop
+            moves.append((j, i - 1, d(w, v), d(t[i - 1], v)))
+        for a, b, added, removed in moves:
+            if added >= removed:
+                continue
+            delta = r.reverse_delta(a, b)
+            if delta < best[0]:
+                best = (delta, a, b)
+    return best
+
+
+def _best_or_opt(r: _Route, v: int, neighbors: np.ndarray) -> tuple[float, int, int, int, bool]:
+    """Best relocation of a run of up to OR_OPT_MAX_SEGMENT stops that starts
+    or ends at `v`, inserted (either way round) next to a neighbour of its
+    first or last stop."""
+    t, pos, d, n = r.tour, r.pos, r.d, r.n
+    i = pos[v]
+    best = (-IMPROVEMENT_EPS, 0, 0, 0, False)
+    spans = {(i, i + length - 1) for length in range(1, OR_OPT_MAX_SEGMENT + 1)}
+    spans |= {(i - length + 1, i) for length in range(1, OR_OPT_MAX_SEGMENT + 1)}
+    for s, e in spans:
+        if s < 1 or e > n - 2:
+            continue
+        p, h, tail, q = t[s - 1], t[s], t[e], t[e + 1]
+        removed = d(p, h) + d(tail, q) - d(p, q)
+        if removed <= IMPROVEMENT_EPS:
+            continue
+        flip = r.reversal_extra(s, e)
+        for u in {h, tail}:
+            for w in neighbors[u].tolist():
+                # Only edges cheaper than what the removal saves can pay off.
+                if min(d(u, w), d(w, u)) >= removed:
+                    break
+                for j in (pos[w] - 1, pos[w]):
+                    if j < 0 or j > n - 2 or s - 1 <= j <= e:
+                        continue
+                    x, y = t[j], t[j + 1]
+                    gap = d(x, y)
+                    forward = d(x, h) + d(tail, y) - gap - removed
+                    if forward < best[0]:
+                        best = (forward, s, e, j, False)
+                    backward = d(x, tail) + d(h, y) - gap + flip - removed
+                    if backward < best[0]:
+                        best = (backward, s, e, j, True)
+    return best
+
+
+def _lk_chain(r: _Route, t1: int, neighbors: np.ndarray) -> list[int]:
+    """LK-style variable-depth move from `t1`: break the edge to its successor
+    and keep re-linking the loose end to its most promising neighbour (one
+    2-opt step each) while the gain criterion holds. The best prefix of the
+    chain is kept; the rest is undone. Returns the stops whose edges changed,
+    or [] if no prefix improved the tour."""
+    t, pos, d = r.tour, r.pos, r.d
+    i = pos[t1]
+    if i > r.n - 4:
+        return []
+    gain = d(t1, t[i + 1])
+    total = best_total = 0.0
+    steps: list[tuple[int, int]] = []
+    touched = [t1, t[i + 1]]
+    best_depth = 0
+    for _ in range(LK_MAX_DEPTH):
+        t2 = t[i + 1]
+        choice = None
+        for t3 in neighbors[t2].tolist():
+            j = pos[t3]
+            # Stops already in the chain are off limits, so it cannot undo itself.
+            if j < i + 3 or t3 in touched:
+                continue
+            g = gain - d(t2, t3)
+            if g <= 0:
+                continue
+            t4 = t[j - 1]
+            # Lookahead: open gain once the edge t4 -> t3 is removed too.
+            if choice is None or g + d(t4, t3) > choice[0]:
+                choice = (g + d(t4, t3), j)
+        if choice is None:
+            break
+        gain, j = choice
+        total += r.reverse_delta(i + 1, j - 1)
+        r.reverse(i + 1, j - 1)
+        steps.append((i + 1, j - 1))
+        touched += [t[i + 1], t[j]]
+        if total < best_total - IMPROVEMENT_EPS:
+            best_total, best_depth = total, len(steps)
+    for a, b in reversed(steps[best_depth:]):
+        r.reverse(a, b)
+    return touched[: 2 + 2 * best_depth] if best_depth else []
+
+
+def or_opt(
+    cost: Sequence[Sequence[float]],
+    order: list[int],
+    *,
+    lk: bool = False,
+    neighbors: np.ndarray | None = None,
+    symmetric: bool | None = None,
+    deadline: float | None = None,
+    stats: SearchStats | None = None,
+) -> list[int]:
+    """Neighbour-list local search: 2-opt and Or-opt moves (runs of up to
+    three stops relocated, optionally reversed), plus LK-style chained 2-opt
+    moves when `lk` is set.
+
+    Moves are only tried between a stop and its `neighbors` (see
+    `neighbor_lists`), and don't-look bits keep a stop out of the work queue
+    until one of its edges changes, so a pass costs about O(n * k) move
+    evaluations instead of 2-opt's O(n^2). Or-opt moves keep the direction of
+    travel, which suits asymmetric matrices where reversals are expensive.
+
+    Like `two_opt`, the first and last positions never move and the tour is
+    valid after every move, so a `deadline` returns the best tour so far.
+    """
+    n = len(order)
+    if n < 4:
+        return order
+    c = np.asarray(cost, dtype=np.float64)
+    if symmetric is None:
+        symmetric = is_symmetric(c)
+    if stats is None:
+        stats = SearchStats()
+    if neighbors is None:
+        neighbors = neighbor_lists(c)
+
+    r = _Route(c, order, symmetric)
+    queue = deque(order)
+    queued = set(order)
+    while queue:
+        if deadline_passed(deadline):
+            stats.timed_out = True
+            break
+        v = queue.popleft()
+        queued.discard(v)
+        touched: list[int] = []
+        delta, a, b = _best_two_opt(r, v, neighbors[v].tolist())
+        if delta < -IMPROVEMENT_EPS:
+            t = r.tour
+            touched = [t[a - 1], t[a], t[b], t[b + 1]]
+            r.reverse(a, b)
+        else:
+            delta, s, e, j, flip = _best_or_opt(r, v, neighbors)
+            if delta < -IMPROVEMENT_EPS:
+                t = r.tour
+                touched = [t[s - 1], t[s], t[e], t[e + 1], t[j], t[j + 1]]
+                r.move_segment(s, e, j, flip)
+            elif lk:
+                touched = _lk_chain(r, v, neighbors)
+        if touched:
+            stats.moves += 1
+            # Clear the don't-look bits of every stop whose edges changed.
+            for u in touched:
+                if u not in queued:
+                    queue.append(u)
+                    queued.add(u)
+    return r.tour
+
+
+def improve(
+    cost: Sequence[Sequence[float]],
+    order: list[int],
+    *,
+    improvement: str = "2opt",
+    deadline: float | None = None,
+    stats: SearchStats | None = None,
+) -> list[int]:
+    """Run the local search engine named in `IMPROVEMENTS` on `order`."""
+    if improvement == "2opt":
+        return two_opt(cost, order, deadline=deadline, stats=stats)
+    return or_opt(cost, order, lk=improvement == "lk", deadline=deadline, stats=stats)
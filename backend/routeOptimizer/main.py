@@ -1,11 +1,23 @@
 from __future__ import annotations
 
+import asyncio
+import json
 import os
+import time
+from datetime import timedelta, timezone
+from contextlib import asynccontextmanager
+from functools import partial
 from pathlib import Path
+from typing import Any, AsyncIterator, Callable
 
+import msgpack
+import numpy as np
 from fastapi import FastAPI
-from fastapi import HTTPException
+from fastapi import HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from pydantic import ValidationError
 
 
 def _load_dotenv_if_present() -> None:
@@ -48,19 +60,79 @@ _load_dotenv_if_present()
 # - `uvicorn backend.routeOptimizer.main:app` (package import)
 # - `python backend/routeOptimizer/main.py` (direct execution)
 try:
-    from .models import OptimizeRequest, OptimizeResponse, Segment
+    from .batch import available_cpus, get_process_pool, shutdown_process_pool
+    from .catalog_matrix import HAVERSINE_LAYER, ROAD_LAYERS, get_catalog_matrix
+    from .encoding import JSON, MATRIX_BLOB, MSGPACK, compact_response, matrix_blob, negotiate
+    from .incremental import remove_stops, reoptimize
+    from .matrix_store import MATRIX_STORE
+    from .result_cache import RESULT_CACHE
+    from .models import BatchOptimizeRequest, CatalogOptimizeRequest, OptimizeRequest, OptimizeResponse
+    from .models import IncrementalOptimizeRequest
+    from .models import DetourCandidate, DetourRequest, DetourResponse
+    from .models import LatLng, NearbyDestination, NearbyRequest, NearbyResponse
     from .models import TrafficRouteRequest, TrafficRouteResponse, TrafficLeg, SpeedInterval
-    from .optimizer import optimize_order_from_cost_matrix, optimize_route, path_length
-    from .google_matrix import GoogleMatrixError, fetch_distance_matrix
-    from .google_routes import GoogleRoutesError, compute_traffic_route
+    from .polyline import simplify_leg, zoom_tolerance_m
+    from .pipeline import catalog_itinerary, matrix_coords, optimize_itinerary, route_horizon_s
+    from .google_matrix import GoogleMatrixError, fetch_distance_matrix_async
+    from .google_routes import GoogleRoutesError, compute_traffic_route_async
+    from .exact import HELD_KARP_MAX_N
+    from .http_client import close_google_client, get_google_client, open_google_client
+    from .metrics import REGISTRY, StageTimer
+    from .multistart import parallel_multistart
+    from .estimator import get_estimator
+    from .road_graph import get_road_graph
+    from .route_cache import SingleFlightCache
+    from .spatial_index import get_catalog_index
+    from .time_slices import TimeSlices, max_time_slices, slice_starts
 except ImportError:  # pragma: no cover
-    from models import OptimizeRequest, OptimizeResponse, Segment
+    from batch import available_cpus, get_process_pool, shutdown_process_pool
+    from catalog_matrix import HAVERSINE_LAYER, ROAD_LAYERS, get_catalog_matrix
+    from encoding import JSON, MATRIX_BLOB, MSGPACK, compact_response, matrix_blob, negotiate
+    from incremental import remove_stops, reoptimize
+    from matrix_store import MATRIX_STORE
+    from result_cache import RESULT_CACHE
+    from models import BatchOptimizeRequest, CatalogOptimizeRequest, OptimizeRequest, OptimizeResponse
+    from models import IncrementalOptimizeRequest
+    from models import DetourCandidate, DetourRequest, DetourResponse
+    from models import LatLng, NearbyDestination, NearbyRequest, NearbyResponse
     from models import TrafficRouteRequest, TrafficRouteResponse, TrafficLeg, SpeedInterval
-    from optimizer import optimize_order_from_cost_matrix, optimize_route, path_length
-    from google_matrix import GoogleMatrixError, fetch_distance_matrix
-    from google_routes import GoogleRoutesError, compute_traffic_route
+    from polyline import simplify_leg, zoom_tolerance_m
+    from pipeline import catalog_itinerary, matrix_coords, optimize_itinerary, route_horizon_s
+    from google_matrix import GoogleMatrixError, fetch_distance_matrix_async
+    from google_routes import GoogleRoutesError, compute_traffic_route_async
+    from exact import HELD_KARP_MAX_N
+    from http_client import close_google_client, get_google_client, open_google_client
+    from metrics import REGISTRY, StageTimer
+    from multistart import parallel_multistart
+    from estimator import get_estimator
+    from road_graph import get_road_graph
+    from route_cache import SingleFlightCache
+    from spatial_index import get_catalog_index
+    from time_slices import TimeSlices, max_time_slices, slice_starts
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    # One pooled (HTTP/2, keep-alive) client shared by every Google call.
+    await open_google_client()
+    # Build the catalog's spatial index on the default executor now, rather
+    # than on the first /nearby request.
+    asyncio.get_running_loop().run_in_executor(None, get_catalog_index)
+    try:
+        yield
+    finally:
+        await close_google_client()
+        shutdown_process_pool()
+
 
-app = FastAPI(title="CeylonRoam Route Optimizer", version="1.0.0")
+app = FastAPI(title="CeylonRoam Route Optimizer", version="1.0.0", lifespan=lifespan)
+
+# The map re-requests the same polyline on every pan/zoom/reopen; traffic data
+# is allowed to be this stale.
+traffic_route_cache = SingleFlightCache(
+    ttl_s=float(os.getenv("TRAFFIC_ROUTE_CACHE_TTL_S", "60")),
+    max_entries=int(os.getenv("TRAFFIC_ROUTE_CACHE_MAX_ENTRIES", "1000")),
+)
 
 
 def _get_cors_settings() -> tuple[list[str], bool, str | None]:
@@ -101,142 +173,433 @@ def health() -> dict:
     return {"status": "ok"}
 
 
-@app.post("/optimize", response_model=OptimizeResponse)
-def optimize(req: OptimizeRequest) -> OptimizeResponse:
-    itinerary = req.itinerary
-    coords = [(d.location.lat, d.location.lng) for d in itinerary]
+def _timed_response(
+    result: OptimizeResponse, timer: StageTimer, req: OptimizeRequest, accept: str | None = None
+) -> Response:
+    """Serialize `result` here (so it can be timed) and report every stage in
+    a `Server-Timing` header and the `/metrics` histograms.
+
+    `Accept: application/msgpack` gets the compact MessagePack encoding
+    (see `compact_response`); anything else gets the full JSON model.
+    """
+    media_type = negotiate(accept, (JSON, MSGPACK))
+    with timer.stage("serialize"):
+        if media_type == MSGPACK:
+            body = msgpack.packb(compact_response(result), use_bin_type=True)
+        else:
+            body = result.model_dump_json().encode()
+    total_ms = timer.elapsed_ms()
+    timer.observe(metric=req.metric, optimize_for=req.optimize_for, n=len(req.itinerary), total_ms=total_ms)
+    return Response(
+        content=body,
+        media_type=media_type,
+        headers={"Server-Timing": timer.server_timing(total_ms=total_ms), "Vary": "Accept"},
+    )
 
-    # Default: haversine distance
-    distance_km_matrix: list[list[float]]
-    duration_s_matrix: list[list[float]] | None = None
-    duration_traffic_s_matrix: list[list[float]] | None = None
 
-    metric_used = req.metric
+# Zone of `departure_time` values sent without one.
+_LOCAL_TZ = timezone(timedelta(hours=5, minutes=30))
 
-    if req.metric == "google":
+
+async def _fetch_google_matrices(
+    req: OptimizeRequest, timer: StageTimer, departure_time: str = "now"
+) -> dict[str, np.ndarray]:
+    with timer.stage("google_matrix"):
         try:
-            matrices = fetch_distance_matrix(coords)
-            distance_km_matrix = matrices["distance_km"]
-            duration_s_matrix = matrices["duration_s"]
-            duration_traffic_s_matrix = matrices["duration_in_traffic_s"]
+            return await fetch_distance_matrix_async(
+                matrix_coords(req), departure_time=departure_time, client=get_google_client()
+            )
         except GoogleMatrixError as e:
             raise HTTPException(status_code=400, detail=str(e))
-    else:
-        order, distance_km_matrix = optimize_route(
-            coords,
-            return_to_start=req.return_to_start,
-            try_all_starts=req.try_all_starts,
+
+
+async def _road_matrices(req: OptimizeRequest, timer: StageTimer) -> dict[str, np.ndarray]:
+    # The first call loads the graph file; keep that off the event loop.
+    graph = await run_in_threadpool(get_road_graph)
+    if graph is None:
+        raise HTTPException(status_code=503, detail="Road graph is not available")
+    with timer.stage("road_matrix"):
+        return await run_in_threadpool(graph.matrix, matrix_coords(req))
+
+
+async def _estimated_matrices(
+    req: OptimizeRequest, timer: StageTimer, departure_epoch: float | None = None
+) -> dict[str, np.ndarray]:
+    estimator = await run_in_threadpool(get_estimator)
+    if estimator is None:
+        raise HTTPException(status_code=503, detail="Travel-time model is not available")
+    with timer.stage("estimated_matrix"):
+        return await run_in_threadpool(
+            partial(estimator.matrix, departure_epoch=departure_epoch), matrix_coords(req)
         )
 
+
+def _departure_epoch(req: OptimizeRequest) -> float | None:
+    """`req.departure_time` in epoch seconds, not before now (Google rejects
+    past departures), or None when unset."""
+    if req.departure_time is None:
+        return None
+    departure = req.departure_time
+    if departure.tzinfo is None:
+        departure = departure.replace(tzinfo=_LOCAL_TZ)
+    return max(departure.timestamp(), time.time())
+
+
+async def _time_sliced_matrices(req: OptimizeRequest, timer: StageTimer, departure_epoch: float) -> TimeSlices:
+    """Matrices for each hour the route spans from `departure_epoch`.
+
+    The departure hour is fetched first; a rough route duration on it
+    decides how many later hours are needed (at most `max_time_slices`),
+    which are then fetched concurrently. Each slice is requested for the
+    start of its hour, or for now when that has passed (Google rejects past
+    departures). Future hours are therefore shared through the matrix cache
+    with every request whose route spans them; the current hour only with
+    requests in the same cache bucket (`MATRIX_CACHE_BUCKET_S`).
+    """
+
+    async def fetch(start: float) -> dict[str, np.ndarray]:
+        at = max(start, time.time())
+        if req.metric == "google":
+            return await _fetch_google_matrices(req, timer, departure_time=str(int(at)))
+        return await _estimated_matrices(req, timer, departure_epoch=at)
+
+    starts = slice_starts(departure_epoch, 0.0, 1)
+    first = await fetch(starts[0])
+    horizon_s = route_horizon_s(req, first["duration_in_traffic_s"])
+    starts = slice_starts(departure_epoch, horizon_s, max_time_slices(req.time_slices))
+    rest = await asyncio.gather(*(fetch(start) for start in starts[1:]))
+    return TimeSlices.stack(departure_epoch, starts, [first, *rest])
+
+
+async def _metric_matrices(
+    req: OptimizeRequest, timer: StageTimer
+) -> tuple[dict[str, np.ndarray] | None, TimeSlices | None]:
+    """Matrices for `metric=google`, `road` or `estimated` (None for
+    haversine), and with `departure_time` the hourly slices they are the
+    first of (google and estimated only; the others do not vary by hour)."""
+    departure_epoch = _departure_epoch(req)
+    if departure_epoch is not None and req.metric in ("google", "estimated"):
+        slices = await _time_sliced_matrices(req, timer, departure_epoch)
+        return slices.first(), slices
     if req.metric == "google":
-        assert duration_traffic_s_matrix is not None
+        return await _fetch_google_matrices(req, timer), None
+    if req.metric == "road":
+        return await _road_matrices(req, timer), None
+    if req.metric == "estimated":
+        return await _estimated_matrices(req, timer), None
+    return None, None
+
+
+def _parallel_solver(req: OptimizeRequest) -> Callable[[np.ndarray], Any] | None:
+    """A multi-start solver on the process pool when more than one worker is
+    requested (and available), else None for the regular solver. Itineraries
+    the exact solver handles are never split up."""
+    workers = req.workers or int(os.getenv("OPTIMIZE_PARALLEL_WORKERS") or 1)
+    workers = min(workers, available_cpus())
+    if workers <= 1 or len(req.itinerary) <= HELD_KARP_MAX_N:
+        return None
+    return partial(
+        parallel_multistart,
+        pool=get_process_pool(),
+        workers=workers,
+        return_to_start=req.return_to_start,
+        try_all_starts=req.try_all_starts,
+        coords=[(d.location.lat, d.location.lng) for d in req.itinerary],
+        time_budget_ms=req.time_budget_ms,
+        improvement=req.improvement,
+    )
 
-        if req.optimize_for == "distance":
-            cost = distance_km_matrix
-        elif req.optimize_for == "time":
-            cost = duration_traffic_s_matrix
-        else:
-            # Hybrid: normalize both matrices to similar scale
-            def mean_off_diagonal(m: list[list[float]]) -> float:
-                vals: list[float] = []
-                for i in range(len(m)):
-                    for j in range(len(m)):
-                        if i != j and m[i][j] < 1e8:
-                            vals.append(float(m[i][j]))
-                if not vals:
-                    return 1.0
-                return sum(vals) / len(vals)
-
-            dist_mean = mean_off_diagonal(distance_km_matrix)
-            time_mean = mean_off_diagonal(duration_traffic_s_matrix)
-            dist_scale = dist_mean if dist_mean > 0 else 1.0
-            time_scale = time_mean if time_mean > 0 else 1.0
-
-            n = len(distance_km_matrix)
-            cost = [[0.0] * n for _ in range(n)]
-            for i in range(n):
-                for j in range(n):
-                    cost[i][j] = (req.distance_weight * (distance_km_matrix[i][j] / dist_scale)) + (
-                        req.time_weight * (duration_traffic_s_matrix[i][j] / time_scale)
-                    )
-
-        order = optimize_order_from_cost_matrix(
-            cost,
-            return_to_start=req.return_to_start,
-            try_all_starts=req.try_all_starts,
-        )
 
-    optimized_itinerary = [itinerary[i] for i in order]
-
-    segments: list[Segment] = []
-    for from_idx, to_idx in zip(order, order[1:]):
-        segments.append(
-            Segment(
-                from_index=from_idx,
-                to_index=to_idx,
-                distance_km=distance_km_matrix[from_idx][to_idx],
-                duration_seconds=(duration_s_matrix[from_idx][to_idx] if duration_s_matrix else None),
-                duration_in_traffic_seconds=(
-                    duration_traffic_s_matrix[from_idx][to_idx] if duration_traffic_s_matrix else None
-                ),
-            )
-        )
+@app.post("/optimize", response_model=OptimizeResponse)
+async def optimize(req: OptimizeRequest, request: Request) -> Response:
+    timer = StageTimer()
+    google_matrices, time_slices = await _metric_matrices(req, timer)
+
+    # Solving is CPU-bound; keep it off the event loop.
+    result = await run_in_threadpool(
+        optimize_itinerary,
+        req,
+        google_matrices,
+        None,
+        timer,
+        _parallel_solver(req),
+        MATRIX_STORE,
+        time_slices,
+        RESULT_CACHE,
+    )
+    return _timed_response(result, timer, req, request.headers.get("accept"))
 
-    if req.return_to_start and len(order) > 1:
-        segments.append(
-            Segment(
-                from_index=order[-1],
-                to_index=order[0],
-                distance_km=distance_km_matrix[order[-1]][order[0]],
-                duration_seconds=(duration_s_matrix[order[-1]][order[0]] if duration_s_matrix else None),
-                duration_in_traffic_seconds=(
-                    duration_traffic_s_matrix[order[-1]][order[0]] if duration_traffic_s_matrix else None
-                ),
-            )
-        )
 
-    total_km = path_length(distance_km_matrix, order, return_to_start=req.return_to_start)
-    total_duration_s = path_length(duration_s_matrix, order, return_to_start=req.return_to_start) if duration_s_matrix else None
-    total_duration_traffic_s = (
-        path_length(duration_traffic_s_matrix, order, return_to_start=req.return_to_start)
-        if duration_traffic_s_matrix
-        else None
+@app.post("/optimize/catalog", response_model=OptimizeResponse)
+async def optimize_catalog(req: CatalogOptimizeRequest, request: Request) -> Response:
+    """`/optimize` for catalog destinations given by id.
+
+    Distances are sliced from the precomputed, memory-mapped catalog matrix
+    instead of being computed. `metric=google` uses the stored road layers
+    when the matrix was built with them, else fetches live like `/optimize`;
+    `metric=road` always queries the road graph.
+    """
+    timer = StageTimer()
+    catalog = get_catalog_matrix()
+    if catalog is None:
+        raise HTTPException(status_code=503, detail="Destination catalog is not available")
+    try:
+        idx = catalog.indices(req.destination_ids)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=f"Unknown destination ids: {e.args[0]}")
+
+    resolved = req.model_copy(update={"itinerary": catalog_itinerary(catalog, idx)})
+    haversine_km: np.ndarray | None = None
+    google_matrices: dict[str, np.ndarray] | None = None
+    time_slices: TimeSlices | None = None
+    # Overnight bases are not in the catalog; those requests build their own matrices.
+    if resolved.day_split is None or not resolved.day_split.overnight_bases:
+        with timer.stage("catalog_matrix"):
+            haversine_km = catalog.submatrix(HAVERSINE_LAYER, idx)
+            # Stored layers are not for a particular departure time.
+            if req.metric == "google" and catalog.has_road() and req.departure_time is None:
+                google_matrices = {name: catalog.submatrix(name, idx) for name in ROAD_LAYERS}
+    if req.metric != "haversine" and google_matrices is None:
+        google_matrices, time_slices = await _metric_matrices(resolved, timer)
+
+    result = await run_in_threadpool(
+        optimize_itinerary,
+        resolved,
+        google_matrices,
+        haversine_km,
+        timer,
+        _parallel_solver(resolved),
+        MATRIX_STORE,
+        time_slices,
+        RESULT_CACHE,
+    )
+    return _timed_response(result, timer, resolved, request.headers.get("accept"))
+
+
+@app.post("/optimize/incremental", response_model=OptimizeResponse)
+async def optimize_incremental(req: IncrementalOptimizeRequest, request: Request) -> Response:
+    """Re-optimize after stops were added to or removed from an optimized route.
+
+    New stops are placed by cheapest insertion and only the stops within
+    `repair_radius` of an edit are re-optimized, so the rest of the route
+    keeps its order. Indices in the response refer to the edited itinerary:
+    the kept stops in their original order, then `insert`.
+    """
+    timer = StageTimer()
+    removed = set(req.remove)
+    kept = [d for i, d in enumerate(req.itinerary) if i not in removed]
+    order, touched = remove_stops(req.current_order, req.remove, len(req.itinerary))
+    edited = req.model_copy(update={"itinerary": kept + list(req.insert)})
+    solve = partial(
+        reoptimize,
+        order=order,
+        inserted=range(len(kept), len(edited.itinerary)),
+        touched=sorted(touched),
+        return_to_start=req.return_to_start,
+        pin_start=not req.try_all_starts,
+        radius=req.repair_radius,
+        time_budget_ms=req.time_budget_ms,
     )
 
-    return OptimizeResponse(
-        optimized_order=order,
-        total_distance_km=total_km,
-        total_duration_seconds=total_duration_s,
-        total_duration_in_traffic_seconds=total_duration_traffic_s,
-        metric_used=metric_used,
-        optimize_for=req.optimize_for,
-        optimized_itinerary=optimized_itinerary,
-        segments=segments,
+    # For metric=google, pairs of the unchanged stops come from the matrix cache.
+    google_matrices, time_slices = await _metric_matrices(edited, timer)
+    # Time-slice refinement would re-optimize the whole route; keep the repair.
+    result = await run_in_threadpool(
+        optimize_itinerary, edited, google_matrices, None, timer, solve, MATRIX_STORE, time_slices, refine=False
     )
+    return _timed_response(result, timer, edited, request.headers.get("accept"))
+
+
+@app.get("/matrices/{matrix_id}")
+def get_matrix(matrix_id: str, request: Request, layer: str = "cost") -> Response:
+    """One matrix of a recent solve, by the `matrix_id` its response returned.
+
+    Layers: 'cost' (what the solver minimized), 'distance_km', and for road
+    metrics 'duration_s' / 'duration_in_traffic_s', indexed like the
+    request itinerary. Encodings by `Accept`: JSON (default), MessagePack
+    (float32 values as one bin field) or `application/octet-stream` (a
+    16-byte header, then row-major float32 little-endian values). The
+    matrices of an id never change, so responses carry an ETag.
+    """
+    layers = MATRIX_STORE.get(matrix_id)
+    if layers is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired matrix id")
+    if layer not in layers:
+        raise HTTPException(status_code=404, detail=f"No layer {layer!r}; available: {sorted(layers)}")
+
+    media_type = negotiate(request.headers.get("accept"), (JSON, MSGPACK, MATRIX_BLOB))
+    encoding = {JSON: "json", MSGPACK: "msgpack", MATRIX_BLOB: "f32"}[media_type]
+    etag = f'"{matrix_id}-{layer}-{encoding}"'
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=86400, immutable", "Vary": "Accept"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    matrix = layers[layer]
+    if media_type == MATRIX_BLOB:
+        body = matrix_blob(matrix)
+    elif media_type == MSGPACK:
+        body = msgpack.packb(
+            {
+                "matrix_id": matrix_id,
+                "layer": layer,
+                "shape": list(matrix.shape),
+                "dtype": "<f4",
+                "data": matrix.astype("<f4").tobytes(),
+            },
+            use_bin_type=True,
+        )
+    else:
+        body = json.dumps(
+            {"matrix_id": matrix_id, "layer": layer, "layers": sorted(layers), "data": matrix.tolist()}
+        ).encode()
+    return Response(content=body, media_type=media_type, headers=headers)
+
+
+@app.post("/optimize/batch")
+async def optimize_batch(req: BatchOptimizeRequest) -> StreamingResponse:
+    """Solve many itineraries in parallel on a process pool.
+
+    Streams NDJSON, one line per item as soon as it finishes (not in input
+    order): `{"index": i, "result": {...OptimizeResponse}}` or
+    `{"index": i, "error": "..."}`. A failing item never fails the batch.
+    """
+    loop = asyncio.get_running_loop()
+    pool = get_process_pool()
+
+    async def solve_item(index: int, raw: dict[str, Any]) -> dict[str, Any]:
+        try:
+            item = OptimizeRequest.model_validate(raw)
+            # Stages inside the worker process are not visible here; the
+            # whole solve is recorded as one 'solve' stage.
+            timer = StageTimer()
+            google_matrices, time_slices = await _metric_matrices(item, timer)
+            with timer.stage("solve"):
+                result = await loop.run_in_executor(
+                    pool, optimize_itinerary, item, google_matrices, None, None, None, None, time_slices
+                )
+            timer.observe(metric=item.metric, optimize_for=item.optimize_for, n=len(item.itinerary))
+            return {"index": index, "result": result.model_dump(mode="json")}
+        except ValidationError as e:
+            return {"index": index, "error": f"Invalid item: {e.errors(include_url=False)}"}
+        except HTTPException as e:
+            return {"index": index, "error": e.detail}
+        except Exception as e:
+            return {"index": index, "error": str(e) or type(e).__name__}
+
+    async def lines() -> AsyncIterator[str]:
+        tasks = [asyncio.ensure_future(solve_item(i, raw)) for i, raw in enumerate(req.items)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield json.dumps(await next_done) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+def _catalog_location(entry: dict[str, Any]) -> LatLng:
+    return LatLng(lat=entry["lat"], lng=entry["lng"])
+
+
+@app.post("/nearby", response_model=NearbyResponse)
+def nearby(req: NearbyRequest) -> NearbyResponse:
+    """Nearest catalog destinations to a point (k-nearest, optionally within a radius)."""
+    catalog = get_catalog_index()
+    if catalog is None:
+        raise HTTPException(status_code=503, detail="Destination catalog is not available")
+    index = catalog.index
+
+    exclude = set(req.exclude_ids)
+    # Ask for enough extra neighbours that excluded ones can be dropped.
+    k = min(req.k + len(exclude), index.size)
+    idx, km = index.nearest(req.location.lat, req.location.lng, k, max_km=req.radius_km)
+    results: list[NearbyDestination] = []
+    for i, dist in zip(idx.tolist(), km.tolist()):
+        entry = catalog.destinations[i]
+        if entry["id"] in exclude:
+            continue
+        results.append(
+            NearbyDestination(id=entry["id"], name=entry["name"], location=_catalog_location(entry), distance_km=dist)
+        )
+    return NearbyResponse(results=results[: req.k])
+
+
+@app.post("/nearby/along-route", response_model=DetourResponse)
+def nearby_along_route(req: DetourRequest) -> DetourResponse:
+    """Catalog destinations that can be added to a route for at most `max_detour_km` extra."""
+    catalog = get_catalog_index()
+    if catalog is None:
+        raise HTTPException(status_code=503, detail="Destination catalog is not available")
+    index = catalog.index
+
+    exclude = set(req.exclude_ids)
+    idx, detour, leg = index.detour_candidates([(p.lat, p.lng) for p in req.route], req.max_detour_km)
+    candidates: list[DetourCandidate] = []
+    for i, extra, after in zip(idx.tolist(), detour.tolist(), leg.tolist()):
+        entry = catalog.destinations[i]
+        if entry["id"] in exclude:
+            continue
+        candidates.append(
+            DetourCandidate(
+                id=entry["id"],
+                name=entry["name"],
+                location=_catalog_location(entry),
+                detour_km=max(extra, 0.0),
+                insert_after=after,
+            )
+        )
+        if len(candidates) == req.limit:
+            break
+    return DetourResponse(candidates=candidates)
 
 
 @app.post("/traffic-route", response_model=TrafficRouteResponse)
-def traffic_route(req: TrafficRouteRequest) -> TrafficRouteResponse:
+async def traffic_route(req: TrafficRouteRequest) -> TrafficRouteResponse:
     """Return traffic-on-polyline intervals for route coloring.
 
     This endpoint is used by the frontend to draw a Google-Maps-like route line
-    with per-segment traffic colors (blue/yellow/red).
+    with per-segment traffic colors (blue/yellow/red). Pass `zoom` (or
+    `tolerance_m`) to get a lighter, simplified line: e.g. an overview first,
+    then the detailed line.
 
     Requires backend `GOOGLE_MAPS_API_KEY` with Routes API enabled.
     """
 
+    origin = (req.origin.lat, req.origin.lng)
+    destination = (req.destination.lat, req.destination.lng)
+    intermediates = [(p.lat, p.lng) for p in req.intermediates]
+    # ~1 m rounding so float noise from the client does not defeat the cache.
+    key = (
+        req.travel_mode,
+        tuple(round(v, 5) for v in origin),
+        tuple(round(v, 5) for v in destination),
+        tuple(tuple(round(v, 5) for v in p) for p in intermediates),
+    )
+
     try:
-        payload = compute_traffic_route(
-            origin=(req.origin.lat, req.origin.lng),
-            destination=(req.destination.lat, req.destination.lng),
-            intermediates=[(p.lat, p.lng) for p in req.intermediates],
-            travel_mode=req.travel_mode,
+        payload = await traffic_route_cache.get_or_compute(
+            key,
+            lambda: compute_traffic_route_async(
+                origin=origin,
+                destination=destination,
+                intermediates=intermediates,
+                travel_mode=req.travel_mode,
+                client=get_google_client(),
+            ),
         )
     except GoogleRoutesError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+    # Simplify after the cache so every zoom level shares one upstream call.
+    tolerance_m = req.tolerance_m
+    if tolerance_m is None and req.zoom is not None:
+        tolerance_m = zoom_tolerance_m(req.zoom, (origin[0] + destination[0]) / 2.0)
+
     legs: list[TrafficLeg] = []
     for leg in payload.get("legs", []):
+        if tolerance_m:
+            leg = simplify_leg(leg, tolerance_m)
         intervals = [
             SpeedInterval(
                 start_index=int(i.get("startIndex", 0)),
@@ -255,6 +618,18 @@ def traffic_route(req: TrafficRouteRequest) -> TrafficRouteResponse:
     )
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics() -> PlainTextResponse:
+    """Prometheus metrics: per-stage optimize timings and Google call counters."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/traffic-route/cache-stats")
+def traffic_route_cache_stats() -> dict:
+    """Hit/miss/coalesced counters of the `/traffic-route` cache."""
+    return traffic_route_cache.stats()
+
+
 if __name__ == "__main__":
     import uvicorn
 
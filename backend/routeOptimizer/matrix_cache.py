@@ -0,0 +1,242 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+# One cached Distance Matrix element: (distance_km, duration_s, duration_in_traffic_s).
+PairValue = tuple[float, float, float]
+
+# Elements at or above this are google_matrix.UNREACHABLE penalties (no
+# route, or a non-OK element status), not measurements.
+_UNREACHABLE_AT_LEAST = 1e8
+
+
+class MatrixCacheBackend(ABC):
+    """Storage for cached matrix elements. Subclasses must be thread-safe."""
+
+    @abstractmethod
+    def get_many(self, keys: list[str]) -> dict[str, PairValue]: ...
+
+    @abstractmethod
+    def set_many(self, items: dict[str, PairValue], ttl_s: float) -> None: ...
+
+
+class MemoryBackend(MatrixCacheBackend):
+    """In-process LRU with per-entry expiry. Not shared between workers."""
+
+    def __init__(self, max_entries: int = 100_000) -> None:
+        self.max_entries = max_entries
+        self._items: OrderedDict[str, tuple[float, PairValue]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: list[str]) -> dict[str, PairValue]:
+        now = time.time()
+        found: dict[str, PairValue] = {}
+        with self._lock:
+            for key in keys:
+                item = self._items.get(key)
+                if item is None:
+                    continue
+                expires_at, value = item
+                if expires_at <= now:
+                    del self._items[key]
+                    continue
+                self._items.move_to_end(key)
+                found[key] = value
+        return found
+
+    def set_many(self, items: dict[str, PairValue], ttl_s: float) -> None:
+        expires_at = time.time() + ttl_s
+        with self._lock:
+            for key, value in items.items():
+                self._items[key] = (expires_at, value)
+                self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+
+class SQLiteBackend(MatrixCacheBackend):
+    """File-backed cache shared by every worker on the same host."""
+
+    # Stay below SQLite's bound-parameter limit on older builds.
+    _CHUNK = 500
+
+    def __init__(self, path: str | Path) -> None:
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5.0)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS matrix_pairs ("
+                "key TEXT PRIMARY KEY, distance_km REAL, duration_s REAL, "
+                "duration_in_traffic_s REAL, expires_at REAL)"
+            )
+
+    def get_many(self, keys: list[str]) -> dict[str, PairValue]:
+        now = time.time()
+        found: dict[str, PairValue] = {}
+        with self._lock:
+            for i in range(0, len(keys), self._CHUNK):
+                chunk = keys[i : i + self._CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    "SELECT key, distance_km, duration_s, duration_in_traffic_s FROM matrix_pairs "
+                    f"WHERE expires_at > ? AND key IN ({placeholders})",
+                    (now, *chunk),
+                ).fetchall()
+                for key, dist_km, dur_s, dur_traffic_s in rows:
+                    found[key] = (dist_km, dur_s, dur_traffic_s)
+        return found
+
+    def set_many(self, items: dict[str, PairValue], ttl_s: float) -> None:
+        now = time.time()
+        rows = [(key, *value, now + ttl_s) for key, value in items.items()]
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO matrix_pairs VALUES (?, ?, ?, ?, ?)", rows)
+            self._conn.execute("DELETE FROM matrix_pairs WHERE expires_at <= ?", (now,))
+
+
+class RedisBackend(MatrixCacheBackend):
+    """Cache in Redis or any server/client speaking the same commands.
+
+    `client` can be a redis-py client or a local stand-in with the same API
+    (`mget`, `pipeline().setex()`), e.g. fakeredis in development.
+    """
+
+    def __init__(self, url: str | None = None, *, client: Any = None, prefix: str = "ceylonroam:dm:") -> None:
+        if client is None:
+            try:
+                import redis  # type: ignore
+            except Exception as e:
+                raise RuntimeError("MATRIX_CACHE_BACKEND=redis requires the `redis` package") from e
+            client = redis.Redis.from_url(url or "redis://localhost:6379/0")
+        self._client = client
+        self.prefix = prefix
+
+    def get_many(self, keys: list[str]) -> dict[str, PairValue]:
+        if not keys:
+            return {}
+        raw = self._client.mget([self.prefix + k for k in keys])
+        found: dict[str, PairValue] = {}
+        for key, value in zip(keys, raw):
+            if value is not None:
+                dist_km, dur_s, dur_traffic_s = json.loads(value)
+                found[key] = (dist_km, dur_s, dur_traffic_s)
+        return found
+
+    def set_many(self, items: dict[str, PairValue], ttl_s: float) -> None:
+        pipe = self._client.pipeline()
+        for key, value in items.items():
+            pipe.setex(self.prefix + key, max(1, int(ttl_s)), json.dumps(list(value)))
+        pipe.execute()
+
+
+class PairMatrixCache:
+    """Pair-level cache of Distance Matrix elements.
+
+    Keys combine rounded origin/destination coordinates (5 decimals, about
+    1 m), travel mode, traffic model and a departure-time bucket, so the same
+    pair requested by different itineraries within one bucket is fetched once.
+    Unreachable / non-OK elements are kept only `unreachable_ttl_s` (0: not
+    at all), so a transient failure does not stick to a pair for the full
+    TTL. Backend errors are logged and treated as misses.
+    """
+
+    def __init__(
+        self,
+        backend: MatrixCacheBackend,
+        *,
+        ttl_s: float = 900.0,
+        bucket_s: float = 900.0,
+        precision: int = 5,
+        unreachable_ttl_s: float = 60.0,
+    ) -> None:
+        self.backend = backend
+        self.ttl_s = ttl_s
+        self.unreachable_ttl_s = unreachable_ttl_s
+        self.bucket_s = bucket_s
+        self.precision = precision
+
+    def departure_bucket(self, departure_time: str) -> int:
+        """`departure_time` is 'now' or epoch seconds, as sent to Google."""
+        ts = time.time() if departure_time == "now" else float(departure_time)
+        return int(ts // self.bucket_s)
+
+    def pair_key(
+        self,
+        origin: tuple[float, float],
+        destination: tuple[float, float],
+        *,
+        mode: str,
+        traffic_model: str,
+        bucket: int,
+    ) -> str:
+        p = self.precision
+        return (
+            f"{mode}|{traffic_model}|{bucket}|"
+            f"{origin[0]:.{p}f},{origin[1]:.{p}f}|{destination[0]:.{p}f},{destination[1]:.{p}f}"
+        )
+
+    def get_many(self, keys: list[str]) -> dict[str, PairValue]:
+        try:
+            return self.backend.get_many(keys)
+        except Exception:
+            logger.exception("Matrix cache read failed; treating as miss")
+            return {}
+
+    def set_many(self, items: dict[str, PairValue]) -> None:
+        reachable: dict[str, PairValue] = {}
+        unreachable: dict[str, PairValue] = {}
+        for key, value in items.items():
+            (unreachable if max(value) >= _UNREACHABLE_AT_LEAST else reachable)[key] = value
+        try:
+            if reachable:
+                self.backend.set_many(reachable, self.ttl_s)
+            if unreachable and self.unreachable_ttl_s > 0:
+                self.backend.set_many(unreachable, self.unreachable_ttl_s)
+        except Exception:
+            logger.exception("Matrix cache write failed")
+
+
+@lru_cache(maxsize=1)
+def default_matrix_cache() -> PairMatrixCache | None:
+    """Process-wide cache configured from the environment.
+
+    - MATRIX_CACHE_BACKEND: memory (default) | sqlite | redis | none
+    - MATRIX_CACHE_TTL_S / MATRIX_CACHE_BUCKET_S: expiry and departure bucket (900)
+    - MATRIX_CACHE_UNREACHABLE_TTL_S: expiry of unreachable / non-OK elements (60; 0 skips them)
+    - MATRIX_CACHE_MAX_ENTRIES: memory backend size (100000)
+    - MATRIX_CACHE_SQLITE_PATH: sqlite file (matrix_cache.sqlite3 next to this module)
+    - MATRIX_CACHE_REDIS_URL: redis URL (redis://localhost:6379/0)
+    """
+    kind = (os.getenv("MATRIX_CACHE_BACKEND") or "memory").strip().lower()
+    if kind in ("none", "off", "disabled"):
+        return None
+
+    backend: MatrixCacheBackend
+    if kind == "sqlite":
+        path = os.getenv("MATRIX_CACHE_SQLITE_PATH") or str(Path(__file__).resolve().parent / "matrix_cache.sqlite3")
+        backend = SQLiteBackend(path)
+    elif kind == "redis":
+        backend = RedisBackend(os.getenv("MATRIX_CACHE_REDIS_URL"))
+    else:
+        backend = MemoryBackend(int(os.getenv("MATRIX_CACHE_MAX_ENTRIES", "100000")))
+
+    return PairMatrixCache(
+        backend,
+        ttl_s=float(os.getenv("MATRIX_CACHE_TTL_S", "900")),
+        bucket_s=float(os.getenv("MATRIX_CACHE_BUCKET_S", "900")),
+        unreachable_ttl_s=float(os.getenv("MATRIX_CACHE_UNREACHABLE_TTL_S", "60")),
+    )
@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+import os
+import secrets
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class MatrixStore:
+    """In-process LRU of the matrices behind recent solves, by id.
+
+    Ids are random and never reused, so what is stored under an id never
+    changes and clients can cache it. Entries are evicted least recently
+    used first once `max_bytes` is exceeded; a single entry larger than
+    that is not stored. Each worker process has its own store; with
+    several workers, route `/matrices` requests to the worker that solved
+    (or solve again).
+    """
+
+    def __init__(self, *, max_bytes: int = 256 * 1024 * 1024) -> None:
+        self.max_bytes = max_bytes
+        self._items: OrderedDict[str, dict[str, np.ndarray]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def put(self, layers: dict[str, np.ndarray]) -> str | None:
+        """Store read-only views of `layers` (copied only when not float64 C
+        arrays) and return their id, or None if they exceed `max_bytes`."""
+        frozen: dict[str, np.ndarray] = {}
+        for name, layer in layers.items():
+            matrix = np.ascontiguousarray(layer, dtype=np.float64).view()
+            matrix.setflags(write=False)
+            frozen[name] = matrix
+        size = sum(m.nbytes for m in frozen.values())
+        if size > self.max_bytes:
+            return None
+        matrix_id = secrets.token_hex(16)
+        with self._lock:
+            self._items[matrix_id] = frozen
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._bytes -= sum(m.nbytes for m in evicted.values())
+        return matrix_id
+
+    def get(self, matrix_id: str) -> dict[str, np.ndarray] | None:
+        with self._lock:
+            layers = self._items.get(matrix_id)
+            if layers is not None:
+                self._items.move_to_end(matrix_id)
+            return layers
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+MATRIX_STORE = MatrixStore(max_bytes=int(float(os.getenv("MATRIX_STORE_MAX_MB") or 256) * 1024 * 1024))
@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, TypeVar
+
+# Seconds; spans a cached 5-stop solve up to a slow 500-stop Google fetch.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Upper bounds of the itinerary size label. The first bucket is what Held-Karp
+# solves exactly by default.
+N_BUCKETS = (13, 50, 200, 1000)
+
+
+def n_bucket(n: int) -> str:
+    """Itinerary size as a bounded label value: '1-13', '14-50', ..., '1001+'."""
+    lo = 1
+    for hi in N_BUCKETS:
+        if n <= hi:
+            return f"{lo}-{hi}"
+        lo = hi + 1
+    return f"{lo}+"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{k}="{_escape(v)}"' for k, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """Monotonic counter per label set (Prometheus `counter`)."""
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values: dict[tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = tuple(str(labels[k]) for k in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(tuple(str(labels[k]) for k in self.labels), 0.0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label set (Prometheus `histogram`)."""
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: per-bucket counts (not cumulative), then +Inf, sum.
+        self._series: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels[k]) for k in self.labels)
+        slot = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                slot = i
+                break
+        with self._lock:
+            counts, total = self._series.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[slot] += 1
+            total[0] += value
+
+    def count(self, **labels: str) -> int:
+        series = self._series.get(tuple(str(labels[k]) for k in self.labels))
+        return sum(series[0]) if series else 0
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, (list(counts), total[0])) for key, (counts, total) in self._series.items())
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+_Metric = TypeVar("_Metric", Counter, Histogram)
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: list[Counter | Histogram] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        return "\n".join(line for metric in self._metrics for line in metric.render()) + "\n"
+
+
+# Process-wide metrics. With several uvicorn workers each process exposes its
+# own series; scrape every worker (or aggregate) to see the whole service.
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(
+    Histogram(
+        "route_optimizer_stage_seconds",
+        "Time spent per optimize stage ('total' is the whole request).",
+        ("stage", "metric", "optimize_for", "n_bucket"),
+    )
+)
+GOOGLE_REQUESTS = REGISTRY.register(
+    Counter("route_optimizer_google_requests_total", "HTTP calls made to Google APIs, retries included.", ("api",))
+)
+RESULT_CACHE_LOOKUPS = REGISTRY.register(
+    Counter(
+        "route_optimizer_result_cache_total",
+        "Optimize result cache lookups by outcome (hit, warm_start, miss).",
+        ("outcome",),
+    )
+)
+GOOGLE_FAILURES = REGISTRY.register(
+    Counter(
+        "route_optimizer_google_failures_total",
+        "Google API calls that failed; retryable ones may have succeeded on a later attempt.",
+        ("api", "retryable"),
+    )
+)
+
+
+class StageTimer:
+    """Wall time per named stage of one request, in milliseconds.
+
+    A stage entered more than once accumulates. Stages are kept in the order
+    they first ran, which is the order `server_timing` reports them in.
+    """
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.stages: dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - t0) * 1000.0)
+
+    def add(self, name: str, ms: float) -> None:
+        self.stages[name] = self.stages.get(name, 0.0) + ms
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000.0
+
+    def server_timing(self, *, total_ms: float | None = None) -> str:
+        """`Server-Timing` header value, e.g. `matrix;dur=1.2, local_search;dur=8.4, total;dur=10.1`."""
+        parts = [f"{name};dur={ms:.2f}" for name, ms in self.stages.items()]
+        parts.append(f"total;dur={(total_ms if total_ms is not None else self.elapsed_ms()):.2f}")
+        return ", ".join(parts)
+
+    def observe(self, *, metric: str, optimize_for: str, n: int, total_ms: float | None = None) -> None:
+        """Record every stage, plus 'total', in `STAGE_SECONDS`."""
+        labels = {"metric": metric, "optimize_for": optimize_for, "n_bucket": n_bucket(n)}
+        for name, ms in self.stages.items():
+            STAGE_SECONDS.observe(ms / 1000.0, stage=name, **labels)
+        total = total_ms if total_ms is not None else self.elapsed_ms()
+        STAGE_SECONDS.observe(total / 1000.0, stage="total", **labels)
@@ -1,6 +1,9 @@
 from __future__ import annotations
 
-from pydantic import BaseModel, Field
+from datetime import datetime
+from typing import Any
+
+from pydantic import BaseModel, Field, model_validator
 
 
 class LatLng(BaseModel):
@@ -14,6 +17,40 @@ class Destination(BaseModel):
     location: LatLng
     description: str | None = None
 
+    # Catalog text used by time_windows, e.g. "6.00 AM - 10.00 PM" and
+    # crowd_info.best_time_to_visit ("Early morning (6:00 AM - 9:00 AM)")
+    opening_hours: str | None = None
+    best_time_to_visit: str | None = None
+    # Time spent at the stop; defaults to time_windows.default_visit_minutes
+    visit_minutes: float | None = Field(default=None, ge=0)
+
+
+class DaySplitOptions(BaseModel):
+    # Number of days of the trip. Used as-is when the daily limits allow it,
+    # otherwise the plan takes the fewest days that meet them.
+    days: int | None = Field(default=None, ge=1)
+    max_drive_minutes: float | None = Field(default=None, gt=0)
+    max_distance_km: float | None = Field(default=None, gt=0)
+
+    # Places to sleep. Each night is spent at the base with the smallest
+    # detour; without bases, near the last stop of the day.
+    overnight_bases: list[Destination] = Field(default_factory=list, max_length=100)
+
+    @model_validator(mode="after")
+    def _needs_days_or_limit(self) -> DaySplitOptions:
+        if self.days is None and self.max_drive_minutes is None and self.max_distance_km is None:
+            raise ValueError("day_split needs days, max_drive_minutes or max_distance_km")
+        return self
+
+
+class TimeWindowOptions(BaseModel):
+    # Departure time of the (each) day, 24-hour 'HH:MM'
+    start_time: str = Field(default="08:00", pattern=r"^([01]\d|2[0-3]):[0-5]\d$")
+    default_visit_minutes: float = Field(default=60.0, ge=0)
+    # Also require visits within best_time_to_visit where it overlaps the
+    # opening hours
+    use_best_time: bool = False
+
 
 class OptimizeRequest(BaseModel):
     itinerary: list[Destination] = Field(default_factory=list)
@@ -23,7 +60,11 @@ class OptimizeRequest(BaseModel):
     # Optimization metric source
     # - 'haversine': uses straight-line haversine distance
     # - 'google': uses Google Distance Matrix (driving + duration_in_traffic)
-    metric: str = Field(default="haversine", pattern="^(haversine|google)$")
+    # - 'road': driving distance/duration on the offline road graph (no
+    #   traffic, no outside service; see road_graph.py)
+    # - 'estimated': distance/duration/traffic predicted by a model fitted on
+    #   past Distance Matrix responses (no outside service; see estimator.py)
+    metric: str = Field(default="haversine", pattern="^(haversine|google|road|estimated)$")
 
     # What to optimize
     # - 'distance': minimize distance (km)
@@ -35,6 +76,95 @@ class OptimizeRequest(BaseModel):
     distance_weight: float = 1.0
     time_weight: float = 1.0
 
+    # Initial route for itineraries too large for the exact solver
+    # - 'nearest_neighbor': best nearest-neighbour walk (all starts if try_all_starts)
+    # - 'greedy_edge': cheapest edges first, no branching or cycles
+    # - 'christofides': MST + greedy odd-node matching, shortcut Euler tour
+    # - 'space_filling_curve': Hilbert-curve order of the coordinates (cheapest)
+    construction: str = Field(
+        default="nearest_neighbor",
+        pattern="^(nearest_neighbor|greedy_edge|christofides|space_filling_curve)$",
+    )
+
+    # Local search after construction
+    # - '2opt': segment reversals over all pairs of positions
+    # - 'or_opt': 2-opt + Or-opt (moving runs of 1-3 stops) between nearby
+    #   stops only, with don't-look bits; faster on large itineraries and
+    #   better on asymmetric (traffic) matrices
+    # - 'lk': 'or_opt' + Lin-Kernighan-style chains of 2-opt moves
+    improvement: str = Field(default="2opt", pattern="^(2opt|or_opt|lk)$")
+
+    # Wall-clock budget for the solve in milliseconds. When set, the best
+    # route found before the deadline is returned (always a valid order);
+    # when unset the solver runs to completion.
+    time_budget_ms: int | None = Field(default=None, ge=1, le=600_000)
+
+    # Worker processes for a parallel multi-start solve (every construction
+    # and several nearest-neighbour starts, each + `improvement`, best kept; with
+    # time_budget_ms, iterated local search until the deadline). Capped at
+    # the available CPUs; default OPTIMIZE_PARALLEL_WORKERS, else 1 (off).
+    workers: int | None = Field(default=None, ge=1, le=64)
+
+    # Split the optimized route into days (see DaySplitOptions)
+    day_split: DaySplitOptions | None = None
+
+    # Schedule visits inside opening hours (see TimeWindowOptions). With
+    # day_split, each day is scheduled from start_time.
+    time_windows: TimeWindowOptions | None = None
+
+    # Converts haversine km to driving time for day_split / time_windows when
+    # no Google durations are used
+    average_speed_kmh: float = Field(default=40.0, gt=0)
+
+    # When the route is driven (ISO 8601 or epoch seconds; without a zone,
+    # Sri Lanka time). For metric 'google' and 'estimated', matrices are
+    # taken for each hour the route spans and every leg is priced at its
+    # expected departure time; past times mean now. Unset: current traffic.
+    departure_time: datetime | None = None
+    # Hourly matrices (upstream fetches) at most; capped by
+    # MATRIX_MAX_TIME_SLICES (default 4), which is also the default.
+    time_slices: int | None = Field(default=None, ge=1, le=24)
+
+    # Keep the itinerary matrices of this solve for GET /matrices/{matrix_id}
+    # (the response then has a matrix_id)
+    store_matrices: bool = False
+
+
+class CatalogOptimizeRequest(OptimizeRequest):
+    # Catalog destination ids in itinerary order. The itinerary is filled in
+    # from the catalog, so `itinerary` is ignored.
+    destination_ids: list[str] = Field(..., min_length=1, max_length=5000)
+
+
+class IncrementalOptimizeRequest(OptimizeRequest):
+    # `optimized_order` previously returned for `itinerary`
+    current_order: list[int]
+    # Indices into `itinerary` of stops to drop
+    remove: list[int] = Field(default_factory=list)
+    # New stops. The edited itinerary is `itinerary` without the removed
+    # stops, followed by these; the response indexes into it.
+    insert: list[Destination] = Field(default_factory=list, max_length=1000)
+    # Stops on each side of an edit that local search may move
+    repair_radius: int = Field(default=3, ge=0, le=100)
+
+    @model_validator(mode="after")
+    def _valid_edit(self) -> IncrementalOptimizeRequest:
+        n = len(self.itinerary)
+        if sorted(self.current_order) != list(range(n)):
+            raise ValueError("current_order must be a permutation of the itinerary indices")
+        if len(set(self.remove)) != len(self.remove) or any(not 0 <= i < n for i in self.remove):
+            raise ValueError("remove must hold distinct itinerary indices")
+        if len(self.remove) == n and not self.insert:
+            raise ValueError("the edit must leave at least one stop")
+        return self
+
+
+class BatchOptimizeRequest(BaseModel):
+    # Each item is an OptimizeRequest payload. Items are validated one by one
+    # so a malformed item is reported on its own NDJSON line instead of
+    # rejecting the whole batch.
+    items: list[dict[str, Any]] = Field(default_factory=list, max_length=5000)
+
 
 class Segment(BaseModel):
     from_index: int
@@ -44,6 +174,32 @@ class Segment(BaseModel):
     duration_in_traffic_seconds: float | None = None
 
 
+class DayRoute(BaseModel):
+    day: int
+    # Indices into the request itinerary, in visiting order
+    optimized_order: list[int]
+    # Indices into day_split.overnight_bases, if bases were given
+    start_base_index: int | None = None
+    end_base_index: int | None = None
+    # Driving of the day, including legs to and from the bases
+    distance_km: float
+    drive_seconds: float
+    # True if the day breaks a daily limit (an unreachable stop on its own day)
+    over_limit: bool = False
+
+
+class ScheduledStop(BaseModel):
+    index: int
+    day: int | None = None
+    # 'HH:MM'; hours run past 24 if a day ends after midnight
+    arrival: str
+    start: str
+    departure: str
+    wait_minutes: float
+    # False if no opening window could be met; such stops come last
+    feasible: bool
+
+
 class OptimizeResponse(BaseModel):
     optimized_order: list[int]
     total_distance_km: float
@@ -51,8 +207,75 @@ class OptimizeResponse(BaseModel):
     total_duration_in_traffic_seconds: float | None = None
     metric_used: str
     optimize_for: str
+    # 'held_karp' (exact) for small itineraries, otherwise 'greedy_2opt'
+    # ('warm_start_<improvement>' when seeded from the result cache)
+    solver: str
+    # True when the order is proven minimum-cost for the chosen objective
+    optimal: bool
+    # Solve wall time and improving local-search moves applied
+    elapsed_ms: float = 0.0
+    iterations: int = 0
+    # True if time_budget_ms stopped the search before it converged
+    timed_out: bool = False
+    # One route per day when day_split was requested
+    days: list[DayRoute] | None = None
+    # Arrival times when time_windows was requested
+    schedule: list[ScheduledStop] | None = None
+    infeasible_indices: list[int] = Field(default_factory=list)
+    # Positions in `segments` of legs whose matrix element could not be
+    # fetched (or has no road route); they are priced as unreachable
+    failed_legs: list[int] = Field(default_factory=list)
     optimized_itinerary: list[Destination]
     segments: list[Segment]
+    # Id of the cost/distance/duration matrices of this solve, to fetch from
+    # GET /matrices/{matrix_id}; only with store_matrices (never for batch items)
+    matrix_id: str | None = None
+    # Hourly matrices the legs were priced with (requests with departure_time)
+    time_slices: int | None = None
+    # Result cache outcome: 'hit' (route reused, not solved), 'warm_start'
+    # (local search seeded with the route cached for the same stops) or 'miss'
+    result_cache: str | None = None
+
+
+class NearbyRequest(BaseModel):
+    location: LatLng
+    # The k nearest catalog destinations, optionally only within radius_km
+    k: int = Field(default=10, ge=1, le=1000)
+    radius_km: float | None = Field(default=None, gt=0)
+    exclude_ids: list[str] = Field(default_factory=list)
+
+
+class NearbyDestination(BaseModel):
+    id: str
+    name: str
+    location: LatLng
+    distance_km: float
+
+
+class NearbyResponse(BaseModel):
+    results: list[NearbyDestination] = Field(default_factory=list)
+
+
+class DetourRequest(BaseModel):
+    # Stops or polyline points of the route, in travel order
+    route: list[LatLng] = Field(..., min_length=2, max_length=10000)
+    # Extra straight-line km a stop may add to the leg it is inserted into
+    max_detour_km: float = Field(default=10.0, gt=0)
+    limit: int = Field(default=20, ge=1, le=1000)
+    exclude_ids: list[str] = Field(default_factory=list)
+
+
+class DetourCandidate(BaseModel):
+    id: str
+    name: str
+    location: LatLng
+    detour_km: float
+    # Insert between route[insert_after] and route[insert_after + 1]
+    insert_after: int
+
+
+class DetourResponse(BaseModel):
+    candidates: list[DetourCandidate] = Field(default_factory=list)
 
 
 class TrafficRouteRequest(BaseModel):
@@ -63,6 +286,12 @@ class TrafficRouteRequest(BaseModel):
     # Google Routes API travel modes (subset for our UI)
     travel_mode: str = Field(default="DRIVE", pattern="^(DRIVE|TWO_WHEELER)$")
 
+    # Simplify the polyline for display: `zoom` (Web Mercator level the line
+    # is drawn at, ~1 px tolerance) or an explicit `tolerance_m`, which wins.
+    # Without either the full-detail line is returned.
+    zoom: int | None = Field(default=None, ge=0, le=22)
+    tolerance_m: float | None = Field(default=None, ge=0)
+
 
 class SpeedInterval(BaseModel):
     start_index: int
@@ -0,0 +1,229 @@
+from __future__ import annotations
+
+import time
+from concurrent.futures import Executor
+from functools import partial
+from multiprocessing import shared_memory
+from typing import Sequence
+
+import numpy as np
+
+try:
+    from .construction import CONSTRUCTIONS
+    from .local_search import IMPROVEMENT_EPS, SearchStats, deadline_passed, neighbor_lists, or_opt, two_opt
+    from .optimizer import SolveResult, construct_route, greedy_nearest_neighbor, path_length
+except ImportError:  # pragma: no cover
+    from construction import CONSTRUCTIONS
+    from local_search import IMPROVEMENT_EPS, SearchStats, deadline_passed, neighbor_lists, or_opt, two_opt
+    from optimizer import SolveResult, construct_route, greedy_nearest_neighbor, path_length
+
+# A seed is a construction name, or ("nearest_neighbor", start node).
+Seed = tuple[str, int | None]
+
+
+def plan_seeds(n: int, workers: int, *, try_all_starts: bool, has_coords: bool) -> list[list[Seed]]:
+    """Starting routes for each worker: every construction heuristic once,
+    then nearest-neighbour walks from start nodes spread over the itinerary
+    (only node 0 when the start is pinned)."""
+    seeds: list[Seed] = [(c, None) for c in CONSTRUCTIONS if c != "space_filling_curve" or has_coords]
+    if try_all_starts:
+        count = min(n, max(2 * workers, 4))
+        seeds += [("nearest_neighbor", int(s)) for s in np.linspace(0, n - 1, count).round().astype(int)]
+    chunks: list[list[Seed]] = [[] for _ in range(workers)]
+    for k, seed in enumerate(seeds):
+        chunks[k % workers].append(seed)
+    return chunks
+
+
+def _double_bridge(tour: list[int], rng: np.random.Generator) -> list[int]:
+    """Random 4-opt 'double bridge' kick that keeps the first and last stop."""
+    n = len(tour)
+    a, b, c = sorted(rng.choice(np.arange(1, n - 1), size=3, replace=False).tolist())
+    return tour[:a] + tour[b:c] + tour[a:b] + tour[c:]
+
+
+def _search(
+    cost: np.ndarray,
+    seeds: Sequence[Seed],
+    *,
+    return_to_start: bool,
+    try_all_starts: bool,
+    coords: np.ndarray | None,
+    deadline: float | None,
+    rng_seed: int,
+    improvement: str = "2opt",
+    initial_order: list[int] | None = None,
+) -> tuple[list[int], float, int, bool]:
+    """Improve `initial_order` (when given) and every seed with the
+    `improvement` local search, then, while time remains, kick the best tour
+    with double bridges (iterated local search)."""
+    if deadline_passed(deadline):
+        # Out of time before starting: the given route, or the quickest
+        # fallback of the first seed's construction, without local search.
+        if initial_order is not None:
+            order = list(initial_order)
+        else:
+            name = seeds[0][0] if seeds else "nearest_neighbor"
+            order, _ = construct_route(
+                cost,
+                name,
+                return_to_start=return_to_start,
+                try_all_starts=try_all_starts,
+                coords=coords,
+                deadline=deadline,
+            )
+        return order, float(path_length(cost, order, return_to_start)), 0, True
+
+    stats = SearchStats()
+    if improvement == "2opt":
+        local_search = partial(two_opt, cost)
+    else:
+        # Neighbour lists are built once and shared by every seed and kick.
+        local_search = partial(or_opt, cost, lk=improvement == "lk", neighbors=neighbor_lists(cost))
+    best: list[int] = []
+    best_cost = np.inf
+    if initial_order is not None:
+        best = local_search(list(initial_order), deadline=deadline, stats=stats)
+        best_cost = path_length(cost, best, return_to_start)
+    for name, start in seeds:
+        if best and deadline_passed(deadline):
+            stats.timed_out = True
+            break
+        if start is not None:
+            order = greedy_nearest_neighbor(cost, start)
+        else:
+            order, _ = construct_route(
+                cost,
+                name,
+                return_to_start=return_to_start,
+                try_all_starts=try_all_starts,
+                coords=coords,
+                deadline=deadline,
+            )
+        order = local_search(order, deadline=deadline, stats=stats)
+        value = path_length(cost, order, return_to_start)
+        if value < best_cost:
+            best, best_cost = order, value
+
+    # Only an unfinished seed counts as cut short; the kicks below always
+    # run until the deadline.
+    timed_out = stats.timed_out
+    if deadline is not None and len(best) >= 5:
+        rng = np.random.default_rng(rng_seed)
+        while not deadline_passed(deadline):
+            candidate = local_search(_double_bridge(best, rng), deadline=deadline, stats=stats)
+            value = path_length(cost, candidate, return_to_start)
+            if value < best_cost - IMPROVEMENT_EPS:
+                best, best_cost = candidate, value
+    return best, float(best_cost), stats.moves, timed_out
+
+
+def _worker(
+    shm_name: str,
+    shape: tuple[int, int],
+    seeds: list[Seed],
+    return_to_start: bool,
+    try_all_starts: bool,
+    coords: np.ndarray | None,
+    deadline_epoch: float | None,
+    rng_seed: int,
+    improvement: str,
+    initial_order: list[int] | None = None,
+) -> tuple[list[int], float, int, bool]:
+    """Process-pool entry point: map the shared cost matrix and search."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    cost: np.ndarray | None = None
+    try:
+        cost = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        # Deadlines cross processes as wall-clock time.
+        deadline = None
+        if deadline_epoch is not None:
+            deadline = time.perf_counter() + (deadline_epoch - time.time())
+        return _search(
+            cost,
+            seeds,
+            return_to_start=return_to_start,
+            try_all_starts=try_all_starts,
+            coords=coords,
+            deadline=deadline,
+            rng_seed=rng_seed,
+            improvement=improvement,
+            initial_order=initial_order,
+        )
+    finally:
+        # The buffer cannot be closed while an array still points into it.
+        del cost
+        shm.close()
+
+
+def parallel_multistart(
+    cost: np.ndarray,
+    *,
+    pool: Executor,
+    workers: int,
+    return_to_start: bool,
+    try_all_starts: bool,
+    coords: Sequence[tuple[float, float]] | np.ndarray | None = None,
+    time_budget_ms: float | None = None,
+    improvement: str = "2opt",
+    initial_order: list[int] | None = None,
+) -> SolveResult:
+    """Run construction + local search (`improvement`) from several seeds on
+    `workers` pool processes and keep the cheapest route.
+
+    The cost matrix is placed in shared memory once; workers map it instead
+    of receiving a pickled copy. Without a time budget each worker improves
+    its seeds and stops; with one, workers keep kicking their best route
+    (iterated local search) until the deadline. Results are combined in task
+    order, so the outcome does not depend on which worker finishes first.
+
+    `initial_order` (e.g. a cached route for the same stops) is improved by
+    the first worker before its seeds, and the solver is then reported as
+    'warm_start_multistart_<improvement>'.
+    """
+    started = time.perf_counter()
+    c = np.ascontiguousarray(cost, dtype=np.float64)
+    n = len(c)
+    pts = np.asarray(coords, dtype=np.float64) if coords is not None and len(coords) == n else None
+    deadline_epoch = time.time() + time_budget_ms / 1000.0 if time_budget_ms is not None else None
+    chunks = [
+        chunk
+        for chunk in plan_seeds(n, max(1, workers), try_all_starts=try_all_starts, has_coords=pts is not None)
+        if chunk
+    ]
+
+    shm = shared_memory.SharedMemory(create=True, size=max(c.nbytes, 1))
+    try:
+        np.ndarray(c.shape, dtype=np.float64, buffer=shm.buf)[:] = c
+        futures = [
+            pool.submit(
+                _worker,
+                shm.name,
+                c.shape,
+                chunk,
+                return_to_start,
+                try_all_starts,
+                pts,
+                deadline_epoch,
+                k,
+                improvement,
+                initial_order if k == 0 else None,
+            )
+            for k, chunk in enumerate(chunks)
+        ]
+        results = [f.result() for f in futures]
+    finally:
+        shm.close()
+        shm.unlink()
+
+    order, _, _, _ = min(results, key=lambda r: r[1])
+    elapsed_ms = (time.perf_counter() - started) * 1000.0
+    return SolveResult(
+        order=order,
+        solver=f"{'warm_start_' if initial_order is not None else ''}multistart_{improvement}",
+        optimal=False,
+        elapsed_ms=elapsed_ms,
+        iterations=sum(r[2] for r in results),
+        timed_out=any(r[3] for r in results),
+        stages={"multistart": elapsed_ms},
+    )
@@ -1,8 +1,27 @@
 from __future__ import annotations
 
 import math
+import time
+from dataclasses import dataclass, field
+
+import numpy as np
+
+try:
+    from .construction import christofides_like, cycle_to_route, greedy_edge
+    from .construction import nearest_neighbor_multistart, space_filling_curve, walk_lengths
+    from .exact import HELD_KARP_MAX_N, held_karp, held_karp_estimate_ms
+    from .local_search import SearchStats, deadline_passed, improve, two_opt
+except ImportError:  # pragma: no cover
+    from construction import christofides_like, cycle_to_route, greedy_edge
+    from construction import nearest_neighbor_multistart, space_filling_curve, walk_lengths
+    from exact import HELD_KARP_MAX_N, held_karp, held_karp_estimate_ms
+    from local_search import SearchStats, deadline_passed, improve, two_opt
+
 EARTH_RADIUS_KM = 6371.0088
 
+# Optimizers accept nested lists or (N, N) NumPy arrays.
+CostMatrix = list[list[float]] | np.ndarray
+
 
 def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
     """Great-circle distance between two points on Earth."""
@@ -32,9 +51,38 @@ def build_distance_matrix(coords: list[tuple[float, float]]) -> list[list[float]
     return dist
 
 
-def path_length(dist: list[list[float]], order: list[int], return_to_start: bool) -> float:
+def build_distance_matrix_array(
+    coords: list[tuple[float, float]] | np.ndarray,
+    dtype: np.dtype | type = np.float64,
+) -> np.ndarray:
+    """Vectorized haversine matrix: one NumPy pass instead of N^2 scalar calls.
+
+    `coords` is a sequence of (lat, lng) pairs or an (N, 2) array. Returns an
+    (N, N) array of kilometres; pass `dtype=np.float32` to halve memory for
+    large matrices.
+    """
+    pts = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    lat = np.radians(pts[:, 0])
+    lng = np.radians(pts[:, 1])
+
+    dlat = lat[None, :] - lat[:, None]
+    dlng = lng[None, :] - lng[:, None]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin(dlng / 2) ** 2
+    dist = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+    np.fill_diagonal(dist, 0.0)
+    return dist.astype(dtype, copy=False)
+
+
+def path_length(dist: CostMatrix, order: list[int], return_to_start: bool) -> float:
     if len(order) <= 1:
         return 0.0
+    if isinstance(dist, np.ndarray):
+        idx = np.asarray(order, dtype=np.intp)
+        # cumsum adds sequentially, matching the list loop below bit for bit.
+        total = float(np.cumsum(dist[idx[:-1], idx[1:]], dtype=np.float64)[-1])
+        if return_to_start:
+            total += float(dist[idx[-1], idx[0]])
+        return total
     total = 0.0
     for a, b in zip(order, order[1:]):
         total += dist[a][b]
@@ -43,65 +91,51 @@ def path_length(dist: list[list[float]], order: list[int], return_to_start: bool
     return total
 
 
-def two_opt_open_path_any(cost: list[list[float]], order: list[int]) -> list[int]:
+def two_opt_open_path_any(
+    cost: CostMatrix,
+    order: list[int],
+    *,
+    deadline: float | None = None,
+    stats: SearchStats | None = None,
+) -> list[int]:
     """2-opt improvement for an OPEN path that works for asymmetric matrices.
 
-    Uses full path cost evaluation per swap (OK for small N).
+    Moves are delta-evaluated (see `local_search.two_opt`), so a full pass is
+    O(n^2) rather than O(n^3).
     """
-    n = len(order)
-    if n < 4:
-        return order
+    return two_opt(cost, order, deadline=deadline, stats=stats)
 
-    best = order
-    best_cost = path_length(cost, best, return_to_start=False)
-
-    improved = True
-    while improved:
-        improved = False
-        for i in range(1, n - 2):
-            for k in range(i + 1, n - 1):
-                candidate = best[:]
-                candidate[i : k + 1] = reversed(candidate[i : k + 1])
-                c = path_length(cost, candidate, return_to_start=False)
-                if c + 1e-12 < best_cost:
-                    best = candidate
-                    best_cost = c
-                    improved = True
-        # loop again if improved
 
-    return best
-
-
-def two_opt_cycle_any(cost: list[list[float]], order: list[int]) -> list[int]:
+def two_opt_cycle_any(
+    cost: CostMatrix,
+    order: list[int],
+    *,
+    deadline: float | None = None,
+    stats: SearchStats | None = None,
+) -> list[int]:
     """2-opt improvement for a closed tour that works for asymmetric matrices."""
-    n = len(order)
-    if n < 4:
-        return order
-
-    best = order
-    best_cost = path_length(cost, best, return_to_start=True)
-
-    improved = True
-    while improved:
-        improved = False
-        for i in range(1, n - 1):
-            for k in range(i + 1, n):
-                candidate = best[:]
-                candidate[i:k] = reversed(candidate[i:k])
-                c = path_length(cost, candidate, return_to_start=True)
-                if c + 1e-12 < best_cost:
-                    best = candidate
-                    best_cost = c
-                    improved = True
+    return two_opt(cost, order, deadline=deadline, stats=stats)
 
-    return best
 
-
-def greedy_nearest_neighbor(dist: list[list[float]], start: int = 0) -> list[int]:
+def greedy_nearest_neighbor(dist: CostMatrix, start: int = 0) -> list[int]:
     n = len(dist)
     if n == 0:
         return []
 
+    if isinstance(dist, np.ndarray):
+        # Masked argmin per step; ties resolve to the lowest index, like `min`
+        # over the small-int set below.
+        visited = np.zeros(n, dtype=bool)
+        visited[start] = True
+        order = [start]
+        current = start
+        for _ in range(n - 1):
+            remaining = np.flatnonzero(~visited)
+            current = int(remaining[np.argmin(dist[current, remaining])])
+            visited[current] = True
+            order.append(current)
+        return order
+
     unvisited = set(range(n))
     order = [start]
     unvisited.remove(start)
@@ -116,42 +150,229 @@ def greedy_nearest_neighbor(dist: list[list[float]], start: int = 0) -> list[int
     return order
 
 
-def best_greedy_route(dist: list[list[float]], try_all_starts: bool) -> list[int]:
+def best_greedy_route(dist: CostMatrix, try_all_starts: bool) -> list[int]:
     n = len(dist)
     if n == 0:
         return []
     if not try_all_starts or n == 1:
         return greedy_nearest_neighbor(dist, 0)
 
-    best_order: list[int] | None = None
-    best_len = float("inf")
-    for start in range(n):
-        order = greedy_nearest_neighbor(dist, start)
-        length = path_length(dist, order, return_to_start=False)
-        if length < best_len:
-            best_len = length
-            best_order = order
-    return best_order or greedy_nearest_neighbor(dist, 0)
+    # All starts run in lockstep; argmin keeps the first shortest walk, as the
+    # old per-start loop with a strict `<` did.
+    walks = nearest_neighbor_multistart(dist)
+    return walks[int(walk_lengths(dist, walks).argmin())].tolist()
+
+
+def _nearest_neighbor_anytime(
+    cost: CostMatrix,
+    *,
+    try_all_starts: bool,
+    deadline: float,
+    chunk: int = 32,
+) -> list[int] | None:
+    """`best_greedy_route` that tries starts in chunks until `deadline`.
+
+    Returns the best complete walk so far, or None if not even one finished.
+    With enough time the result equals `best_greedy_route`.
+    """
+    n = len(cost)
+    starts = np.arange(n) if try_all_starts else np.zeros(1, dtype=np.intp)
+    best: list[int] | None = None
+    best_len = math.inf
+    for lo in range(0, len(starts), chunk):
+        walks = nearest_neighbor_multistart(cost, starts=starts[lo : lo + chunk], deadline=deadline)
+        if walks is None:
+            break
+        lengths = walk_lengths(cost, walks)
+        k = int(lengths.argmin())
+        if lengths[k] < best_len:
+            best_len = float(lengths[k])
+            best = walks[k].tolist()
+        if deadline_passed(deadline):
+            break
+    return best
+
+
+def construct_route(
+    cost: CostMatrix,
+    construction: str,
+    *,
+    return_to_start: bool,
+    try_all_starts: bool,
+    coords: list[tuple[float, float]] | np.ndarray | None = None,
+    deadline: float | None = None,
+) -> tuple[list[int], str]:
+    """Initial route for local search, built by the named construction
+    heuristic, and the construction that built it.
+
+    'space_filling_curve' needs `coords` and falls back to nearest-neighbour
+    without them.
+
+    With a `deadline`, a valid route is always returned: the Hilbert-curve
+    order (or one nearest-neighbour walk without coordinates) is used when
+    the requested heuristic does not finish in time.
+    """
+    start = None if try_all_starts else 0
+    has_coords = coords is not None and len(coords) == len(cost)
+
+    def fallback() -> tuple[list[int], str]:
+        if has_coords:
+            cycle = space_filling_curve(coords)
+            return cycle_to_route(cost, cycle, return_to_start=return_to_start, start=start), "space_filling_curve"
+        walk = nearest_neighbor_multistart(cost, starts=[start or 0])
+        return walk[0].tolist(), "nearest_neighbor"
+
+    if deadline is not None and deadline_passed(deadline):
+        return fallback()
+    if construction == "nearest_neighbor" and deadline is not None:
+        order = _nearest_neighbor_anytime(cost, try_all_starts=try_all_starts, deadline=deadline)
+        return (order, construction) if order is not None else fallback()
+    if construction == "greedy_edge":
+        order = greedy_edge(cost, start=start, deadline=deadline)
+        return (order, construction) if order is not None else fallback()
+    if construction == "christofides":
+        cycle = christofides_like(cost, deadline=deadline)
+        if cycle is None:
+            return fallback()
+        return cycle_to_route(cost, cycle, return_to_start=return_to_start, start=start), construction
+    if construction == "space_filling_curve" and has_coords:
+        cycle = space_filling_curve(coords)
+        return cycle_to_route(cost, cycle, return_to_start=return_to_start, start=start), construction
+    return best_greedy_route(cost, try_all_starts=try_all_starts), "nearest_neighbor"
+
+
+@dataclass
+class SolveResult:
+    order: list[int]
+    # Which solver produced `order`: 'held_karp', 'greedy_<improvement>'
+    # (nearest-neighbour + local search, e.g. 'greedy_2opt') or
+    # '<construction>_<improvement>' for the other construction heuristics.
+    solver: str
+    # True when `order` is proven to be a minimum-cost ordering.
+    optimal: bool
+    # Wall time spent solving, in milliseconds.
+    elapsed_ms: float = 0.0
+    # Improving local-search moves applied.
+    iterations: int = 0
+    # True if the time budget cut the search short.
+    timed_out: bool = False
+    # Milliseconds per solver stage: 'exact', or 'construct' and 'local_search'.
+    stages: dict[str, float] = field(default_factory=dict)
+
+
+def solve_order_from_cost_matrix(
+    cost: CostMatrix,
+    *,
+    return_to_start: bool,
+    try_all_starts: bool,
+    exact_max_n: int = HELD_KARP_MAX_N,
+    construction: str = "nearest_neighbor",
+    coords: list[tuple[float, float]] | np.ndarray | None = None,
+    time_budget_ms: float | None = None,
+    improvement: str = "2opt",
+    initial_order: list[int] | None = None,
+) -> SolveResult:
+    """Pick a solver by size: exact Held-Karp for small inputs, else a
+    construction heuristic (see `construct_route`) + local search, named by
+    `improvement` (see `local_search.IMPROVEMENTS`).
+
+    `initial_order` (e.g. a cached route for the same stops) replaces the
+    construction: local search starts from it and the solver is
+    'warm_start_<improvement>'. Held-Karp sizes ignore it.
+
+    `try_all_starts=False` pins the first itinerary entry as the start for
+    both solvers.
+
+    With `time_budget_ms`, the solve is anytime: Held-Karp only runs if its
+    estimated cost fits the budget, construction falls back to a cheap seed,
+    and 2-opt stops at the deadline with the best tour so far.
+    """
+    started = time.perf_counter()
+    deadline = construction_deadline = None
+    if time_budget_ms is not None:
+        deadline = started + time_budget_ms / 1000.0
+        # Leave half of the budget for local search.
+        construction_deadline = started + time_budget_ms / 2000.0
+
+    stages: dict[str, float] = {}
+    mark = started
+
+    def lap(name: str) -> None:
+        nonlocal mark
+        now = time.perf_counter()
+        stages[name] = (now - mark) * 1000.0
+        mark = now
+
+    def finish(order: list[int], solver: str, optimal: bool, stats: SearchStats | None = None) -> SolveResult:
+        return SolveResult(
+            order=order,
+            solver=solver,
+            optimal=optimal,
+            elapsed_ms=(time.perf_counter() - started) * 1000.0,
+            iterations=stats.moves if stats else 0,
+            timed_out=stats.timed_out if stats else False,
+            stages=stages,
+        )
+
+    n = len(cost)
+    if n <= exact_max_n and (time_budget_ms is None or held_karp_estimate_ms(n) <= time_budget_ms):
+        order = held_karp(
+            cost,
+            return_to_start=return_to_start,
+            start=None if try_all_starts else 0,
+        )
+        lap("exact")
+        return finish(order, "held_karp", True)
+
+    if initial_order is not None:
+        order = list(initial_order)
+        construction = "warm_start"
+    else:
+        if construction == "space_filling_curve" and (coords is None or len(coords) != n):
+            construction = "nearest_neighbor"
+        order, construction = construct_route(
+            cost,
+            construction,
+            return_to_start=return_to_start,
+            try_all_starts=try_all_starts,
+            coords=coords,
+            deadline=construction_deadline,
+        )
+        lap("construct")
+    stats = SearchStats()
+    if deadline_passed(deadline):
+        stats.timed_out = True
+    elif improvement != "2opt":
+        order = improve(cost, order, improvement=improvement, deadline=deadline, stats=stats)
+    elif return_to_start:
+        order = two_opt_cycle_any(cost, order, deadline=deadline, stats=stats)
+    else:
+        order = two_opt_open_path_any(cost, order, deadline=deadline, stats=stats)
+    lap("local_search")
+    prefix = "greedy" if construction == "nearest_neighbor" else construction
+    solver = f"{prefix}_{improvement}"
+    return finish(order, solver, False, stats)
 
 
 def optimize_order_from_cost_matrix(
-    cost: list[list[float]],
+    cost: CostMatrix,
     *,
     return_to_start: bool,
     try_all_starts: bool,
 ) -> list[int]:
-    order = best_greedy_route(cost, try_all_starts=try_all_starts)
-    if return_to_start:
-        return two_opt_cycle_any(cost, order)
-    return two_opt_open_path_any(cost, order)
+    return solve_order_from_cost_matrix(
+        cost,
+        return_to_start=return_to_start,
+        try_all_starts=try_all_starts,
+    ).order
 
 
 def optimize_route(
     coords: list[tuple[float, float]],
     return_to_start: bool = False,
     try_all_starts: bool = True,
-) -> tuple[list[int], list[list[float]]]:
-    dist = build_distance_matrix(coords)
+) -> tuple[list[int], np.ndarray]:
+    dist = build_distance_matrix_array(coords)
     order = optimize_order_from_cost_matrix(
         dist,
         return_to_start=return_to_start,
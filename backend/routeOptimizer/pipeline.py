@@ -0,0 +1,521 @@
+from __future__ import annotations
+
+import time
+from functools import partial
+from itertools import accumulate
+from typing import Callable
+
+import numpy as np
+
+try:
+    from .catalog_matrix import CatalogMatrix
+    from .day_planner import split_into_days, with_stops
+    from .matrix_store import MatrixStore
+    from .metrics import RESULT_CACHE_LOOKUPS, StageTimer
+    from .models import DayRoute, Destination, LatLng, OptimizeRequest, OptimizeResponse, ScheduledStop, Segment
+    from .optimizer import (
+        SolveResult,
+        build_distance_matrix_array,
+        greedy_nearest_neighbor,
+        path_length,
+        solve_order_from_cost_matrix,
+    )
+    from .result_cache import ResultCache, Signature
+    from .time_slices import TimeSlices
+    from .time_windows import (
+        ALL_DAY,
+        Window,
+        format_clock,
+        intersect,
+        parse_best_time,
+        parse_clock,
+        parse_opening_hours,
+        solve_time_windows,
+    )
+except ImportError:  # pragma: no cover
+    from catalog_matrix import CatalogMatrix
+    from day_planner import split_into_days, with_stops
+    from matrix_store import MatrixStore
+    from metrics import RESULT_CACHE_LOOKUPS, StageTimer
+    from models import DayRoute, Destination, LatLng, OptimizeRequest, OptimizeResponse, ScheduledStop, Segment
+    from optimizer import (
+        SolveResult,
+        build_distance_matrix_array,
+        greedy_nearest_neighbor,
+        path_length,
+        solve_order_from_cost_matrix,
+    )
+    from result_cache import ResultCache, Signature
+    from time_slices import TimeSlices
+    from time_windows import (
+        ALL_DAY,
+        Window,
+        format_clock,
+        intersect,
+        parse_best_time,
+        parse_clock,
+        parse_opening_hours,
+        solve_time_windows,
+    )
+
+
+def _mean_off_diagonal(m: np.ndarray) -> float:
+    """Mean of the reachable (< 1e8) off-diagonal entries, or 1.0 if none."""
+    mask = ~np.eye(len(m), dtype=bool) & (m < 1e8)
+    if not mask.any():
+        return 1.0
+    return float(m[mask].mean())
+
+
+def _hybrid_cost_matrix(
+    distance_km: np.ndarray,
+    duration_s: np.ndarray,
+    *,
+    distance_weight: float,
+    time_weight: float,
+    scale_like: tuple[np.ndarray, np.ndarray] | None = None,
+) -> np.ndarray:
+    # Normalize both matrices to a similar scale before weighting them.
+    # `scale_like` takes the scales from other matrices (the departure slice,
+    # so every time slice is weighted alike).
+    dist_mean = _mean_off_diagonal(scale_like[0] if scale_like is not None else distance_km)
+    time_mean = _mean_off_diagonal(scale_like[1] if scale_like is not None else duration_s)
+    dist_scale = dist_mean if dist_mean > 0 else 1.0
+    time_scale = time_mean if time_mean > 0 else 1.0
+    return distance_weight * (distance_km / dist_scale) + time_weight * (duration_s / time_scale)
+
+
+def _cost_matrix(
+    req: OptimizeRequest,
+    distance_km: np.ndarray,
+    duration_in_traffic_s: np.ndarray | None,
+    scale_like: tuple[np.ndarray, np.ndarray] | None = None,
+) -> np.ndarray:
+    """What the solver minimizes for `req.optimize_for`. Without durations
+    (haversine) that is always the distance."""
+    if duration_in_traffic_s is None:
+        return distance_km
+    if req.optimize_for == "time":
+        return duration_in_traffic_s
+    if req.optimize_for == "hybrid":
+        return _hybrid_cost_matrix(
+            distance_km,
+            duration_in_traffic_s,
+            distance_weight=req.distance_weight,
+            time_weight=req.time_weight,
+            scale_like=scale_like,
+        )
+    return distance_km
+
+
+def matrix_coords(req: OptimizeRequest) -> list[tuple[float, float]]:
+    """Points the cost matrices must cover: the itinerary, then any overnight bases."""
+    points = list(req.itinerary)
+    if req.day_split is not None:
+        points += req.day_split.overnight_bases
+    return [(d.location.lat, d.location.lng) for d in points]
+
+
+def _visit_windows(req: OptimizeRequest, n_nodes: int) -> tuple[list[tuple[Window, ...]], list[float]]:
+    """Opening windows and visit durations (seconds) of every matrix node;
+    overnight bases are always open and take no time."""
+    options = req.time_windows
+    assert options is not None
+    windows: list[tuple[Window, ...]] = [ALL_DAY] * n_nodes
+    service_s = [0.0] * n_nodes
+    for i, d in enumerate(req.itinerary):
+        open_windows = parse_opening_hours(d.opening_hours)
+        if options.use_best_time:
+            preferred = intersect(open_windows, parse_best_time(d.best_time_to_visit))
+            if preferred:
+                open_windows = preferred
+        windows[i] = open_windows
+        minutes = d.visit_minutes if d.visit_minutes is not None else options.default_visit_minutes
+        service_s[i] = minutes * 60.0
+    return windows, service_s
+
+
+# Time-window relocations are cubic in the stops; without `time_budget_ms`
+# they stop after this long.
+_TIME_WINDOWS_DEFAULT_BUDGET_S = 1.0
+
+# Longest day `route_horizon_s` assumes when the route is split into days;
+# each day departs at the same time of day.
+_MAX_DAY_S = 12 * 3600.0
+
+
+def route_horizon_s(req: OptimizeRequest, drive_s: np.ndarray) -> float:
+    """Rough time from departure to the last stop: a nearest-neighbour walk
+    on `drive_s` plus the visits. Decides how many hourly slices to fetch."""
+    n = len(req.itinerary)
+    if n < 2:
+        return 0.0
+    walk = greedy_nearest_neighbor(drive_s[:n, :n], start=0)
+    horizon = path_length(drive_s[:n, :n], walk, return_to_start=req.return_to_start)
+    if req.time_windows is not None:
+        horizon += sum(_visit_windows(req, n)[1])
+    if req.day_split is not None:
+        horizon = min(horizon, _MAX_DAY_S)
+    return horizon
+
+
+def catalog_itinerary(catalog: CatalogMatrix, idx: np.ndarray) -> list[Destination]:
+    """Itinerary entries of the catalog rows `idx`."""
+    itinerary: list[Destination] = []
+    for k in idx.tolist():
+        entry = catalog.destinations[k]
+        itinerary.append(
+            Destination(
+                id=entry["id"],
+                name=entry["name"],
+                location=LatLng(lat=entry["lat"], lng=entry["lng"]),
+                description=entry.get("description"),
+                opening_hours=entry.get("opening_hours"),
+                best_time_to_visit=entry.get("best_time_to_visit"),
+            )
+        )
+    return itinerary
+
+
+def optimize_itinerary(
+    req: OptimizeRequest,
+    google_matrices: dict[str, np.ndarray] | None = None,
+    haversine_km: np.ndarray | None = None,
+    timer: StageTimer | None = None,
+    solve: Callable[[np.ndarray], SolveResult] | None = None,
+    matrix_store: MatrixStore | None = None,
+    time_slices: TimeSlices | None = None,
+    result_cache: ResultCache | None = None,
+    refine: bool = True,
+) -> OptimizeResponse:
+    """Solve one `/optimize` request.
+
+    `google_matrices` is the result of `fetch_distance_matrix` over
+    `matrix_coords(req)` for `metric=google` (or `RoadGraph.matrix` for
+    `metric=road` and `TravelTimeEstimator.matrix` for `metric=estimated`,
+    which have the same keys); without it haversine distances
+    are used, taken from `haversine_km` when the caller already has them
+    (e.g. sliced from the catalog matrix). This is plain CPU work with no
+    I/O, so it can run in a thread or a worker process.
+
+    Stage times (matrix, solver stages, days, time_windows, response) are
+    added to `timer` when one is passed. `solve` replaces the solver: it gets
+    the itinerary cost matrix and returns the order (e.g. an incremental
+    repair of a previous route), plus `initial_order` when the result cache
+    has a near miss. With `matrix_store` and `req.store_matrices`,
+    the itinerary matrices are kept there and the response carries their
+    `matrix_id`.
+
+    `time_slices` holds the matrices of each hour the route spans from
+    `req.departure_time` (`google_matrices` is then its first slice): the
+    solved route (each day of it, with `day_split`) is refined with every
+    leg priced at its departure slice, unless `refine` is False (incremental
+    repairs, which keep the rest of the route), and segments and totals are
+    reported that way.
+
+    With `result_cache`, a route solved before for the same stops and
+    options is reused without solving, and one for the same stops with other
+    options seeds local search; the solved route is then cached.
+    """
+    started = time.perf_counter()
+    timer = timer if timer is not None else StageTimer()
+    itinerary = req.itinerary
+    n = len(itinerary)
+    all_coords = matrix_coords(req)
+    coords = all_coords[:n]
+
+    # Default: haversine distance
+    distance_km_matrix: np.ndarray
+    duration_s_matrix: np.ndarray | None = None
+    duration_traffic_s_matrix: np.ndarray | None = None
+
+    metric_used = req.metric
+    failed: np.ndarray | None = None
+
+    with timer.stage("matrix"):
+        if google_matrices is not None:
+            distance_km_matrix = google_matrices["distance_km"]
+            duration_s_matrix = google_matrices["duration_s"]
+            duration_traffic_s_matrix = google_matrices["duration_in_traffic_s"]
+            failed = google_matrices.get("failed")
+        elif haversine_km is not None:
+            distance_km_matrix = haversine_km
+        else:
+            distance_km_matrix = build_distance_matrix_array(all_coords)
+
+        cost = _cost_matrix(req, distance_km_matrix, duration_traffic_s_matrix)
+
+    signature = cached = None
+    cache_outcome: str | None = None
+    if result_cache is not None and n > 1:
+        signature = Signature(req, time_slices.departure_epoch if time_slices is not None else None)
+        cached = result_cache.get(signature)
+
+    seed = cached.order if cached is not None else None
+    if seed is not None and not req.try_all_starts and seed[0] != 0:
+        # Stops at the pinned start's place are interchangeable; pin it.
+        seed.remove(0)
+        seed.insert(0, 0)
+    if cached is not None and cached.exact:
+        cache_outcome = "hit"
+        solved = SolveResult(order=cached.order, solver=cached.solver, optimal=cached.optimal)
+    elif solve is not None:
+        # A near-miss route seeds the custom (parallel) solver as well.
+        solved = solve(cost[:n, :n]) if seed is None else solve(cost[:n, :n], initial_order=seed)
+    else:
+        solved = solve_order_from_cost_matrix(
+            cost[:n, :n],
+            return_to_start=req.return_to_start,
+            try_all_starts=req.try_all_starts,
+            construction=req.construction,
+            coords=coords,
+            time_budget_ms=req.time_budget_ms,
+            improvement=req.improvement,
+            initial_order=seed,
+        )
+    if signature is not None and cache_outcome is None:
+        cache_outcome = "warm_start" if solved.solver.startswith("warm_start") else "miss"
+        result_cache.put(
+            signature, solved.order, solver=solved.solver, optimal=solved.optimal, complete=not solved.timed_out
+        )
+    if cache_outcome is not None:
+        RESULT_CACHE_LOOKUPS.inc(outcome=cache_outcome)
+    for name, ms in solved.stages.items():
+        timer.add(name, ms)
+    order = solved.order
+
+    drive_s_matrix = (
+        duration_traffic_s_matrix
+        if duration_traffic_s_matrix is not None
+        else distance_km_matrix / req.average_speed_kmh * 3600.0
+    )
+    split = req.day_split
+    max_drive_s = max_distance_km = None
+    windows: list[tuple[Window, ...]] = []
+    service_s: list[float] = []
+    if req.time_windows is not None:
+        windows, service_s = _visit_windows(req, len(cost))
+
+    plans = None
+    if split is not None:
+        max_drive_s = split.max_drive_minutes * 60.0 if split.max_drive_minutes is not None else None
+        max_distance_km = split.max_distance_km
+        with timer.stage("days"):
+            plans = split_into_days(
+                order,
+                cost=cost,
+                distance_km=distance_km_matrix,
+                drive_s=drive_s_matrix,
+                n_bases=len(split.overnight_bases),
+                days=split.days,
+                max_drive_s=max_drive_s,
+                max_distance_km=max_distance_km,
+                return_to_start=req.return_to_start,
+                visit_s=np.asarray(service_s) if service_s else None,
+            )
+
+    # Refine with every leg priced at its departure hour. Days are refined
+    # one by one between their start and end nodes, since each day departs
+    # at the same time of day.
+    if time_slices is not None and refine:
+        with timer.stage("time_slices"):
+            reference = (time_slices.layers["distance_km"][0], time_slices.layers["duration_in_traffic_s"][0])
+            cost_slices = np.stack(
+                [
+                    _cost_matrix(req, distance, traffic, reference)
+                    for distance, traffic in zip(
+                        time_slices.layers["distance_km"], time_slices.layers["duration_in_traffic_s"]
+                    )
+                ]
+            )
+            refine = partial(
+                time_slices.refine,
+                cost_slices,
+                service_s=service_s or None,
+                improvement=req.improvement,
+                deadline=started + req.time_budget_ms / 1000.0 if req.time_budget_ms is not None else None,
+            )
+            if plans is None:
+                order = refine(order, return_to_start=req.return_to_start)
+            else:
+                for k, plan in enumerate(plans):
+                    head = [plan.start_node] if plan.start_node is not None else []
+                    tail = [plan.end_node] if plan.end_node is not None else []
+                    route = refine(head + plan.stops + tail, return_to_start=False)
+                    stops = route[len(head) : len(route) - len(tail)]
+                    if stops == plan.stops:
+                        continue
+                    refined = with_stops(
+                        plan,
+                        stops,
+                        distance_km=distance_km_matrix,
+                        drive_s=drive_s_matrix,
+                        max_drive_s=max_drive_s,
+                        max_distance_km=max_distance_km,
+                    )
+                    # A day within its limits stays within them.
+                    if plan.over_limit or not refined.over_limit:
+                        plans[k] = refined
+                order = [i for plan in plans for i in plan.stops]
+
+    schedule: list[ScheduledStop] | None = None
+    if req.time_windows is not None:
+        windows_started = time.perf_counter()
+        start_s = parse_clock(req.time_windows.start_time)
+        if req.time_budget_ms is not None:
+            deadline = started + req.time_budget_ms / 1000.0
+        else:
+            deadline = windows_started + _TIME_WINDOWS_DEFAULT_BUDGET_S
+        # Without days the whole route is one day; otherwise each day starts
+        # at start_time from its base or the previous day's last stop.
+        day_stops = [plan.stops for plan in plans] if plans is not None else [order]
+        schedule = []
+        origin: int | None = None
+        for k, stops in enumerate(day_stops):
+            if plans is not None and k > 0:
+                origin = plans[k].start_node if plans[k].start_base is not None else day_stops[k - 1][-1]
+            timed = solve_time_windows(
+                stops,
+                drive_s_matrix,
+                windows,
+                service_s,
+                start_s=start_s,
+                origin=origin,
+                pin_first=k == 0 and (not req.try_all_starts or (plans is not None and req.return_to_start)),
+                deadline=deadline,
+            )
+            day_stops[k] = timed.order
+            if plans is not None:
+                plans[k] = with_stops(
+                    plans[k],
+                    timed.order,
+                    start_node=origin,
+                    distance_km=distance_km_matrix,
+                    drive_s=drive_s_matrix,
+                    max_drive_s=max_drive_s,
+                    max_distance_km=max_distance_km,
+                )
+            schedule.extend(
+                ScheduledStop(
+                    index=v.node,
+                    day=k + 1 if plans is not None else None,
+                    arrival=format_clock(v.arrival_s),
+                    start=format_clock(v.start_s),
+                    departure=format_clock(v.departure_s),
+                    wait_minutes=(v.start_s - v.arrival_s) / 60.0,
+                    feasible=v.feasible,
+                )
+                for v in timed.visits
+            )
+        order = [i for stops in day_stops for i in stops]
+        timer.add("time_windows", (time.perf_counter() - windows_started) * 1000.0)
+
+    response_started = time.perf_counter()
+    days: list[DayRoute] | None = None
+    if plans is not None:
+        days = [
+            DayRoute(
+                day=k,
+                optimized_order=plan.stops,
+                start_base_index=plan.start_base,
+                end_base_index=plan.end_base,
+                distance_km=plan.distance_km,
+                drive_seconds=plan.drive_s,
+                over_limit=plan.over_limit,
+            )
+            for k, plan in enumerate(plans, start=1)
+        ]
+        # Days may reorder stops locally; keep the flat order consistent.
+        order = [i for plan in plans for i in plan.stops]
+
+    distance_km_matrix = distance_km_matrix[:n, :n]
+    if duration_s_matrix is not None:
+        duration_s_matrix = duration_s_matrix[:n, :n]
+    if duration_traffic_s_matrix is not None:
+        duration_traffic_s_matrix = duration_traffic_s_matrix[:n, :n]
+
+    matrix_id: str | None = None
+    if matrix_store is not None and req.store_matrices:
+        layers = {"cost": cost[:n, :n], "distance_km": distance_km_matrix}
+        if duration_s_matrix is not None:
+            layers["duration_s"] = duration_s_matrix
+        if duration_traffic_s_matrix is not None:
+            layers["duration_in_traffic_s"] = duration_traffic_s_matrix
+        matrix_id = matrix_store.put(layers)
+
+    optimized_itinerary = [itinerary[i] for i in order]
+
+    legs = list(zip(order, order[1:]))
+    if req.return_to_start and len(order) > 1:
+        legs.append((order[-1], order[0]))
+
+    # The matrices each leg is priced with: its departure slice with
+    # time_slices (each day departing at the same time of day), else the one set.
+    leg_matrices = [(distance_km_matrix, duration_s_matrix, duration_traffic_s_matrix)] * len(legs)
+    leg_failed = [failed] * len(legs)
+    if time_slices is not None:
+        day_starts = list(accumulate(len(plan.stops) for plan in plans))[:-1] if plans is not None else []
+        stacks = time_slices.layers
+        leg_slices = time_slices.leg_slices(
+            order, return_to_start=req.return_to_start, service_s=service_s or None, day_starts=day_starts
+        )
+        leg_matrices = [
+            (stacks["distance_km"][k], stacks["duration_s"][k], stacks["duration_in_traffic_s"][k]) for k in leg_slices
+        ]
+        leg_failed = [stacks["failed"][k] for k in leg_slices]
+
+    segments: list[Segment] = []
+    for (from_idx, to_idx), (leg_km, leg_s, leg_traffic_s) in zip(legs, leg_matrices):
+        segments.append(
+            Segment(
+                from_index=from_idx,
+                to_index=to_idx,
+                distance_km=float(leg_km[from_idx, to_idx]),
+                duration_seconds=float(leg_s[from_idx, to_idx]) if leg_s is not None else None,
+                duration_in_traffic_seconds=(
+                    float(leg_traffic_s[from_idx, to_idx]) if leg_traffic_s is not None else None
+                ),
+            )
+        )
+
+    if time_slices is not None:
+        total_km = sum(s.distance_km for s in segments)
+        total_duration_s = sum(s.duration_seconds or 0.0 for s in segments)
+        total_duration_traffic_s = sum(s.duration_in_traffic_seconds or 0.0 for s in segments)
+    else:
+        total_km = path_length(distance_km_matrix, order, return_to_start=req.return_to_start)
+        total_duration_s = (
+            path_length(duration_s_matrix, order, return_to_start=req.return_to_start)
+            if duration_s_matrix is not None
+            else None
+        )
+        total_duration_traffic_s = (
+            path_length(duration_traffic_s_matrix, order, return_to_start=req.return_to_start)
+            if duration_traffic_s_matrix is not None
+            else None
+        )
+
+    response = OptimizeResponse(
+        optimized_order=order,
+        total_distance_km=total_km,
+        total_duration_seconds=total_duration_s,
+        total_duration_in_traffic_seconds=total_duration_traffic_s,
+        metric_used=metric_used,
+        optimize_for=req.optimize_for,
+        solver=solved.solver,
+        optimal=solved.optimal,
+        elapsed_ms=solved.elapsed_ms,
+        iterations=solved.iterations,
+        timed_out=solved.timed_out,
+        days=days,
+        schedule=schedule,
+        infeasible_indices=[s.index for s in schedule if not s.feasible] if schedule is not None else [],
+        failed_legs=[k for k, ((i, j), mask) in enumerate(zip(legs, leg_failed)) if mask is not None and mask[i, j]],
+        optimized_itinerary=optimized_itinerary,
+        segments=segments,
+        matrix_id=matrix_id,
+        time_slices=len(time_slices) if time_slices is not None else None,
+        result_cache=cache_outcome,
+    )
+    timer.add("response", (time.perf_counter() - response_started) * 1000.0)
+    return response
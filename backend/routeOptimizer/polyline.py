@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import math
+from typing import Any, Sequence
+
+import numpy as np
+
+try:
+    from .optimizer import EARTH_RADIUS_KM
+except ImportError:  # pragma: no cover
+    from optimizer import EARTH_RADIUS_KM
+
+# Web Mercator ground resolution at the equator, zoom 0, 256 px tiles.
+_METERS_PER_PIXEL_Z0 = 156543.03392
+
+
+def decode_polyline(encoded: str, *, precision: int = 5) -> np.ndarray:
+    """Google encoded polyline to an (N, 2) array of (lat, lng)."""
+    values: list[int] = []
+    shift = 0
+    result = 0
+    for ch in encoded:
+        b = ord(ch) - 63
+        result |= (b & 0x1F) << shift
+        shift += 5
+        if b < 0x20:
+            values.append(~(result >> 1) if result & 1 else result >> 1)
+            shift = 0
+            result = 0
+    if shift:
+        raise ValueError("Malformed encoded polyline: it ends inside a value")
+    if len(values) % 2:
+        raise ValueError("Malformed encoded polyline")
+    deltas = np.asarray(values, dtype=np.int64).reshape(-1, 2)
+    return np.cumsum(deltas, axis=0) / 10.0**precision
+
+
+def _encode_value(value: int, out: list[str]) -> None:
+    value = ~(value << 1) if value < 0 else value << 1
+    while value >= 0x20:
+        out.append(chr((0x20 | (value & 0x1F)) + 63))
+        value >>= 5
+    out.append(chr(value + 63))
+
+
+def encode_polyline(points: Sequence[tuple[float, float]] | np.ndarray, *, precision: int = 5) -> str:
+    """(lat, lng) points to a Google encoded polyline."""
+    scaled = np.rint(np.asarray(points, dtype=np.float64).reshape(-1, 2) * 10.0**precision).astype(np.int64)
+    if not len(scaled):
+        return ""
+    deltas = np.diff(scaled, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+    out: list[str] = []
+    for value in deltas.ravel().tolist():
+        _encode_value(value, out)
+    return "".join(out)
+
+
+def _project_m(points: np.ndarray) -> np.ndarray:
+    """Local equirectangular projection in meters, accurate at route scale."""
+    lat0 = math.radians(float(points[:, 0].mean()))
+    rad = np.radians(points)
+    r_m = EARTH_RADIUS_KM * 1000.0
+    return np.column_stack((rad[:, 1] * math.cos(lat0) * r_m, rad[:, 0] * r_m))
+
+
+def douglas_peucker(
+    points: np.ndarray,
+    tolerance_m: float,
+    *,
+    must_keep: Sequence[int] = (),
+) -> np.ndarray:
+    """Indices of the points Douglas-Peucker keeps at `tolerance_m`, ascending.
+
+    `must_keep` points (e.g. speed-interval boundaries) are always kept and
+    the line is simplified between them. Each split is one vectorized
+    distance computation over the span, using distance to the segment (not
+    the infinite line) so loops back along the route are not dropped.
+    """
+    n = len(points)
+    if n <= 2 or tolerance_m <= 0:
+        return np.arange(n)
+    xy = _project_m(np.asarray(points, dtype=np.float64))
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    forced = np.asarray(must_keep, dtype=np.intp)
+    keep[forced[(forced >= 0) & (forced < n)]] = True
+    anchors = np.flatnonzero(keep).tolist()
+    stack = list(zip(anchors[:-1], anchors[1:]))
+    while stack:
+        lo, hi = stack.pop()
+        if hi - lo < 2:
+            continue
+        a = xy[lo]
+        ab = xy[hi] - a
+        ap = xy[lo + 1 : hi] - a
+        length2 = float(ab @ ab)
+        if length2 > 0:
+            t = np.clip((ap @ ab) / length2, 0.0, 1.0)
+            dist = np.hypot(*(ap - t[:, None] * ab).T)
+        else:
+            dist = np.hypot(ap[:, 0], ap[:, 1])
+        k = int(dist.argmax())
+        if dist[k] > tolerance_m:
+            mid = lo + 1 + k
+            keep[mid] = True
+            stack.append((lo, mid))
+            stack.append((mid, hi))
+    return np.flatnonzero(keep)
+
+
+def zoom_tolerance_m(zoom: float, latitude: float, *, pixels: float = 1.0) -> float:
+    """Ground size of `pixels` screen pixels at a Web Mercator zoom level."""
+    return pixels * _METERS_PER_PIXEL_Z0 * math.cos(math.radians(latitude)) / 2.0**zoom
+
+
+def remap_intervals(intervals: list[dict[str, Any]], kept: np.ndarray) -> list[dict[str, Any]]:
+    """Move speed-interval point indices onto the simplified line.
+
+    Each boundary maps to its kept point (or the nearest one if it was
+    dropped). Intervals that shrink to nothing are dropped and neighbours
+    with the same speed are merged, so the result still tiles the same
+    stretches of road.
+    """
+    if not len(kept):
+        return []
+
+    def snap(i: int) -> int:
+        pos = int(np.searchsorted(kept, i))
+        if pos >= len(kept):
+            return len(kept) - 1
+        if pos > 0 and i - kept[pos - 1] <= kept[pos] - i:
+            return pos - 1
+        return pos
+
+    out: list[dict[str, Any]] = []
+    for interval in intervals:
+        start = snap(int(interval.get("startIndex", 0)))
+        end = snap(int(interval.get("endIndex", 0)))
+        if end <= start:
+            continue
+        speed = interval.get("speed", "SPEED_UNSPECIFIED")
+        if out and out[-1]["speed"] == speed and out[-1]["endIndex"] == start:
+            out[-1]["endIndex"] = end
+        else:
+            out.append({"startIndex": start, "endIndex": end, "speed": speed})
+    return out
+
+
+def simplify_leg(leg: dict[str, Any], tolerance_m: float) -> dict[str, Any]:
+    """A `compute_traffic_route` leg with its polyline simplified between
+    speed-interval boundaries and the intervals remapped; the input is not
+    modified."""
+    encoded = str(leg.get("encodedPolyline") or "")
+    if not encoded or tolerance_m <= 0:
+        return leg
+    points = decode_polyline(encoded)
+    intervals = list(leg.get("speedReadingIntervals") or [])
+    # Keep interval boundaries so traffic colours start and end where they did.
+    boundaries = [int(i.get(k, 0)) for i in intervals for k in ("startIndex", "endIndex")]
+    kept = douglas_peucker(points, tolerance_m, must_keep=boundaries)
+    if len(kept) == len(points):
+        return leg
+    return {
+        **leg,
+        "encodedPolyline": encode_polyline(points[kept]),
+        "speedReadingIntervals": remap_intervals(intervals, kept),
+    }
@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+try:
+    from .models import OptimizeRequest
+    from .time_slices import SLICE_S
+except ImportError:  # pragma: no cover
+    from models import OptimizeRequest
+    from time_slices import SLICE_S
+
+# Stops closer than this many decimal degrees (about 1 m) are the same stop,
+# as in the Distance Matrix cache keys.
+COORD_PRECISION = 5
+
+
+@dataclass
+class CachedTour:
+    """A solved route, in the caller's itinerary indices."""
+
+    order: list[int]
+    solver: str
+    optimal: bool
+    # False for the cached route of other options, only good as a seed.
+    exact: bool
+
+
+@dataclass
+class _Entry:
+    expires_at: float
+    # Positions in the canonical (sorted) stop list.
+    tour: list[int]
+    solver: str
+    optimal: bool
+
+
+class Signature:
+    """Canonical form of an `/optimize` request's solve.
+
+    Stops are identified by their rounded coordinates (ids are client-side
+    labels; two stops at the same place cost the same) and sorted, so the
+    same places in any itinerary order have the same `stops` key. `options`
+    adds everything else the route depends on, including the departure hour
+    (`departure_epoch`) for time-sliced solves. `to_canonical[i]` is the
+    canonical position of itinerary entry i.
+    """
+
+    def __init__(self, req: OptimizeRequest, departure_epoch: float | None = None) -> None:
+        p = COORD_PRECISION
+        keys = [f"{d.location.lat:.{p}f},{d.location.lng:.{p}f}" for d in req.itinerary]
+        ranked = sorted(range(len(keys)), key=lambda i: keys[i])
+        self.from_canonical = ranked
+        self.to_canonical = [0] * len(keys)
+        for position, i in enumerate(ranked):
+            self.to_canonical[i] = position
+        stops = hashlib.sha256("|".join(keys[i] for i in ranked).encode())
+        # A pinned first stop is part of the problem, not an option.
+        if not req.try_all_starts and keys:
+            stops.update(f"|start={keys[0]}".encode())
+        self.stops = stops.hexdigest()[:32]
+
+        weights = f"{req.distance_weight:g},{req.time_weight:g}" if req.optimize_for == "hybrid" else ""
+        departure = str(int(departure_epoch // SLICE_S)) if departure_epoch is not None else ""
+        self.options = "|".join(
+            (
+                req.metric,
+                req.optimize_for,
+                weights,
+                str(req.return_to_start),
+                req.construction,
+                req.improvement,
+                departure,
+            )
+        )
+
+
+class ResultCache:
+    """In-process LRU of solved routes by canonical signature.
+
+    An exact hit (same stops in any order, same options) skips the solve and
+    is remapped to the caller's itinerary order. A near miss (same stops,
+    other options, e.g. another `optimize_for`) returns the latest route for
+    those stops as a local-search seed. Routes cut short by a time budget
+    are only kept as seeds. Entries expire after `ttl_s`, since traffic
+    matrices change; each worker process has its own cache.
+    """
+
+    def __init__(self, *, ttl_s: float = 600.0, max_entries: int = 1000) -> None:
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self._items: OrderedDict[tuple[str, str], _Entry] = OrderedDict()
+        # Latest options solved per stop set, for near misses.
+        self._latest: dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def get(self, signature: Signature) -> CachedTour | None:
+        now = time.monotonic()
+        with self._lock:
+            key = (signature.stops, signature.options)
+            entry = self._items.get(key)
+            exact = entry is not None and entry.expires_at > now
+            if not exact:
+                options = self._latest.get(signature.stops)
+                key = (signature.stops, options) if options is not None else key
+                entry = self._items.get(key)
+                if entry is None or entry.expires_at <= now:
+                    return None
+            self._items.move_to_end(key)
+            order = [signature.from_canonical[position] for position in entry.tour]
+            return CachedTour(order=order, solver=entry.solver, optimal=entry.optimal, exact=exact)
+
+    def put(self, signature: Signature, order: list[int], *, solver: str, optimal: bool, complete: bool) -> None:
+        """Keep the route `order` (caller indices). Incomplete (timed-out)
+        routes are stored for near misses only."""
+        entry = _Entry(
+            expires_at=time.monotonic() + self.ttl_s,
+            tour=[signature.to_canonical[i] for i in order],
+            solver=solver,
+            optimal=optimal,
+        )
+        # Keyed so that an exact lookup never finds an incomplete route.
+        options = signature.options if complete else signature.options + "|partial"
+        with self._lock:
+            self._items[(signature.stops, options)] = entry
+            self._items.move_to_end((signature.stops, options))
+            self._latest[signature.stops] = options
+            while len(self._items) > self.max_entries:
+                (stops, evicted), _ = self._items.popitem(last=False)
+                if self._latest.get(stops) == evicted:
+                    del self._latest[stops]
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._latest.clear()
+
+
+RESULT_CACHE = ResultCache(
+    ttl_s=float(os.getenv("RESULT_CACHE_TTL_S") or 600),
+    max_entries=int(os.getenv("RESULT_CACHE_MAX_ENTRIES") or 1000),
+)
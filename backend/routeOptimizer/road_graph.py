@@ -0,0 +1,537 @@
+from __future__ import annotations
+
+import argparse
+import gzip
+import heapq
+import logging
+import math
+import os
+import re
+import xml.etree.ElementTree as ET
+from collections import Counter
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Sequence
+
+import numpy as np
+
+try:
+    from .google_matrix import UNREACHABLE
+    from .optimizer import haversine_km
+    from .spatial_index import SpatialIndex
+except ImportError:  # pragma: no cover
+    from google_matrix import UNREACHABLE
+    from optimizer import haversine_km
+    from spatial_index import SpatialIndex
+
+logger = logging.getLogger(__name__)
+
+# Typical driving speed (km/h) per OSM highway class on Sri Lankan roads.
+# Ways of other classes (footways, paths, ...) are not drivable and skipped.
+HIGHWAY_SPEED_KMH = {
+    "motorway": 80.0,
+    "motorway_link": 40.0,
+    "trunk": 50.0,
+    "trunk_link": 30.0,
+    "primary": 45.0,
+    "primary_link": 30.0,
+    "secondary": 35.0,
+    "secondary_link": 25.0,
+    "tertiary": 30.0,
+    "tertiary_link": 20.0,
+    "unclassified": 25.0,
+    "road": 25.0,
+    "residential": 20.0,
+    "living_street": 10.0,
+    "service": 10.0,
+    "track": 10.0,
+}
+
+# Getting from a point to the nearest graph node: straight-line distance
+# times a detour factor, at walking-pace driving speed.
+ACCESS_DETOUR = 1.3
+ACCESS_SPEED_KMH = 15.0
+
+# Nodes a witness search may settle before assuming a shortcut is needed.
+# Lower builds faster but adds shortcuts; queries stay exact either way.
+WITNESS_SETTLE_LIMIT = 60
+# Cheaper witness searches for the contraction order, which is re-evaluated
+# several times per node; they may overestimate a node's shortcuts.
+PRIORITY_SETTLE_LIMIT = 8
+PRIORITY_HOP_LIMIT = 2
+
+FILE_VERSION = 1
+
+
+def default_road_graph_path() -> Path:
+    """ROAD_GRAPH_PATH, or road_graph.npz next to this module."""
+    configured = (os.getenv("ROAD_GRAPH_PATH") or "").strip()
+    return Path(configured) if configured else Path(__file__).resolve().parent / "road_graph.npz"
+
+
+@dataclass
+class RoadNetwork:
+    """Directed road graph: node coordinates and one entry per edge."""
+
+    lat: np.ndarray
+    lng: np.ndarray
+    tail: np.ndarray
+    head: np.ndarray
+    distance_km: np.ndarray
+    duration_s: np.ndarray
+
+
+def _way_speed(highway: str, maxspeed: str | None) -> float:
+    speed = HIGHWAY_SPEED_KMH[highway]
+    match = re.match(r"\s*(\d+(?:\.\d+)?)\s*(mph)?", maxspeed or "")
+    if match and float(match[1]) > 0:
+        limit = float(match[1]) * (1.609344 if match[2] else 1.0)
+        speed = min(speed, limit)
+    return speed
+
+
+def _way_direction(tags: dict[str, str], highway: str) -> int:
+    """1 for one-way along the node order, -1 against it, 0 for both ways."""
+    oneway = tags.get("oneway", "")
+    if oneway == "-1":
+        return -1
+    if oneway in ("yes", "true", "1"):
+        return 1
+    implied = highway in ("motorway", "motorway_link") or tags.get("junction") in ("roundabout", "circular")
+    return 1 if implied and oneway != "no" else 0
+
+
+def parse_osm(path: Path) -> RoadNetwork:
+    """Drivable roads of an OSM XML extract (.osm or .osm.gz).
+
+    Only way ends and nodes shared by several ways (intersections) become
+    graph nodes; the geometry in between only adds to the edge length, so a
+    country extract shrinks to a fraction of its OSM node count.
+    """
+    opener = gzip.open if path.suffix == ".gz" else open
+    coords: dict[int, tuple[float, float]] = {}
+    ways: list[tuple[list[int], float, int]] = []
+    with opener(path, "rb") as f:
+        for _, elem in ET.iterparse(f, events=("end",)):
+            if elem.tag == "node":
+                coords[int(elem.get("id"))] = (float(elem.get("lat")), float(elem.get("lon")))
+                elem.clear()
+            elif elem.tag == "way":
+                tags = {t.get("k"): t.get("v") for t in elem.iter("tag")}
+                highway = tags.get("highway")
+                if highway in HIGHWAY_SPEED_KMH and tags.get("access") not in ("no", "private"):
+                    refs = [int(nd.get("ref")) for nd in elem.iter("nd")]
+                    ways.append((refs, _way_speed(highway, tags.get("maxspeed")), _way_direction(tags, highway)))
+                elem.clear()
+            elif elem.tag == "relation":
+                elem.clear()
+
+    # Extracts clip ways at their boundary; drop references to missing nodes.
+    ways = [([r for r in refs if r in coords], speed, direction) for refs, speed, direction in ways]
+    uses = Counter(r for refs, _, _ in ways for r in refs)
+    index: dict[int, int] = {}
+    tail: list[int] = []
+    head: list[int] = []
+    distance: list[float] = []
+    duration: list[float] = []
+    for refs, speed, direction in ways:
+        if len(refs) < 2:
+            continue
+        start = refs[0]
+        km = 0.0
+        for pos in range(1, len(refs)):
+            ref = refs[pos]
+            km += haversine_km(*coords[refs[pos - 1]], *coords[ref])
+            if pos < len(refs) - 1 and uses[ref] < 2:
+                continue
+            a = index.setdefault(start, len(index))
+            b = index.setdefault(ref, len(index))
+            pairs = ([(a, b)] if direction >= 0 else []) + ([(b, a)] if direction <= 0 else [])
+            for u, v in pairs:
+                tail.append(u)
+                head.append(v)
+                distance.append(km)
+                duration.append(km / speed * 3600.0)
+            start, km = ref, 0.0
+
+    latlng = np.array([coords[r] for r in index], dtype=np.float64).reshape(-1, 2)
+    return RoadNetwork(
+        lat=latlng[:, 0],
+        lng=latlng[:, 1],
+        tail=np.array(tail, dtype=np.intp),
+        head=np.array(head, dtype=np.intp),
+        distance_km=np.array(distance, dtype=np.float64),
+        duration_s=np.array(duration, dtype=np.float64),
+    )
+
+
+def _csr(n: int, tail: np.ndarray, head: np.ndarray) -> tuple[list[int], list[int]]:
+    order = np.argsort(tail, kind="stable")
+    indptr = np.zeros(n + 1, dtype=np.intp)
+    np.cumsum(np.bincount(tail, minlength=n), out=indptr[1:])
+    return indptr.tolist(), head[order].tolist()
+
+
+def largest_component(network: RoadNetwork) -> RoadNetwork:
+    """The largest strongly connected part of `network`, so every snapped
+    point can reach every other (Kosaraju, iterative)."""
+    n = len(network.lat)
+    if n == 0:
+        return network
+    fwd_ptr, fwd = _csr(n, network.tail, network.head)
+    bwd_ptr, bwd = _csr(n, network.head, network.tail)
+
+    finished: list[int] = []
+    seen = [False] * n
+    for root in range(n):
+        if seen[root]:
+            continue
+        seen[root] = True
+        stack = [(root, fwd_ptr[root])]
+        while stack:
+            v, e = stack[-1]
+            if e < fwd_ptr[v + 1]:
+                stack[-1] = (v, e + 1)
+                x = fwd[e]
+                if not seen[x]:
+                    seen[x] = True
+                    stack.append((x, fwd_ptr[x]))
+            else:
+                stack.pop()
+                finished.append(v)
+
+    component = [-1] * n
+    sizes: list[int] = []
+    for root in reversed(finished):
+        if component[root] >= 0:
+            continue
+        label = len(sizes)
+        component[root] = label
+        todo = [root]
+        size = 0
+        while todo:
+            v = todo.pop()
+            size += 1
+            for x in bwd[bwd_ptr[v] : bwd_ptr[v + 1]]:
+                if component[x] < 0:
+                    component[x] = label
+                    todo.append(x)
+        sizes.append(size)
+
+    keep = np.asarray(component) == int(np.argmax(sizes))
+    renumber = np.cumsum(keep) - 1
+    edges = keep[network.tail] & keep[network.head]
+    return RoadNetwork(
+        lat=network.lat[keep],
+        lng=network.lng[keep],
+        tail=renumber[network.tail[edges]],
+        head=renumber[network.head[edges]],
+        distance_km=network.distance_km[edges],
+        duration_s=network.duration_s[edges],
+    )
+
+
+@dataclass
+class _UpwardGraph:
+    """Edges from each node to higher-ranked nodes (CSR, Python lists for
+    fast scalar access in the searches)."""
+
+    indptr: list[int]
+    head: list[int]
+    duration_s: list[float]
+    distance_km: list[float]
+
+    def search(self, node: int, duration_s: float, distance_km: float) -> dict[int, tuple[float, float]]:
+        """Dijkstra on upward edges only: (duration, distance) of every node
+        in the search space. Distance follows the fastest path."""
+        best = {node: duration_s}
+        settled: dict[int, tuple[float, float]] = {}
+        heap = [(duration_s, distance_km, node)]
+        indptr, head, dur, km = self.indptr, self.head, self.duration_s, self.distance_km
+        while heap:
+            d, k, v = heapq.heappop(heap)
+            if v in settled:
+                continue
+            settled[v] = (d, k)
+            for e in range(indptr[v], indptr[v + 1]):
+                x = head[e]
+                nd = d + dur[e]
+                if nd < best.get(x, math.inf):
+                    best[x] = nd
+                    heapq.heappush(heap, (nd, k + km[e], x))
+        return settled
+
+    def arrays(self, prefix: str) -> dict[str, np.ndarray]:
+        return {
+            f"{prefix}_indptr": np.asarray(self.indptr, dtype=np.int64),
+            f"{prefix}_head": np.asarray(self.head, dtype=np.int64),
+            f"{prefix}_duration_s": np.asarray(self.duration_s, dtype=np.float64),
+            f"{prefix}_distance_km": np.asarray(self.distance_km, dtype=np.float64),
+        }
+
+    @classmethod
+    def from_arrays(cls, data: dict[str, np.ndarray], prefix: str) -> _UpwardGraph:
+        return cls(*(data[f"{prefix}_{name}"].tolist() for name in ("indptr", "head", "duration_s", "distance_km")))
+
+    @classmethod
+    def from_lists(cls, edges: list[list[tuple[int, float, float]]]) -> _UpwardGraph:
+        indptr = [0]
+        for out in edges:
+            indptr.append(indptr[-1] + len(out))
+        flat = [e for out in edges for e in out]
+        return cls(indptr, [e[0] for e in flat], [e[1] for e in flat], [e[2] for e in flat])
+
+
+def _witness_search(
+    out_adj: list[dict[int, tuple[float, float]]],
+    source: int,
+    skip: int,
+    limit: float,
+    max_settled: int,
+    targets: set[int],
+    max_hops: int | None = None,
+) -> dict[int, float]:
+    """Shortest durations from `source` avoiding `skip`, up to `limit`.
+
+    Stops once every node in `targets` is settled, after `max_settled`
+    nodes, and does not follow paths of more than `max_hops` edges; a
+    target it misses only costs a superfluous shortcut.
+    """
+    dist = {source: 0.0}
+    hops = {source: 0}
+    heap = [(0.0, source)]
+    done: set[int] = set()
+    pending = len(targets)
+    while heap and len(done) < max_settled:
+        d, v = heapq.heappop(heap)
+        if d > limit:
+            break
+        if v in done:
+            continue
+        done.add(v)
+        if v in targets:
+            pending -= 1
+            if pending == 0:
+                break
+        h = hops[v] + 1
+        if max_hops is not None and h > max_hops:
+            continue
+        for x, (w, _) in out_adj[v].items():
+            nd = d + w
+            if x != skip and nd < dist.get(x, math.inf):
+                dist[x] = nd
+                hops[x] = h
+                heapq.heappush(heap, (nd, x))
+    return dist
+
+
+class RoadGraph:
+    """Contraction hierarchy over a road network, answering many-to-many
+    duration/distance matrices.
+
+    Every node is ranked; a query only walks 'upward' edges (towards higher
+    ranks) from the source and, reversed, from the target, and the two
+    search spaces meet at the top of the fastest path. Shortcut edges added
+    during contraction keep those searches exact and small: a few hundred
+    nodes each, whatever the network size. Points are snapped to their
+    nearest graph node.
+    """
+
+    def __init__(self, lat: np.ndarray, lng: np.ndarray, up: _UpwardGraph, down: _UpwardGraph) -> None:
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lng = np.asarray(lng, dtype=np.float64)
+        # Edges u -> x with rank(x) > rank(u), searched from the source.
+        self.up = up
+        # Edges x -> u with rank(x) > rank(u), stored at u and searched
+        # backwards from the target.
+        self.down = down
+        self._index = SpatialIndex(np.column_stack((self.lat, self.lng)))
+
+    def __len__(self) -> int:
+        return len(self.lat)
+
+    def snap(self, lat: float, lng: float) -> tuple[int, float, float]:
+        """Nearest graph node, and the distance (km) and duration (s) to reach it."""
+        idx, km = self._index.nearest(lat, lng, 1)
+        access_km = float(km[0]) * ACCESS_DETOUR
+        return int(idx[0]), access_km, access_km / ACCESS_SPEED_KMH * 3600.0
+
+    def matrix(self, coords: Sequence[tuple[float, float]]) -> dict[str, np.ndarray]:
+        """Driving matrices between `coords`, keyed like `fetch_distance_matrix`
+        (there is no traffic, so 'duration_in_traffic_s' equals 'duration_s').
+
+        One backward search per target leaves (target, duration, distance)
+        'buckets' on its search space; one forward search per source then
+        scans the buckets of the nodes it reaches.
+        """
+        n = len(coords)
+        snapped = [self.snap(lat, lng) for lat, lng in coords]
+
+        collected: dict[int, list[tuple[int, float, float]]] = {}
+        for j, (node, km, s) in enumerate(snapped):
+            for v, (d, k) in self.down.search(node, s, km).items():
+                collected.setdefault(v, []).append((j, d, k))
+        buckets = {
+            v: (
+                np.array([b[0] for b in entries], dtype=np.intp),
+                np.array([b[1] for b in entries]),
+                np.array([b[2] for b in entries]),
+            )
+            for v, entries in collected.items()
+        }
+
+        duration_s = np.full((n, n), UNREACHABLE)
+        distance_km = np.full((n, n), UNREACHABLE)
+        for i, (node, km, s) in enumerate(snapped):
+            row_s, row_km = duration_s[i], distance_km[i]
+            for v, (d, k) in self.up.search(node, s, km).items():
+                bucket = buckets.get(v)
+                if bucket is None:
+                    continue
+                targets, bd, bk = bucket
+                total = d + bd
+                better = total < row_s[targets]
+                row_s[targets[better]] = total[better]
+                row_km[targets[better]] = k + bk[better]
+        np.fill_diagonal(duration_s, 0.0)
+        np.fill_diagonal(distance_km, 0.0)
+        return {
+            "distance_km": distance_km,
+            "duration_s": duration_s,
+            "duration_in_traffic_s": duration_s.copy(),
+            "failed": duration_s >= UNREACHABLE,
+        }
+
+    def save(self, path: Path) -> Path:
+        """Write to `path` (.npz) under a temporary name, then rename into place."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.stem + ".tmp.npz")
+        np.savez(
+            tmp,
+            version=np.int64(FILE_VERSION),
+            lat=self.lat,
+            lng=self.lng,
+            **self.up.arrays("up"),
+            **self.down.arrays("down"),
+        )
+        os.replace(tmp, path)
+        return path
+
+    @classmethod
+    def load(cls, path: Path) -> RoadGraph:
+        with np.load(path) as npz:
+            data = dict(npz)
+        if int(data["version"]) != FILE_VERSION:
+            raise ValueError(f"{path} has version {int(data['version'])}, expected {FILE_VERSION}; rebuild it")
+        return cls(
+            data["lat"], data["lng"], _UpwardGraph.from_arrays(data, "up"), _UpwardGraph.from_arrays(data, "down")
+        )
+
+
+def contract(network: RoadNetwork, *, witness_settle_limit: int = WITNESS_SETTLE_LIMIT) -> RoadGraph:
+    """Build the contraction hierarchy of `network`.
+
+    Nodes are contracted cheapest first by edge difference (twice the
+    shortcuts added minus edges removed, plus already contracted neighbours
+    to spread the order), with lazy priority updates. Priorities use witness
+    searches capped at `PRIORITY_SETTLE_LIMIT` nodes and `PRIORITY_HOP_LIMIT`
+    edges, since every pop re-evaluates one; only the contraction itself
+    searches up to `witness_settle_limit`. Contracting v adds a shortcut
+    u -> x for each pair of neighbours unless a witness path avoiding v is
+    at least as fast. The edges v still has when it is contracted all lead
+    to higher ranks, so they become its upward edges.
+    """
+    n = len(network.lat)
+    out_adj: list[dict[int, tuple[float, float]]] = [{} for _ in range(n)]
+    in_adj: list[dict[int, tuple[float, float]]] = [{} for _ in range(n)]
+    edges = zip(
+        network.tail.tolist(), network.head.tolist(), network.duration_s.tolist(), network.distance_km.tolist()
+    )
+    for u, v, dur, km in edges:
+        if u != v and dur < out_adj[u].get(v, (math.inf, 0.0))[0]:
+            out_adj[u][v] = in_adj[v][u] = (dur, km)
+
+    def shortcuts(v: int, max_settled: int, max_hops: int | None = None) -> list[tuple[int, int, float, float]]:
+        found: list[tuple[int, int, float, float]] = []
+        for u, (du, ku) in in_adj[v].items():
+            via = {x: (du + dx, ku + kx) for x, (dx, kx) in out_adj[v].items() if x != u}
+            if not via:
+                continue
+            limit = max(d for d, _ in via.values())
+            witness = _witness_search(out_adj, u, v, limit, max_settled, set(via), max_hops)
+            for x, (d, k) in via.items():
+                if witness.get(x, math.inf) > d:
+                    found.append((u, x, d, k))
+        return found
+
+    contracted_neighbors = [0] * n
+
+    def priority(v: int) -> int:
+        # An estimate with a cheap search: it only orders the contraction.
+        added = shortcuts(v, PRIORITY_SETTLE_LIMIT, PRIORITY_HOP_LIMIT)
+        return 2 * (len(added) - len(in_adj[v]) - len(out_adj[v])) + contracted_neighbors[v]
+
+    heap = [(priority(v), v) for v in range(n)]
+    heapq.heapify(heap)
+    up: list[list[tuple[int, float, float]]] = [[] for _ in range(n)]
+    down: list[list[tuple[int, float, float]]] = [[] for _ in range(n)]
+    while heap:
+        _, v = heapq.heappop(heap)
+        p = priority(v)
+        if heap and p > heap[0][0]:
+            heapq.heappush(heap, (p, v))
+            continue
+        added = shortcuts(v, witness_settle_limit)
+        up[v] = [(x, d, k) for x, (d, k) in out_adj[v].items()]
+        down[v] = [(u, d, k) for u, (d, k) in in_adj[v].items()]
+        for x in out_adj[v]:
+            del in_adj[x][v]
+            contracted_neighbors[x] += 1
+        for u in in_adj[v]:
+            del out_adj[u][v]
+            contracted_neighbors[u] += 1
+        out_adj[v], in_adj[v] = {}, {}
+        for u, x, d, k in added:
+            if d < out_adj[u].get(x, (math.inf, 0.0))[0]:
+                out_adj[u][x] = in_adj[x][u] = (d, k)
+    return RoadGraph(network.lat, network.lng, _UpwardGraph.from_lists(up), _UpwardGraph.from_lists(down))
+
+
+def build_road_graph(osm_path: Path, output: Path) -> RoadGraph:
+    """Parse an OSM extract, keep its largest connected part, contract it and save it."""
+    network = largest_component(parse_osm(osm_path))
+    logger.info("Contracting %d road nodes, %d edges", len(network.lat), len(network.tail))
+    graph = contract(network)
+    graph.save(output)
+    return graph
+
+
+@lru_cache(maxsize=1)
+def get_road_graph() -> RoadGraph | None:
+    """Process-wide road graph loaded from `default_road_graph_path()`, or
+    None if it has not been built."""
+    path = default_road_graph_path()
+    if not path.exists():
+        logger.error(
+            "No road graph at %s; run `python -m backend.routeOptimizer.road_graph --osm <extract.osm>` to build it",
+            path,
+        )
+        return None
+    return RoadGraph.load(path)
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Build the offline road graph for metric=road.")
+    parser.add_argument("--osm", type=Path, required=True, help="OSM XML extract (.osm or .osm.gz)")
+    parser.add_argument("--output", type=Path, default=None, help="graph file (default: ROAD_GRAPH_PATH)")
+    args = parser.parse_args(argv)
+
+    output = args.output or default_road_graph_path()
+    graph = build_road_graph(args.osm, output)
+    print(f"Wrote {len(graph)} road nodes to {output}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class SingleFlightCache:
+    """Short-TTL async result cache with request coalescing.
+
+    Identical concurrent requests share one in-flight upstream call; the result
+    is then served from memory until it expires. Failures are not cached, and
+    every waiter of a failed call receives the same exception. Cancelling a
+    waiter never cancels the shared call.
+    """
+
+    def __init__(self, *, ttl_s: float = 60.0, max_entries: int = 1000) -> None:
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._items: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._inflight: dict[Hashable, asyncio.Future[Any]] = {}
+
+    async def get_or_compute(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        item = self._items.get(key)
+        if item is not None:
+            expires_at, value = item
+            if expires_at > time.monotonic():
+                self._items.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._items[key]
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(self._compute(key, compute))
+            self._inflight[key] = task
+            # Retrieve a failure that no caller is left to await, so it is
+            # not logged as lost.
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        # The call runs in its own task; shield it so that a cancelled caller,
+        # the first one included, does not cancel it for the others.
+        return await asyncio.shield(task)
+
+    async def _compute(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            value = await compute()
+        finally:
+            del self._inflight[key]
+        self._items[key] = (time.monotonic() + self.ttl_s, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_entries:
+            self._items.popitem(last=False)
+        return value
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "size": len(self._items),
+        }
+
+    def clear(self) -> None:
+        self._items.clear()
@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import math
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Sequence
+
+import numpy as np
+
+try:
+    from .catalog_matrix import load_catalog_entries
+    from .optimizer import EARTH_RADIUS_KM
+except ImportError:  # pragma: no cover
+    from catalog_matrix import load_catalog_entries
+    from optimizer import EARTH_RADIUS_KM
+
+
+def unit_vectors(coords: Sequence[tuple[float, float]] | np.ndarray) -> np.ndarray:
+    """(lat, lng) in degrees to points on the unit sphere, shape (N, 3)."""
+    latlng = np.radians(np.asarray(coords, dtype=np.float64).reshape(-1, 2))
+    cos_lat = np.cos(latlng[:, 0])
+    return np.column_stack((cos_lat * np.cos(latlng[:, 1]), cos_lat * np.sin(latlng[:, 1]), np.sin(latlng[:, 0])))
+
+
+def km_to_chord(km: float) -> float:
+    """Straight-line distance through the sphere for a great-circle distance."""
+    return 2.0 * math.sin(min(km / EARTH_RADIUS_KM, math.pi) / 2.0)
+
+
+def chord_to_km(chord: np.ndarray) -> np.ndarray:
+    """Inverse of `km_to_chord`; equals the haversine distance."""
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin(np.minimum(chord / 2.0, 1.0))
+
+
+class SpatialIndex:
+    """Static KD-tree over points on the unit sphere.
+
+    Chord length is monotonic in great-circle distance, so nearest-by-chord
+    is nearest-by-haversine, with no distortion near the poles or the
+    antimeridian. Leaves hold up to `leaf_size` points stored contiguously
+    and are scanned with one vectorized step each, so a query touches a few
+    leaves instead of every point.
+    """
+
+    def __init__(self, coords: Sequence[tuple[float, float]] | np.ndarray, *, leaf_size: int = 32) -> None:
+        points = unit_vectors(coords)
+        n = len(points)
+        perm = np.arange(n)
+        # Per node: split axis (-1 for leaves), split value, children, and the
+        # [lo, hi) range of its points in `perm` order.
+        self._axis: list[int] = []
+        self._split: list[float] = []
+        self._left: list[int] = []
+        self._right: list[int] = []
+        self._lo: list[int] = []
+        self._hi: list[int] = []
+
+        def add_node(lo: int, hi: int) -> int:
+            self._axis.append(-1)
+            self._split.append(0.0)
+            self._left.append(-1)
+            self._right.append(-1)
+            self._lo.append(lo)
+            self._hi.append(hi)
+            return len(self._axis) - 1
+
+        stack = [add_node(0, n)] if n else []
+        while stack:
+            node = stack.pop()
+            lo, hi = self._lo[node], self._hi[node]
+            if hi - lo <= leaf_size:
+                continue
+            block = points[perm[lo:hi]]
+            axis = int((block.max(axis=0) - block.min(axis=0)).argmax())
+            mid = (hi - lo) // 2
+            part = np.argpartition(block[:, axis], mid)
+            perm[lo:hi] = perm[lo:hi][part]
+            self._axis[node] = axis
+            self._split[node] = float(points[perm[lo + mid], axis])
+            self._left[node] = add_node(lo, lo + mid)
+            self._right[node] = add_node(lo + mid, hi)
+            stack.extend((self._left[node], self._right[node]))
+
+        self.size = n
+        # Original index of each stored point, and the points in that order.
+        self.ids = perm
+        self.points = np.ascontiguousarray(points[perm])
+        self._points_by_id = points
+
+    def _search(self, q: np.ndarray, k: int | None, max_chord: float) -> tuple[np.ndarray, np.ndarray]:
+        """Up to `k` points (all if None) within `max_chord` of `q`, nearest first."""
+        bound = max_chord * max_chord
+        best_d2 = np.empty(0)
+        best_i = np.empty(0, dtype=np.intp)
+        if self.size == 0:
+            return best_i, best_d2
+        q0, q1, q2 = float(q[0]), float(q[1]), float(q[2])
+        stack: list[tuple[int, float]] = [(0, 0.0)]
+        while stack:
+            node, lower = stack.pop()
+            if lower > bound:
+                continue
+            axis = self._axis[node]
+            if axis < 0:
+                lo, hi = self._lo[node], self._hi[node]
+                d2 = ((self.points[lo:hi] - q) ** 2).sum(axis=1)
+                hit = np.flatnonzero(d2 <= bound)
+                if not len(hit):
+                    continue
+                best_d2 = np.concatenate((best_d2, d2[hit]))
+                best_i = np.concatenate((best_i, hit + lo))
+                if k is not None and len(best_d2) >= k:
+                    if len(best_d2) > k:
+                        keep = np.argpartition(best_d2, k - 1)[:k]
+                        best_d2 = best_d2[keep]
+                        best_i = best_i[keep]
+                    bound = float(best_d2.max())
+                continue
+            diff = (q0, q1, q2)[axis] - self._split[node]
+            near, far = (self._left[node], self._right[node]) if diff < 0 else (self._right[node], self._left[node])
+            stack.append((far, max(lower, diff * diff)))
+            stack.append((near, lower))
+        order = np.argsort(best_d2, kind="stable")
+        return self.ids[best_i[order]], np.sqrt(best_d2[order])
+
+    def nearest(self, lat: float, lng: float, k: int, *, max_km: float | None = None) -> tuple[np.ndarray, np.ndarray]:
+        """Indices and haversine km of the `k` points nearest to (lat, lng),
+        optionally only those within `max_km`."""
+        q = unit_vectors([(lat, lng)])[0]
+        max_chord = km_to_chord(max_km) if max_km is not None else 2.0
+        idx, chord = self._search(q, k, max_chord)
+        return idx, chord_to_km(chord)
+
+    def within(self, lat: float, lng: float, radius_km: float) -> tuple[np.ndarray, np.ndarray]:
+        """Every point within `radius_km` of (lat, lng), nearest first."""
+        q = unit_vectors([(lat, lng)])[0]
+        idx, chord = self._search(q, None, km_to_chord(radius_km))
+        return idx, chord_to_km(chord)
+
+    def _within_unit(self, q: np.ndarray, radius_km: float) -> np.ndarray:
+        idx, _ = self._search(q, None, km_to_chord(radius_km))
+        return idx
+
+    def detour_candidates(
+        self,
+        route: Sequence[tuple[float, float]],
+        max_detour_km: float,
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Points worth a stop along `route` (a polyline of (lat, lng)).
+
+        A point qualifies if visiting it between two consecutive route points
+        adds at most `max_detour_km` (straight-line) to that leg. Returns the
+        point indices, their smallest detour and the leg it is achieved on
+        (0 = between route[0] and route[1]), smallest detour first.
+        """
+        route_pts = unit_vectors(route)
+        best: dict[int, tuple[float, int]] = {}
+        for leg in range(len(route_pts) - 1):
+            a = route_pts[leg]
+            b = route_pts[leg + 1]
+            leg_km = float(chord_to_km(np.linalg.norm(a - b)))
+            mid = a + b
+            norm = np.linalg.norm(mid)
+            center = mid / norm if norm > 1e-12 else a
+            # Any point with d(a,p) + d(p,b) <= L + D lies within L + D/2 of
+            # the leg midpoint (triangle inequality), so this ball is safe.
+            idx = self._within_unit(center, leg_km + max_detour_km / 2.0)
+            if not len(idx):
+                continue
+            pts = self._points_by_id[idx]
+            detour = (
+                chord_to_km(np.linalg.norm(pts - a, axis=1))
+                + chord_to_km(np.linalg.norm(pts - b, axis=1))
+                - leg_km
+            )
+            ok = detour <= max_detour_km
+            for i, d in zip(idx[ok].tolist(), detour[ok].tolist()):
+                if i not in best or d < best[i][0]:
+                    best[i] = (d, leg)
+        ranked = sorted(best.items(), key=lambda item: (item[1][0], item[0]))
+        return (
+            np.array([i for i, _ in ranked], dtype=np.intp),
+            np.array([d for _, (d, _) in ranked], dtype=np.float64),
+            np.array([leg for _, (_, leg) in ranked], dtype=np.intp),
+        )
+
+
+@dataclass
+class CatalogIndex:
+    """Catalog entries and a spatial index whose point ids are their positions."""
+
+    destinations: list[dict[str, Any]]
+    index: SpatialIndex
+
+
+@lru_cache(maxsize=1)
+def get_catalog_index() -> CatalogIndex | None:
+    """Spatial index over the destination catalog.
+
+    Built straight from destinations.json, so it works without a catalog
+    matrix file and while a stale one is rejected; None without a catalog.
+    """
+    entries = load_catalog_entries()
+    if entries is None:
+        return None
+    return CatalogIndex(destinations=entries, index=SpatialIndex([(e["lat"], e["lng"]) for e in entries]))
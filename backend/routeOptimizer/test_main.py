@@ -103,3 +103,1303 @@ def test_traffic_route_invalid():
     response = client.post("/traffic-route", json=payload)
     # Should error due to invalid route (Google API not called in test)
     assert response.status_code in (400, 422)
+
+
+# 2-opt on an asymmetric matrix should reach a tour no single reversal can improve
+def test_two_opt_asymmetric_local_optimum():
+    import random
+    from optimizer import path_length, two_opt_open_path_any
+
+    rng = random.Random(7)
+    n = 12
+    cost = [[0.0 if i == j else rng.uniform(1, 100) for j in range(n)] for i in range(n)]
+    start = list(range(n))
+    order = two_opt_open_path_any(cost, start)
+
+    assert sorted(order) == start
+    best = path_length(cost, order, return_to_start=False)
+    assert best <= path_length(cost, start, return_to_start=False)
+    for i in range(1, n - 2):
+        for k in range(i + 1, n - 1):
+            candidate = order[:]
+            candidate[i : k + 1] = reversed(candidate[i : k + 1])
+            assert path_length(cost, candidate, return_to_start=False) + 1e-9 >= best
+
+
+# Small itineraries are solved exactly and the response says so
+def test_optimize_reports_exact_solver():
+    payload = {
+        "itinerary": [
+            {"id": "1", "name": "Kandy", "location": {"lat": 7.2906, "lng": 80.6337}},
+            {"id": "2", "name": "Colombo", "location": {"lat": 6.9271, "lng": 79.8612}},
+            {"id": "3", "name": "Galle", "location": {"lat": 6.0535, "lng": 80.2210}},
+            {"id": "4", "name": "Sigiriya", "location": {"lat": 7.9570, "lng": 80.7603}},
+            {"id": "5", "name": "Ella", "location": {"lat": 6.8667, "lng": 81.0467}},
+        ],
+        "return_to_start": True,
+        "try_all_starts": True,
+    }
+    response = client.post("/optimize", json=payload)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["solver"] == "held_karp"
+    assert data["optimal"] is True
+    assert data["optimized_order"][0] == 0
+
+
+# Held-Karp should match brute force on asymmetric costs
+def test_held_karp_matches_brute_force():
+    import itertools
+    import random
+    from exact import held_karp
+    from optimizer import path_length
+
+    rng = random.Random(3)
+    n = 6
+    cost = [[0.0 if i == j else rng.uniform(1, 50) for j in range(n)] for i in range(n)]
+    for return_to_start in (False, True):
+        order = held_karp(cost, return_to_start=return_to_start)
+        best = min(path_length(cost, list(p), return_to_start) for p in itertools.permutations(range(n)))
+        assert abs(path_length(cost, order, return_to_start) - best) < 1e-9
+
+
+# The vectorized haversine matrix should agree with the scalar implementation
+def test_distance_matrix_array_matches_scalar():
+    import numpy as np
+    from optimizer import build_distance_matrix, build_distance_matrix_array
+
+    coords = [(7.2906, 80.6337), (6.9271, 79.8612), (6.0535, 80.2210), (9.6615, 80.0255)]
+    dist = build_distance_matrix_array(coords)
+    assert dist.shape == (4, 4)
+    assert dist.dtype == np.float64
+    assert np.allclose(dist, build_distance_matrix(coords), rtol=0, atol=1e-9)
+    assert build_distance_matrix_array(coords, dtype=np.float32).dtype == np.float32
+
+
+# Every construction heuristic should produce a valid route for a large itinerary
+def test_optimize_construction_heuristics():
+    import random
+
+    rng = random.Random(11)
+    itinerary = [
+        {"id": str(i), "name": f"Stop {i}", "location": {"lat": rng.uniform(5.9, 9.8), "lng": rng.uniform(79.7, 81.9)}}
+        for i in range(30)
+    ]
+    for construction in ("nearest_neighbor", "greedy_edge", "christofides", "space_filling_curve"):
+        payload = {"itinerary": itinerary, "try_all_starts": False, "construction": construction}
+        response = client.post("/optimize", json=payload)
+        assert response.status_code == 200
+        data = response.json()
+        assert sorted(data["optimized_order"]) == list(range(30))
+        assert data["optimized_order"][0] == 0
+        assert data["optimal"] is False
+        assert data["solver"].endswith("_2opt")
+
+
+# Only pairs missing from the matrix cache should be requested from Google
+def test_fetch_distance_matrix_requests_only_missing_pairs(monkeypatch):
+    import numpy as np
+    import google_matrix
+    from matrix_cache import MemoryBackend, PairMatrixCache
+
+    calls = []
+
+    async def fake_request(client, url, origins, destinations, params):
+        calls.append((list(origins), list(destinations)))
+        shape = (len(origins), len(destinations))
+        return np.full(shape, 10.0), np.full(shape, 600.0), np.full(shape, 700.0)
+
+    monkeypatch.setattr(google_matrix, "_request_tile", fake_request)
+    cache = PairMatrixCache(MemoryBackend())
+    coords = [(7.2906, 80.6337), (6.9271, 79.8612), (6.0535, 80.2210)]
+
+    first = google_matrix.fetch_distance_matrix(coords, api_key="test", cache=cache)
+    assert len(calls) == 1
+    assert first["duration_in_traffic_s"][0, 1] == 700.0
+    assert first["distance_km"][1, 1] == 0.0
+
+    calls.clear()
+    google_matrix.fetch_distance_matrix(coords + [(7.9570, 80.7603)], api_key="test", cache=cache)
+    requested = sorted((len(o), len(d)) for o, d in calls)
+    assert requested == [(1, 3), (3, 1)]
+
+    calls.clear()
+    google_matrix.fetch_distance_matrix(coords, api_key="test", cache=cache)
+    assert calls == []
+
+
+# Cache backends should expire entries after their TTL
+def test_matrix_cache_backends_ttl(tmp_path):
+    from matrix_cache import MemoryBackend, SQLiteBackend
+
+    for backend in (MemoryBackend(max_entries=2), SQLiteBackend(tmp_path / "cache.sqlite3")):
+        backend.set_many({"a": (1.0, 2.0, 3.0)}, ttl_s=60)
+        backend.set_many({"b": (4.0, 5.0, 6.0)}, ttl_s=-1)
+        assert backend.get_many(["a", "b"]) == {"a": (1.0, 2.0, 3.0)}
+
+    lru = MemoryBackend(max_entries=2)
+    lru.set_many({"a": (1.0, 1.0, 1.0), "b": (2.0, 2.0, 2.0)}, ttl_s=60)
+    lru.get_many(["a"])
+    lru.set_many({"c": (3.0, 3.0, 3.0)}, ttl_s=60)
+    assert set(lru.get_many(["a", "b", "c"])) == {"a", "c"}
+
+    # Unreachable elements get their own short TTL (0: never cached).
+    import pytest
+
+    from matrix_cache import MatrixCacheBackend, PairMatrixCache
+
+    with pytest.raises(TypeError):
+        MatrixCacheBackend()
+    cache = PairMatrixCache(MemoryBackend(), unreachable_ttl_s=0)
+    cache.set_many({"ok": (1.0, 60.0, 70.0), "no_route": (1e9, 1e9, 1e9)})
+    assert set(cache.get_many(["ok", "no_route"])) == {"ok"}
+
+
+# Large matrices are tiled into API-legal requests against a local mock server,
+# with transient tile failures retried
+def test_fetch_distance_matrix_tiles_with_mock_server():
+    import json
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import parse_qs, urlparse
+    import google_matrix
+
+    seen = []
+    failed_once = set()
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            query = parse_qs(urlparse(self.path).query)
+            origins = query["origins"][0].split("|")
+            destinations = query["destinations"][0].split("|")
+            with lock:
+                seen.append((len(origins), len(destinations)))
+                # First request for each tile fails with a 503 to exercise the retry.
+                tile = (origins[0], destinations[0])
+                first_try = tile not in failed_once
+                failed_once.add(tile)
+            if first_try:
+                self.send_response(503)
+                self.end_headers()
+                return
+            rows = [
+                {
+                    "elements": [
+                        {
+                            "status": "OK",
+                            "distance": {"value": 1000 * (float(o.split(",")[0]) + float(d.split(",")[0]))},
+                            "duration": {"value": 60},
+                        }
+                        for d in destinations
+                    ]
+                }
+                for o in origins
+            ]
+            body = json.dumps({"status": "OK", "rows": rows}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        coords = [(float(i), 80.0) for i in range(30)]
+        result = google_matrix.fetch_distance_matrix(
+            coords,
+            api_key="test",
+            use_cache=False,
+            url=f"http://127.0.0.1:{server.server_address[1]}/",
+            retry_backoff_s=0.0,
+        )
+    finally:
+        server.shutdown()
+
+    assert all(o <= 25 and d <= 25 and o * d <= 100 for o, d in seen)
+    assert result["distance_km"].shape == (30, 30)
+    assert result["distance_km"][3, 7] == 10.0
+    assert result["distance_km"][5, 5] == 0.0
+    assert not result["failed"].any()
+
+
+# Fetched elements are appended to the observation log off the event loop thread
+def test_fetch_distance_matrix_logs_observations_off_loop(monkeypatch):
+    import threading
+
+    import numpy as np
+    import google_matrix
+
+    async def fake_request(client, url, origins, destinations, params):
+        shape = (len(origins), len(destinations))
+        return np.full(shape, 10.0), np.full(shape, 600.0), np.full(shape, 700.0)
+
+    written = []
+    monkeypatch.setattr(google_matrix, "_request_tile", fake_request)
+    monkeypatch.setattr(google_matrix, "observation_log_path", lambda: "observations.jsonl")
+    monkeypatch.setattr(google_matrix, "record_observations", lambda rows: written.append((threading.get_ident(), rows)))
+    coords = [(7.2906, 80.6337), (6.9271, 79.8612), (6.0535, 80.2210)]
+    google_matrix.fetch_distance_matrix(coords, api_key="test", use_cache=False)
+
+    [(thread, rows)] = written
+    assert thread != threading.get_ident()
+    assert len(rows) == 6 and rows[0][-3:] == (10.0, 600.0, 700.0)
+
+
+# Matrix cache reads and writes (SQLite, Redis) run off the event loop thread
+def test_fetch_distance_matrix_cache_off_loop(monkeypatch):
+    import threading
+
+    import numpy as np
+    import google_matrix
+    from matrix_cache import MemoryBackend, PairMatrixCache
+
+    async def fake_request(client, url, origins, destinations, params):
+        shape = (len(origins), len(destinations))
+        return np.full(shape, 10.0), np.full(shape, 600.0), np.full(shape, 700.0)
+
+    class ThreadRecordingBackend(MemoryBackend):
+        def get_many(self, keys):
+            cache_threads.append(threading.get_ident())
+            return super().get_many(keys)
+
+        def set_many(self, items, ttl_s):
+            cache_threads.append(threading.get_ident())
+            super().set_many(items, ttl_s)
+
+    cache_threads = []
+    monkeypatch.setattr(google_matrix, "_request_tile", fake_request)
+    coords = [(7.2906, 80.6337), (6.9271, 79.8612), (6.0535, 80.2210)]
+    google_matrix.fetch_distance_matrix(coords, api_key="test", cache=PairMatrixCache(ThreadRecordingBackend()))
+    assert len(cache_threads) == 2 and threading.get_ident() not in cache_threads
+
+
+# A tile that keeps failing is marked and penalized instead of failing the matrix
+def test_fetch_distance_matrix_partial_failure(monkeypatch):
+    import numpy as np
+    import google_matrix
+
+    async def flaky_request(client, url, origins, destinations, params):
+        if origins[0] == (0.0, 80.0):
+            raise google_matrix._RetryableMatrixError("OVER_QUERY_LIMIT")
+        shape = (len(origins), len(destinations))
+        return np.ones(shape), np.ones(shape), np.ones(shape)
+
+    monkeypatch.setattr(google_matrix, "_request_tile", flaky_request)
+    coords = [(float(i), 80.0) for i in range(12)]
+    result = google_matrix.fetch_distance_matrix(coords, api_key="test", use_cache=False, retry_backoff_s=0.0)
+
+    assert result["failed"][0, 1]
+    assert result["distance_km"][0, 1] == google_matrix.UNREACHABLE
+    assert not result["failed"][11, 10]
+    assert result["distance_km"][11, 10] == 1.0
+
+
+# Route legs priced with a failed tile are reported in failed_legs
+def test_optimize_reports_failed_legs(monkeypatch):
+    import numpy as np
+    import google_matrix
+
+    async def flaky_request(client, url, origins, destinations, params):
+        if origins[0] == (6.5, 81.5):
+            raise google_matrix._RetryableMatrixError("OVER_QUERY_LIMIT")
+        shape = (len(origins), len(destinations))
+        return np.ones(shape), np.ones(shape), np.ones(shape)
+
+    monkeypatch.setenv("GOOGLE_MAPS_API_KEY", "test")
+    monkeypatch.setattr(google_matrix, "_request_tile", flaky_request)
+    itinerary = [{"id": str(i), "name": str(i), "location": {"lat": 6.5 + 0.01 * i, "lng": 81.5}} for i in range(12)]
+    body = {"itinerary": itinerary, "metric": "google", "try_all_starts": False}
+    response = client.post("/optimize", json=body)
+    assert response.status_code == 200
+    data = response.json()
+    # The first stop's tile failed, so the leg out of it is unreachable.
+    assert 0 in data["failed_legs"]
+    unreachable = [k for k, s in enumerate(data["segments"]) if s["distance_km"] >= google_matrix.UNREACHABLE]
+    assert data["failed_legs"] == unreachable
+
+
+# The app lifespan should open one pooled Google client and close it on shutdown
+def test_lifespan_shared_google_client(monkeypatch):
+    import http_client
+
+    monkeypatch.setenv("GOOGLE_HTTP_MAX_CONNECTIONS", "7")
+    with TestClient(app) as lifespan_client:
+        shared = http_client.get_google_client()
+        assert shared is not None
+        assert shared._transport._pool._max_connections == 7
+        assert lifespan_client.get("/health").status_code == 200
+        assert http_client.get_google_client() is shared
+    assert http_client.get_google_client() is None
+    assert shared.is_closed
+
+
+# Identical concurrent traffic-route lookups share one upstream call, then hit the cache
+def test_single_flight_cache_coalesces():
+    import asyncio
+    from route_cache import SingleFlightCache
+
+    cache = SingleFlightCache(ttl_s=60)
+    calls = []
+
+    async def upstream():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"legs": []}
+
+    async def run():
+        results = await asyncio.gather(*(cache.get_or_compute("k", upstream) for _ in range(5)))
+        again = await cache.get_or_compute("k", upstream)
+        return results, again
+
+    results, again = asyncio.run(run())
+    assert len(calls) == 1
+    assert all(r == {"legs": []} for r in results) and again == {"legs": []}
+    assert cache.stats() == {"hits": 1, "misses": 1, "coalesced": 4, "size": 1}
+
+    # Cancelling the caller that started the call leaves it running for the others.
+    async def cancel_first():
+        first = asyncio.ensure_future(cache.get_or_compute("c", upstream))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(cache.get_or_compute("c", upstream))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second, first.cancelled()
+
+    assert asyncio.run(cancel_first()) == ({"legs": []}, True)
+    assert len(calls) == 2
+
+
+# /traffic-route should serve repeated requests from the cache
+def test_traffic_route_cached(monkeypatch):
+    import main
+
+    calls = []
+
+    async def fake_route(**kwargs):
+        calls.append(kwargs)
+        return {"durationSeconds": 120.0, "distanceMeters": 1500, "legs": [{"encodedPolyline": "abc"}]}
+
+    monkeypatch.setattr(main, "compute_traffic_route_async", fake_route)
+    main.traffic_route_cache.clear()
+    before = main.traffic_route_cache.stats()
+    payload = {"origin": {"lat": 7.29, "lng": 80.63}, "destination": {"lat": 6.93, "lng": 79.86}}
+    for _ in range(3):
+        response = client.post("/traffic-route", json=payload)
+        assert response.status_code == 200
+        assert response.json()["legs"][0]["encoded_polyline"] == "abc"
+
+    assert len(calls) == 1
+    stats = client.get("/traffic-route/cache-stats").json()
+    assert stats["hits"] - before["hits"] == 2
+    assert stats["misses"] - before["misses"] == 1
+
+
+# /optimize/batch streams one NDJSON line per item, with per-item errors
+def test_optimize_batch_ndjson():
+    import json
+
+    good = {
+        "itinerary": [
+            {"id": "1", "name": "Kandy", "location": {"lat": 7.2906, "lng": 80.6337}},
+            {"id": "2", "name": "Colombo", "location": {"lat": 6.9271, "lng": 79.8612}},
+            {"id": "3", "name": "Galle", "location": {"lat": 6.0535, "lng": 80.2210}},
+        ],
+        "try_all_starts": False,
+    }
+    invalid = {"itinerary": [], "metric": "invalid_metric"}
+    response = client.post("/optimize/batch", json={"items": [good, invalid, good]})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+
+    lines = [json.loads(line) for line in response.text.splitlines() if line]
+    by_index = {line["index"]: line for line in lines}
+    assert sorted(by_index) == [0, 1, 2]
+    assert "error" in by_index[1]
+    assert by_index[0]["result"]["optimized_order"][0] == 0
+    assert sorted(by_index[2]["result"]["optimized_order"]) == [0, 1, 2]
+
+
+# A tight time budget still returns a valid route for a large itinerary
+def test_optimize_time_budget():
+    import random
+
+    rng = random.Random(7)
+    itinerary = [
+        {"id": str(i), "name": f"Stop {i}", "location": {"lat": rng.uniform(5.9, 9.8), "lng": rng.uniform(79.7, 81.9)}}
+        for i in range(400)
+    ]
+    response = client.post("/optimize", json={"itinerary": itinerary, "time_budget_ms": 20})
+    assert response.status_code == 200
+    data = response.json()
+    assert sorted(data["optimized_order"]) == list(range(400))
+    assert data["timed_out"] is True
+    assert data["elapsed_ms"] < 1000
+
+    # Small itineraries are still solved exactly within a generous budget
+    response = client.post("/optimize", json={"itinerary": itinerary[:6], "time_budget_ms": 1000})
+    assert response.json()["solver"] == "held_karp"
+    assert response.json()["timed_out"] is False
+
+    # Greedy edge and Christofides give up at the deadline; the solver names the seed actually used
+    import time
+    from construction import christofides_like, greedy_edge
+    from optimizer import build_distance_matrix_array, solve_order_from_cost_matrix
+
+    coords = [(d["location"]["lat"], d["location"]["lng"]) for d in itinerary]
+    cost = build_distance_matrix_array(coords)
+    assert greedy_edge(cost, deadline=time.perf_counter()) is None
+    assert christofides_like(cost, deadline=time.perf_counter()) is None
+    for construction in ("greedy_edge", "christofides"):
+        solved = solve_order_from_cost_matrix(
+            cost, return_to_start=False, try_all_starts=False, construction=construction, time_budget_ms=0.001
+        )
+        assert solved.solver == "greedy_2opt"
+        solved = solve_order_from_cost_matrix(
+            cost,
+            return_to_start=False,
+            try_all_starts=False,
+            construction=construction,
+            coords=coords,
+            time_budget_ms=0.001,
+        )
+        assert solved.solver == "space_filling_curve_2opt"
+        assert sorted(solved.order) == list(range(400)) and solved.order[0] == 0
+
+
+# day_split cuts the route into days that respect the daily driving limit
+def test_optimize_day_split():
+    import random
+
+    rng = random.Random(3)
+    itinerary = [
+        {"id": str(i), "name": f"Stop {i}", "location": {"lat": rng.uniform(6.5, 8.0), "lng": rng.uniform(79.9, 81.0)}}
+        for i in range(40)
+    ]
+    payload = {"itinerary": itinerary, "day_split": {"days": 10}}
+    data = client.post("/optimize", json=payload).json()
+    assert len(data["days"]) == 10
+    assert [i for day in data["days"] for i in day["optimized_order"]] == data["optimized_order"]
+    assert sorted(data["optimized_order"]) == list(range(40))
+
+    payload["day_split"] = {"max_drive_minutes": 180}
+    days = client.post("/optimize", json=payload).json()["days"]
+    assert all(day["drive_seconds"] <= 180 * 60 + 1e-6 or len(day["optimized_order"]) == 1 for day in days)
+    assert all(not day["over_limit"] for day in days if len(day["optimized_order"]) > 1)
+
+    base = {"id": "b", "name": "Kandy hotel", "location": {"lat": 7.29, "lng": 80.63}}
+    payload["day_split"] = {"days": 4, "overnight_bases": [base]}
+    days = client.post("/optimize", json=payload).json()["days"]
+    assert len(days) == 4
+    assert days[0]["start_base_index"] is None and days[0]["end_base_index"] == 0
+    assert days[-1]["start_base_index"] == 0 and days[-1]["end_base_index"] is None
+
+    assert client.post("/optimize", json={"itinerary": itinerary, "day_split": {}}).status_code == 422
+
+
+# Catalog opening hours and best-time text parse into visiting windows
+def test_parse_time_windows():
+    from time_windows import format_clock, parse_best_time, parse_opening_hours
+
+    def clock(windows):
+        return [(format_clock(a), format_clock(b)) for a, b in windows]
+
+    assert clock(parse_opening_hours("6.00 AM - 10.00 PM")) == [("06:00", "22:00")]
+    assert clock(parse_opening_hours("5:00 AM - 12:00 PM, 4:00 PM - 9:00 PM")) == [("05:00", "12:00"), ("16:00", "21:00")]
+    assert clock(parse_opening_hours("Open 24 hours")) == [("00:00", "24:00")]
+    assert clock(parse_opening_hours("Daytime only")) == [("06:00", "18:00")]
+    assert clock(parse_best_time("Evening (4:30 PM - sunset)")) == [("16:30", "18:30")]
+    assert clock(parse_best_time("Early morning (7:00–9:00 AM) when quiet")) == [("07:00", "09:00")]
+    assert clock(parse_best_time("Morning or late afternoon")) == [("06:00", "12:00"), ("15:30", "18:00")]
+    assert parse_best_time("After rainfall") == ()
+
+
+# time_windows schedules stops inside opening hours and reports unreachable ones
+def test_optimize_time_windows():
+    itinerary = [
+        {"id": "1", "name": "Temple", "location": {"lat": 6.9167, "lng": 79.8567}, "opening_hours": "6.00 AM - 10.00 PM"},
+        {"id": "2", "name": "Museum", "location": {"lat": 6.9100, "lng": 79.8610}, "opening_hours": "9:00 AM - 11:00 AM"},
+        {"id": "3", "name": "Beach", "location": {"lat": 6.9270, "lng": 79.8450}, "opening_hours": "4:00 PM - 7:00 PM"},
+        {"id": "4", "name": "Show", "location": {"lat": 6.9200, "lng": 79.8700}, "opening_hours": "6:00 AM - 7:00 AM"},
+    ]
+    payload = {"itinerary": itinerary, "time_windows": {"start_time": "08:00", "default_visit_minutes": 60}}
+    response = client.post("/optimize", json=payload)
+    assert response.status_code == 200
+    data = response.json()
+    assert sorted(data["optimized_order"]) == [0, 1, 2, 3]
+    assert data["infeasible_indices"] == [3]
+    schedule = {s["index"]: s for s in data["schedule"]}
+    assert "09:00" <= schedule[1]["start"] <= "10:00"
+    assert schedule[2]["start"] >= "16:00"
+    assert data["optimized_order"][-1] == 3
+
+
+# Time-window relocations end in a route that no single relocation improves
+def test_time_window_relocations_local_optimum():
+    import numpy as np
+
+    from time_windows import _better, _evaluate, solve_time_windows
+
+    rng = np.random.default_rng(3)
+    n = 25
+    points = rng.uniform(0, 50, (n + 1, 2))
+    travel = np.linalg.norm(points[:, None] - points[None], axis=2) * 60.0
+    opens = rng.uniform(8, 15, n + 1) * 3600
+    windows = [((o, o + 3 * 3600.0),) if k % 3 else ((0.0, 86400.0),) for k, o in enumerate(opens)]
+    service = [1200.0] * (n + 1)
+    stops = list(range(1, n + 1))
+    result = solve_time_windows(stops, travel, windows, service, start_s=8 * 3600.0, origin=0)
+
+    order = result.order
+    best = _evaluate(order, travel, windows, service, 8 * 3600.0, 0)
+    assert best[0] == len(result.infeasible)
+    for i in range(n):
+        without = order[:i] + order[i + 1 :]
+        for j in range(n):
+            moved = without[:j] + [order[i]] + without[j:]
+            assert not _better(_evaluate(moved, travel, windows, service, 8 * 3600.0, 0), best)
+
+
+# /optimize/catalog slices the prebuilt, memory-mapped catalog matrix by id
+def test_optimize_catalog_matrix(tmp_path, monkeypatch):
+    import json
+
+    import numpy as np
+
+    import catalog_matrix
+
+    catalog = [
+        {"id": "kandy", "name": "Kandy", "latitude": 7.2906, "longitude": 80.6337, "opening_hours": "Open all day"},
+        {"id": "colombo", "name": "Colombo", "latitude": 6.9271, "longitude": 79.8612},
+        {"id": "galle", "name": "Galle", "latitude": 6.0535, "longitude": 80.2210},
+        {"id": "ella", "name": "Ella", "latitude": 6.8667, "longitude": 81.0466},
+    ]
+    path = catalog_matrix.build_catalog_matrix(catalog, tmp_path / "catalog_matrix.npy")
+    monkeypatch.setenv("CATALOG_MATRIX_PATH", str(path))
+    catalog_matrix.get_catalog_matrix.cache_clear()
+    try:
+        loaded = catalog_matrix.get_catalog_matrix()
+        assert isinstance(loaded.layers["haversine_km"], np.memmap)
+
+        ids = ["galle", "kandy", "colombo", "ella"]
+        response = client.post("/optimize/catalog", json={"destination_ids": ids, "try_all_starts": False})
+        assert response.status_code == 200
+        data = response.json()
+        assert [d["id"] for d in data["optimized_itinerary"]][0] == "galle"
+
+        itinerary = [
+            {"id": d["id"], "name": d["name"], "location": {"lat": d["latitude"], "lng": d["longitude"]}}
+            for d in sorted(catalog, key=lambda d: ids.index(d["id"]))
+        ]
+        direct = client.post("/optimize", json={"itinerary": itinerary, "try_all_starts": False}).json()
+        assert data["optimized_order"] == direct["optimized_order"]
+        assert abs(data["total_distance_km"] - direct["total_distance_km"]) < 1e-9
+
+        response = client.post("/optimize/catalog", json={"destination_ids": ["kandy", "nowhere"]})
+        assert response.status_code == 404
+
+        # A matrix built from another version of destinations.json is not used
+        source = tmp_path / "destinations.json"
+        source.write_text(json.dumps(catalog), encoding="utf-8")
+        _, digest = catalog_matrix._read_catalog(source)
+        catalog_matrix.build_catalog_matrix(catalog, path, source_sha256=digest)
+        monkeypatch.setenv("DESTINATIONS_JSON_PATH", str(source))
+        catalog_matrix.get_catalog_matrix.cache_clear()
+        assert catalog_matrix.get_catalog_matrix().source_sha256 == digest
+        source.write_text(json.dumps(catalog[:3]), encoding="utf-8")
+        catalog_matrix.get_catalog_matrix.cache_clear()
+        response = client.post("/optimize/catalog", json={"destination_ids": ids})
+        assert response.status_code == 503
+    finally:
+        catalog_matrix.get_catalog_matrix.cache_clear()
+
+
+# The spatial index matches a linear haversine scan
+def test_spatial_index_matches_linear_scan():
+    import numpy as np
+
+    from optimizer import haversine_km
+    from spatial_index import SpatialIndex
+
+    rng = np.random.default_rng(5)
+    coords = np.column_stack((rng.uniform(5.9, 9.8, 3000), rng.uniform(79.7, 81.9, 3000)))
+    index = SpatialIndex(coords)
+    for lat, lng in rng.uniform([5.9, 79.7], [9.8, 81.9], (10, 2)):
+        scan = np.array([haversine_km(lat, lng, p[0], p[1]) for p in coords])
+        idx, km = index.nearest(lat, lng, 5)
+        assert idx.tolist() == np.argsort(scan, kind="stable")[:5].tolist()
+        assert np.allclose(km, np.sort(scan)[:5])
+        idx, km = index.within(lat, lng, 8.0)
+        assert sorted(idx.tolist()) == np.flatnonzero(scan <= 8.0).tolist()
+
+    route = [(6.93, 79.86), (7.29, 80.63)]
+    idx, detour, leg = index.detour_candidates(route, 3.0)
+    direct = haversine_km(*route[0], *route[1])
+
+    def via(p):
+        return haversine_km(*route[0], *p) + haversine_km(*p, *route[1]) - direct
+
+    for i, extra in zip(idx.tolist(), detour.tolist()):
+        assert abs(via(coords[i]) - extra) < 1e-6
+    expected = [i for i, p in enumerate(coords) if via(p) <= 3.0]
+    assert sorted(idx.tolist()) == expected
+
+
+# /nearby and /nearby/along-route query the catalog index
+def test_nearby_endpoints(tmp_path, monkeypatch):
+    import json
+
+    import spatial_index
+
+    catalog = [
+        {"id": "kandy", "name": "Kandy", "latitude": 7.2906, "longitude": 80.6337},
+        {"id": "peradeniya", "name": "Peradeniya", "latitude": 7.2690, "longitude": 80.5960},
+        {"id": "colombo", "name": "Colombo", "latitude": 6.9271, "longitude": 79.8612},
+        {"id": "kegalle", "name": "Kegalle", "latitude": 7.2513, "longitude": 80.3464},
+        {"id": "galle", "name": "Galle", "latitude": 6.0535, "longitude": 80.2210},
+    ]
+    # The index needs only destinations.json, not a (possibly stale) catalog matrix.
+    source = tmp_path / "destinations.json"
+    source.write_text(json.dumps(catalog))
+    monkeypatch.setenv("DESTINATIONS_JSON_PATH", str(source))
+    monkeypatch.setenv("CATALOG_MATRIX_PATH", str(tmp_path / "missing.npy"))
+    spatial_index.get_catalog_index.cache_clear()
+    try:
+        response = client.post("/nearby", json={"location": {"lat": 7.29, "lng": 80.63}, "k": 2, "exclude_ids": ["kandy"]})
+        assert response.status_code == 200
+        assert [r["id"] for r in response.json()["results"]] == ["peradeniya", "kegalle"]
+
+        response = client.post("/nearby", json={"location": {"lat": 7.29, "lng": 80.63}, "radius_km": 10})
+        assert [r["id"] for r in response.json()["results"]] == ["kandy", "peradeniya"]
+
+        payload = {
+            "route": [{"lat": 6.9271, "lng": 79.8612}, {"lat": 7.2906, "lng": 80.6337}],
+            "max_detour_km": 5,
+            "exclude_ids": ["kandy", "colombo"],
+        }
+        candidates = client.post("/nearby/along-route", json=payload).json()["candidates"]
+        assert {c["id"] for c in candidates} == {"peradeniya", "kegalle"}
+        assert all(c["insert_after"] == 0 and c["detour_km"] <= 5 for c in candidates)
+    finally:
+        spatial_index.get_catalog_index.cache_clear()
+
+
+# Polylines round-trip, and simplification keeps speed intervals on the right stretch
+def test_polyline_simplification():
+    import numpy as np
+
+    from polyline import decode_polyline, douglas_peucker, encode_polyline, remap_intervals, simplify_leg
+
+    points = decode_polyline("_p~iF~ps|U_ulLnnqC_mqNvxq`@")
+    assert np.allclose(points, [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)])
+    assert encode_polyline(points) == "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+    # A string cut off inside a value is rejected, not silently shortened.
+    with pytest.raises(ValueError):
+        decode_polyline("_p~iF~ps|U_ulLnnqC_mqNvxq`@_")
+
+    # A straight line with one sharp corner collapses to three points
+    line = [(7.0, 80.0 + 0.001 * i) for i in range(50)] + [(7.0 + 0.001 * i, 80.049) for i in range(1, 50)]
+    kept = douglas_peucker(np.array(line), 5.0)
+    assert kept.tolist() == [0, 49, 98]
+
+    intervals = [
+        {"startIndex": 0, "endIndex": 20, "speed": "NORMAL"},
+        {"startIndex": 20, "endIndex": 60, "speed": "SLOW"},
+        {"startIndex": 60, "endIndex": 98, "speed": "SLOW"},
+    ]
+    # The short NORMAL stretch snaps to nothing; the two SLOW ones merge.
+    assert remap_intervals(intervals, kept) == [{"startIndex": 0, "endIndex": 2, "speed": "SLOW"}]
+
+    leg = {"encodedPolyline": encode_polyline(line), "speedReadingIntervals": intervals}
+    simplified = simplify_leg(leg, 5.0)
+    # Corner and endpoints, plus the interval boundaries at 20 and 60
+    assert len(decode_polyline(simplified["encodedPolyline"])) == 5
+    assert [i["speed"] for i in simplified["speedReadingIntervals"]] == ["NORMAL", "SLOW"]
+    assert leg["encodedPolyline"] == encode_polyline(line)
+
+
+# /traffic-route simplifies the cached route per zoom level
+def test_traffic_route_zoom(monkeypatch):
+    import main
+    from polyline import decode_polyline, encode_polyline
+
+    line = [(7.0 + 0.0001 * i, 80.0 + 0.0001 * (i % 2)) for i in range(500)]
+    calls = []
+
+    async def fake_route(**kwargs):
+        calls.append(kwargs)
+        intervals = [{"startIndex": 0, "endIndex": 250, "speed": "NORMAL"}, {"startIndex": 250, "endIndex": 499, "speed": "TRAFFIC_JAM"}]
+        return {"durationSeconds": 600.0, "legs": [{"encodedPolyline": encode_polyline(line), "speedReadingIntervals": intervals}]}
+
+    monkeypatch.setattr(main, "compute_traffic_route_async", fake_route)
+    main.traffic_route_cache.clear()
+    payload = {"origin": {"lat": 7.0, "lng": 80.0}, "destination": {"lat": 7.05, "lng": 80.0}}
+
+    overview = client.post("/traffic-route", json={**payload, "zoom": 8}).json()["legs"][0]
+    detailed = client.post("/traffic-route", json=payload).json()["legs"][0]
+    assert len(calls) == 1
+    assert len(decode_polyline(detailed["encoded_polyline"])) == 500
+    overview_points = decode_polyline(overview["encoded_polyline"])
+    assert len(overview_points) < 10
+    # The jam still starts exactly where it did on the full line
+    assert [i["speed"] for i in overview["speed_intervals"]] == ["NORMAL", "TRAFFIC_JAM"]
+    jam = overview["speed_intervals"][1]
+    assert tuple(overview_points[jam["start_index"]]) == line[250]
+    assert jam["end_index"] == len(overview_points) - 1
+
+
+# Benchmarks are seeded and measure quality against the exact optimum
+def test_benchmark_suite():
+    import numpy as np
+
+    from benchmark import compare, make_instances, run_benchmarks
+
+    instances = make_instances((6, 15), families=("uniform", "traffic"))
+    assert [i.name for i in instances] == ["uniform-n6-s0", "uniform-n15-s0", "traffic-n6-s0", "traffic-n15-s0"]
+    assert np.array_equal(make_instances((6,), families=("traffic",))[0].cost, instances[2].cost)
+    assert not np.allclose(instances[2].cost, instances[2].cost.T)
+
+    results = run_benchmarks(instances, solvers=("held_karp", "nearest_neighbor"), repeats=1)
+    rows = {(r.instance, r.solver): r for r in results}
+    assert ("uniform-n15-s0", "held_karp") not in rows
+    assert rows[("uniform-n6-s0", "held_karp")].gap == 0.0
+    assert rows[("traffic-n6-s0", "nearest_neighbor")].reference_kind == "exact"
+    assert rows[("traffic-n15-s0", "nearest_neighbor")].reference_kind == "best_known"
+    assert all(r.gap >= 0 and r.runtime_ms > 0 and r.peak_memory_bytes > 0 for r in results)
+
+    current = [vars(r) for r in results]
+    worse = [{**row, "gap": row["gap"] + 0.1} for row in current]
+    assert compare(current, current) == []
+    assert len(compare(worse, current)) == len(current)
+
+
+# /optimize reports its stages in Server-Timing and /metrics histograms
+def test_optimize_server_timing_and_metrics(monkeypatch):
+    import numpy as np
+    import google_matrix
+    from metrics import GOOGLE_FAILURES, GOOGLE_REQUESTS, STAGE_SECONDS
+
+    payload = {
+        "itinerary": [
+            {"id": str(i), "name": str(i), "location": {"lat": 7.0 + 0.1 * i, "lng": 80.0 + 0.05 * (i % 3)}}
+            for i in range(20)
+        ],
+        "construction": "greedy_edge",
+    }
+    before = STAGE_SECONDS.count(stage="total", metric="haversine", optimize_for="distance", n_bucket="14-50")
+    response = client.post("/optimize", json=payload)
+    assert response.status_code == 200
+    assert response.json()["solver"] == "greedy_edge_2opt"
+    stages = [part.split(";")[0] for part in response.headers["server-timing"].split(", ")]
+    assert stages == ["matrix", "construct", "local_search", "response", "serialize", "total"]
+    assert STAGE_SECONDS.count(stage="total", metric="haversine", optimize_for="distance", n_bucket="14-50") == before + 1
+
+    text = client.get("/metrics").text
+    assert "# TYPE route_optimizer_stage_seconds histogram" in text
+    assert 'stage="local_search",metric="haversine",optimize_for="distance",n_bucket="14-50",le="+Inf"' in text
+
+    # Every attempt is counted; the tile that keeps failing counts once per retry.
+    async def flaky_request(client, url, origins, destinations, params):
+        if origins[0] == (0.0, 80.0):
+            raise google_matrix._RetryableMatrixError("OVER_QUERY_LIMIT")
+        shape = (len(origins), len(destinations))
+        return np.ones(shape), np.ones(shape), np.ones(shape)
+
+    monkeypatch.setattr(google_matrix, "_request_tile", flaky_request)
+    calls = GOOGLE_REQUESTS.value(api="distance_matrix")
+    failures = GOOGLE_FAILURES.value(api="distance_matrix", retryable="true")
+    google_matrix.fetch_distance_matrix(
+        [(float(i), 80.0) for i in range(12)], api_key="test", use_cache=False, max_retries=2, retry_backoff_s=0.0
+    )
+    assert GOOGLE_FAILURES.value(api="distance_matrix", retryable="true") == failures + 3
+    assert GOOGLE_REQUESTS.value(api="distance_matrix") > calls + 3
+
+
+# Removing and inserting stops only re-optimizes around the edits
+def test_optimize_incremental():
+    from incremental import remove_stops
+
+    assert remove_stops([4, 0, 3, 1, 2], [3], 5) == ([3, 0, 1, 2], {0, 1})
+    assert remove_stops([4, 0, 3, 1, 2], [4, 2], 5) == ([0, 2, 1], {0, 1})
+
+    itinerary = [
+        {"id": str(i), "name": str(i), "location": {"lat": 6.0 + 0.1 * i, "lng": 80.0 + 0.02 * (i % 2)}}
+        for i in range(30)
+    ]
+    base = client.post("/optimize", json={"itinerary": itinerary}).json()
+    new_stop = {"id": "new", "name": "new", "location": {"lat": 6.75, "lng": 80.0}}
+    payload = {
+        "itinerary": itinerary,
+        "current_order": base["optimized_order"],
+        "remove": [20],
+        "insert": [new_stop],
+        "repair_radius": 2,
+    }
+    response = client.post("/optimize/incremental", json=payload)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["solver"] == "incremental"
+    ids = [d["id"] for d in data["optimized_itinerary"]]
+    assert sorted(ids) == sorted([str(i) for i in range(30) if i != 20] + ["new"])
+    # The new stop lands between its neighbours along the line; the far end is untouched.
+    assert ids[ids.index("new") - 1 : ids.index("new") + 2] in (["7", "new", "8"], ["8", "new", "7"])
+    before = [d["id"] for d in base["optimized_itinerary"]]
+    far = [i for i in before if int(i) < 5]
+    assert [i for i in ids if i in far] == far
+    assert "local_search" in response.headers["server-timing"]
+
+    bad = client.post("/optimize/incremental", json={**payload, "current_order": [0, 1]})
+    assert bad.status_code == 422
+    empty = client.post("/optimize/incremental", json={**payload, "remove": list(range(30)), "insert": []})
+    assert empty.status_code == 422
+
+
+# Multi-start on worker processes shares the matrix and never loses to the default solve
+def test_parallel_multistart(monkeypatch):
+    import time
+    from concurrent.futures import ProcessPoolExecutor
+
+    import main
+    from benchmark import make_instances
+    from multistart import _search, parallel_multistart, plan_seeds
+    from optimizer import path_length, solve_order_from_cost_matrix
+
+    chunks = plan_seeds(40, 3, try_all_starts=True, has_coords=True)
+    assert len(chunks) == 3
+    assert chunks[0][0] == ("nearest_neighbor", None)
+    assert sum(len(c) for c in chunks) == 4 + 6
+
+    inst = make_instances((40,), families=("traffic",))[0]
+    default = solve_order_from_cost_matrix(inst.cost, return_to_start=False, try_all_starts=True)
+    with ProcessPoolExecutor(2) as pool:
+        result = parallel_multistart(
+            inst.cost, pool=pool, workers=3, return_to_start=False, try_all_starts=True, coords=inst.coords
+        )
+        budgeted = parallel_multistart(
+            inst.cost, pool=pool, workers=2, return_to_start=True, try_all_starts=False, time_budget_ms=200
+        )
+    assert sorted(result.order) == list(range(40))
+    assert path_length(inst.cost, result.order, False) <= path_length(inst.cost, default.order, False)
+    assert budgeted.order[0] == 0 and sorted(budgeted.order) == list(range(40))
+    # A deadline that passed before the search still yields a valid route.
+    late, _, moves, timed_out = _search(
+        inst.cost,
+        chunks[0],
+        return_to_start=False,
+        try_all_starts=True,
+        coords=inst.coords,
+        deadline=time.perf_counter() - 1,
+        rng_seed=0,
+        improvement="lk",
+    )
+    assert sorted(late) == list(range(40)) and moves == 0 and timed_out
+
+    monkeypatch.setattr(main, "available_cpus", lambda: 4)
+    itinerary = [
+        {"id": str(i), "name": str(i), "location": {"lat": float(p[0]), "lng": float(p[1])}}
+        for i, p in enumerate(inst.coords[:20])
+    ]
+    data = client.post("/optimize", json={"itinerary": itinerary, "workers": 2}).json()
+    assert data["solver"] == "multistart_2opt"
+    assert sorted(data["optimized_order"]) == list(range(20))
+    small = client.post("/optimize", json={"itinerary": itinerary[:8], "workers": 2}).json()
+    assert small["solver"] == "held_karp"
+
+
+# Or-opt / LK-style search keeps the route ends fixed and beats 2-opt on traffic matrices
+def test_or_opt_and_lk():
+    import numpy as np
+
+    from benchmark import make_instances
+    from local_search import SearchStats, neighbor_lists, or_opt, two_opt
+    from optimizer import best_greedy_route, path_length
+    from result_cache import RESULT_CACHE
+
+    inst = make_instances((120,), families=("traffic",))[0]
+    near = neighbor_lists(inst.cost, 5)
+    assert near.shape == (120, 5)
+    assert 0 not in near[0]
+    sym = np.minimum(inst.cost, inst.cost.T)
+    assert sym[0, near[0, 0]] == min(sym[0, j] for j in range(1, 120))
+
+    start = best_greedy_route(inst.cost, try_all_starts=True)
+    plain = path_length(inst.cost, two_opt(inst.cost, start), False)
+    for lk in (False, True):
+        stats = SearchStats()
+        order = or_opt(inst.cost, start, lk=lk, stats=stats)
+        assert sorted(order) == list(range(120))
+        assert (order[0], order[-1]) == (start[0], start[-1])
+        assert stats.moves > 0
+        assert path_length(inst.cost, order, False) < plain
+
+    itinerary = [
+        {"id": str(i), "name": str(i), "location": {"lat": float(p[0]), "lng": float(p[1])}}
+        for i, p in enumerate(inst.coords[:40])
+    ]
+    for improvement, solver in (("or_opt", "greedy_or_opt"), ("lk", "space_filling_curve_lk")):
+        # Solve from the construction, not warm-started from the last route.
+        RESULT_CACHE.clear()
+        construction = "space_filling_curve" if improvement == "lk" else "nearest_neighbor"
+        payload = {"itinerary": itinerary, "improvement": improvement, "construction": construction}
+        data = client.post("/optimize", json={**payload, "return_to_start": True}).json()
+        assert data["solver"] == solver
+        assert sorted(data["optimized_order"]) == list(range(40))
+    assert client.post("/optimize", json={"itinerary": itinerary, "improvement": "3opt"}).status_code == 422
+
+
+# The road graph parses OSM, answers exact matrices via contraction hierarchies and backs metric=road
+def test_road_graph(tmp_path, monkeypatch):
+    import heapq
+
+    import numpy as np
+
+    import main
+    from road_graph import RoadGraph, RoadNetwork, build_road_graph, contract, largest_component
+
+    # Two-way street A-B-C, a one-way shortcut A->C, an unreachable island D-E
+    # and a footway (not drivable). B only shapes the street, so it is no node.
+    osm = """<?xml version="1.0"?>
+<osm>
+  <node id="1" lat="7.000" lon="80.000"/>
+  <node id="2" lat="7.010" lon="80.010"/>
+  <node id="3" lat="7.020" lon="80.000"/>
+  <node id="4" lat="7.500" lon="80.500"/>
+  <node id="5" lat="7.510" lon="80.500"/>
+  <way id="10"><nd ref="1"/><nd ref="2"/><nd ref="3"/><tag k="highway" v="secondary"/></way>
+  <way id="11"><nd ref="1"/><nd ref="3"/><tag k="highway" v="primary"/><tag k="oneway" v="yes"/></way>
+  <way id="12"><nd ref="4"/><nd ref="5"/><tag k="highway" v="service"/><tag k="oneway" v="yes"/></way>
+  <way id="13"><nd ref="2"/><nd ref="4"/><tag k="highway" v="footway"/></way>
+</osm>
+"""
+    (tmp_path / "tiny.osm").write_text(osm, encoding="utf-8")
+    graph = build_road_graph(tmp_path / "tiny.osm", tmp_path / "road_graph.npz")
+    assert len(graph) == 2
+    loaded = RoadGraph.load(tmp_path / "road_graph.npz")
+    m = loaded.matrix([(7.0, 80.0), (7.02, 80.0)])
+    # A->C takes the one-way primary road; C->A must go back through B.
+    assert m["distance_km"][0, 1] < m["distance_km"][1, 0]
+    assert m["duration_s"][0, 1] < m["duration_s"][1, 0]
+    assert not m["failed"].any()
+
+    # Contraction hierarchy matrices equal plain Dijkstra on a random street grid.
+    rng = np.random.default_rng(5)
+    side = 12
+    lat = np.repeat(np.linspace(7.0, 7.2, side), side)
+    lng = np.tile(np.linspace(80.6, 80.8, side), side)
+    tail, head = [], []
+    for v in range(side * side):
+        for x in (v + 1, v + side):
+            if x < side * side and (x != v + 1 or x % side) and rng.random() < 0.9:
+                tail.append(v)
+                head.append(x)
+                if rng.random() < 0.8:
+                    tail.append(x)
+                    head.append(v)
+    tail, head = np.array(tail), np.array(head)
+    km = rng.uniform(1.0, 3.0, len(tail))
+    network = largest_component(RoadNetwork(lat, lng, tail, head, km, km / rng.uniform(20, 60, len(tail)) * 3600))
+    ch = contract(network)
+    nodes = rng.choice(len(network.lat), 15, replace=False)
+    matrix = ch.matrix([(network.lat[v], network.lng[v]) for v in nodes])["duration_s"]
+    for i, source in enumerate(nodes.tolist()):
+        best = {source: 0.0}
+        heap = [(0.0, source)]
+        while heap:
+            d, v = heapq.heappop(heap)
+            if d > best[v]:
+                continue
+            for e in np.flatnonzero(network.tail == v).tolist():
+                x, nd = int(network.head[e]), d + float(network.duration_s[e])
+                if nd < best.get(x, np.inf):
+                    best[x] = nd
+                    heapq.heappush(heap, (nd, x))
+        assert np.allclose(matrix[i], [best[v] for v in nodes.tolist()])
+
+    itinerary = [
+        {"id": str(i), "name": str(i), "location": {"lat": float(network.lat[v]), "lng": float(network.lng[v])}}
+        for i, v in enumerate(nodes[:6].tolist())
+    ]
+    monkeypatch.setattr(main, "get_road_graph", lambda: None)
+    assert client.post("/optimize", json={"itinerary": itinerary, "metric": "road"}).status_code == 503
+    monkeypatch.setattr(main, "get_road_graph", lambda: ch)
+    response = client.post("/optimize", json={"itinerary": itinerary, "metric": "road", "optimize_for": "time"})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["metric_used"] == "road"
+    assert data["total_duration_seconds"] == data["total_duration_in_traffic_seconds"] > 0
+    assert "road_matrix;dur=" in response.headers["Server-Timing"]
+
+
+# MessagePack / float32 blob encodings and fetching the matrices of a solve by id
+def test_compact_encodings_and_matrices():
+    import json
+
+    import numpy as np
+
+    from msgpack import unpackb
+
+    from encoding import negotiate, read_matrix_blob
+
+    assert negotiate(None, ("application/json", "application/msgpack")) == "application/json"
+    assert negotiate("*/*", ("application/json", "application/msgpack")) == "application/json"
+    assert negotiate("application/msgpack, */*;q=0.1", ("application/json", "application/msgpack")) == (
+        "application/msgpack"
+    )
+
+    itinerary = [
+        {"id": str(i), "name": f"Stop {i}", "location": {"lat": 7.0 + 0.05 * i, "lng": 80.0 + 0.03 * (i % 3)}}
+        for i in range(6)
+    ]
+    assert client.post("/optimize", json={"itinerary": itinerary}).json()["matrix_id"] is None
+    full = client.post("/optimize", json={"itinerary": itinerary, "store_matrices": True}).json()
+    response = client.post("/optimize", json={"itinerary": itinerary}, headers={"Accept": "application/msgpack"})
+    assert response.headers["content-type"] == "application/msgpack"
+    compact = unpackb(response.content)
+    assert "optimized_itinerary" not in compact
+    assert compact["optimized_order"] == full["optimized_order"]
+    assert compact["segments"]["to_index"] == [s["to_index"] for s in full["segments"]]
+    assert len(response.content) < len(json.dumps(full)) / 2
+
+    url = f"/matrices/{full['matrix_id']}"
+    as_json = client.get(url).json()
+    assert as_json["layers"] == ["cost", "distance_km"]
+    cost = np.array(as_json["data"])
+    assert cost.shape == (6, 6)
+    blob = client.get(url, params={"layer": "distance_km"}, headers={"Accept": "application/octet-stream"})
+    assert len(blob.content) == 16 + 6 * 6 * 4
+    assert np.allclose(read_matrix_blob(blob.content), cost, rtol=1e-6)
+    packed = unpackb(client.get(url, headers={"Accept": "application/msgpack"}).content)
+    assert np.allclose(np.frombuffer(packed["data"], dtype="<f4").reshape(packed["shape"]), cost, rtol=1e-6)
+    # ETags name the layer and the encoding.
+    cached = {"If-None-Match": blob.headers["etag"], "Accept": "application/octet-stream"}
+    assert client.get(url, params={"layer": "distance_km"}, headers=cached).status_code == 304
+    assert client.get(url, headers=cached).status_code == 200
+    assert client.get(url, params={"layer": "duration_s"}).status_code == 404
+    assert client.get("/matrices/unknown").status_code == 404
+
+    # Entries larger than the whole store are refused; others evict the oldest
+    from matrix_store import MatrixStore
+
+    store = MatrixStore(max_bytes=2 * 6 * 6 * 8)
+    first = store.put({"cost": cost})
+    assert store.put({"cost": np.zeros((9, 9))}) is None
+    second = store.put({"cost": cost})
+    assert len(store) == 2 and store.get(first) is not None
+    # Reading `first` above made `second` the least recently used.
+    store.put({"cost": cost})
+    assert store.get(second) is None and store.get(first) is not None
+    assert not store.get(first)["cost"].flags.writeable
+
+
+# metric=estimated: a model fitted on logged Distance Matrix elements beats the haversine baseline
+def test_estimator(tmp_path, monkeypatch):
+    import numpy as np
+
+    import main
+    from estimator import TravelTimeEstimator, load_observation_log, load_sqlite_cache, record_observations, refit
+    from matrix_cache import PairMatrixCache, SQLiteBackend
+
+    # Synthetic history: hill-country roads wind more and are slower, and
+    # 07:00-09:00 local time is congested.
+    rng = np.random.default_rng(3)
+    rows = []
+    for _ in range(3000):
+        o_lat, o_lng = rng.uniform(6.0, 8.0), rng.uniform(79.9, 81.5)
+        d_lat, d_lng = o_lat + rng.normal(0, 0.2), o_lng + rng.normal(0, 0.2)
+        hill = 6.7 < o_lat < 7.4 and 80.4 < o_lng < 81.0
+        km = 111.0 * float(np.hypot(d_lat - o_lat, d_lng - o_lng)) * (1.6 if hill else 1.25)
+        seconds = km / (30.0 if hill else 50.0) * 3600
+        epoch = 1.7e9 + rng.uniform(0, 86400)
+        rush = 7 <= ((epoch + 5.5 * 3600) // 3600) % 24 <= 9
+        rows.append((o_lat, o_lng, d_lat, d_lng, epoch, km, seconds, seconds * (1.4 if rush else 1.0)))
+    monkeypatch.setenv("MATRIX_OBSERVATIONS_PATH", str(tmp_path / "observations.jsonl"))
+    record_observations(rows + [(7.0, 80.0, 7.1, 80.1, 1.7e9, 1e9, 1e9, 1e9)])  # unreachable: dropped
+    obs = load_observation_log(tmp_path / "observations.jsonl")
+    assert len(obs) == len(rows)
+
+    model = refit(obs)
+    report = model.report["holdout"]
+    assert report["samples"] > 0
+    assert report["duration_in_traffic_s"]["mape"] < 0.5 * report["baseline"]["duration_in_traffic_s"]["mape"]
+    model.save(tmp_path / "model.json")
+    loaded = TravelTimeEstimator.load(tmp_path / "model.json")
+    coords = [(7.2, 80.6), (7.25, 80.65), (6.9, 79.95)]
+    rush_hour = 1.7e9 - 1.7e9 % 86400 + 8 * 3600 - 5.5 * 3600
+    m = loaded.matrix(coords, departure_epoch=rush_hour)
+    assert m["distance_km"].shape == (3, 3) and np.all(np.diag(m["distance_km"]) == 0)
+    assert np.allclose(m["duration_s"], model.matrix(coords, departure_epoch=rush_hour)["duration_s"])
+    assert (m["duration_in_traffic_s"] > m["duration_s"] * 1.2)[~np.eye(3, dtype=bool)].all()
+
+    # The SQLite matrix cache is a training source too.
+    cache = PairMatrixCache(SQLiteBackend(tmp_path / "cache.sqlite3"))
+    key = cache.pair_key((7.0, 80.0), (7.1, 80.1), mode="driving", traffic_model="best_guess", bucket=5)
+    cache.set_many({key: (15.0, 1200.0, 1500.0)})
+    from_cache = load_sqlite_cache(tmp_path / "cache.sqlite3", bucket_s=900)
+    assert from_cache.departure_epoch.tolist() == [4500.0]
+    assert from_cache.duration_in_traffic_s.tolist() == [1500.0]
+
+    itinerary = [{"id": str(i), "name": str(i), "location": {"lat": lat, "lng": lng}} for i, (lat, lng) in enumerate(coords)]
+    monkeypatch.setattr(main, "get_estimator", lambda: None)
+    assert client.post("/optimize", json={"itinerary": itinerary, "metric": "estimated"}).status_code == 503
+    monkeypatch.setattr(main, "get_estimator", lambda: loaded)
+    response = client.post("/optimize", json={"itinerary": itinerary, "metric": "estimated", "optimize_for": "time"})
+    assert response.status_code == 200
+    assert response.json()["metric_used"] == "estimated"
+    assert response.json()["total_duration_in_traffic_seconds"] > 0
+    assert "estimated_matrix;dur=" in response.headers["Server-Timing"]
+
+
+# departure_time prices every leg at its hourly slice, with a bounded number of matrix fetches
+def test_time_dependent_matrices(monkeypatch):
+    import time
+
+    import numpy as np
+
+    import main
+    from optimizer import build_distance_matrix_array
+    from time_slices import TimeSlices, slice_starts
+
+    assert slice_starts(7200 + 1800, 6000, 4) == [7200, 10800, 14400]
+    assert slice_starts(7200, 50 * 3600, 4) == [7200, 10800, 14400, 18000]
+
+    # Traffic gets slower every hour after the departure.
+    departure = (int(time.time()) // 3600 + 48) * 3600
+    calls = []
+
+    async def fake_fetch(coords, *, departure_time="now", **kwargs):
+        calls.append(int(departure_time))
+        km = build_distance_matrix_array(coords)
+        seconds = km / 40.0 * 3600.0
+        slower = 1.0 + (int(departure_time) - departure) // 3600
+        return {
+            "distance_km": km,
+            "duration_s": seconds,
+            "duration_in_traffic_s": seconds * slower,
+            # Every pair of the second hour's fetch failed.
+            "failed": np.full(km.shape, slower == 2.0),
+        }
+
+    monkeypatch.setattr(main, "fetch_distance_matrix_async", fake_fetch)
+    monkeypatch.setenv("MATRIX_MAX_TIME_SLICES", "3")
+    # About 45 minutes between stops: five legs span more hours than allowed.
+    itinerary = [
+        {"id": str(i), "name": str(i), "location": {"lat": 7.0 + 0.3 * i, "lng": 80.0}} for i in range(6)
+    ]
+    body = {"itinerary": itinerary, "metric": "google", "optimize_for": "time", "try_all_starts": False}
+    response = client.post("/optimize", json={**body, "departure_time": departure})
+    assert response.status_code == 200
+    data = response.json()
+    assert sorted(calls) == [departure, departure + 3600, departure + 7200]
+    assert data["time_slices"] == 3
+    assert "time_slices;dur=" in response.headers["Server-Timing"]
+    factors = [s["duration_in_traffic_seconds"] / s["duration_seconds"] for s in data["segments"]]
+    assert factors == sorted(factors) and factors[0] == 1.0 and factors[-1] == 3.0
+    assert data["failed_legs"] == [k for k, factor in enumerate(factors) if factor == 2.0] != []
+    total = sum(s["duration_in_traffic_seconds"] for s in data["segments"])
+    assert np.isclose(data["total_duration_in_traffic_seconds"], total)
+
+    # Each day is refined on its own; incremental repairs are not refined at all.
+    split = client.post("/optimize", json={**body, "departure_time": departure, "day_split": {"days": 2}})
+    assert split.status_code == 200
+    assert sorted(i for day in split.json()["days"] for i in day["optimized_order"]) == list(range(6))
+    assert "time_slices;dur=" in split.headers["Server-Timing"]
+    edit = {"current_order": data["optimized_order"], "remove": [5]}
+    repaired = client.post("/optimize/incremental", json={**body, **edit, "departure_time": departure})
+    assert repaired.status_code == 200
+    assert "time_slices;dur=" not in repaired.headers["Server-Timing"]
+    # Parallel solves are refined like the regular solver.
+    monkeypatch.setattr(main, "available_cpus", lambda: 4)
+    many = [
+        {"id": str(i), "name": str(i), "location": {"lat": 7.0 + 0.05 * i, "lng": 80.0 + 0.02 * (i % 3)}}
+        for i in range(16)
+    ]
+    parallel = client.post("/optimize", json={**body, "itinerary": many, "departure_time": departure, "workers": 2})
+    assert parallel.json()["solver"] == "multistart_2opt"
+    assert "time_slices;dur=" in parallel.headers["Server-Timing"]
+
+    # A naive ISO time is Sri Lanka time; without departure_time one "now" fetch.
+    calls.clear()
+    local = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(departure + 5.5 * 3600))
+    assert client.post("/optimize", json={**body, "departure_time": local, "time_slices": 1}).json()["time_slices"] == 1
+    assert calls == [departure]
+    calls.clear()
+    monkeypatch.setattr(main, "fetch_distance_matrix_async", lambda c, **kw: fake_fetch(c, departure_time=departure))
+    assert client.post("/optimize", json=body).json()["time_slices"] is None
+    assert len(calls) == 1
+
+    # Refinement never makes the time-dependent cost worse.
+    rng = np.random.default_rng(7)
+    n = 12
+    stack = rng.uniform(600, 3600, (3, n, n))
+    slices = TimeSlices(0.0, 0.0, {"distance_km": stack / 60, "duration_s": stack, "duration_in_traffic_s": stack})
+    order = list(range(n))
+
+    def cost(route):
+        return slices.route_cost(stack, route, slices.leg_slices(route, return_to_start=False), False)
+
+    refined = slices.refine(stack, order, return_to_start=False)
+    assert sorted(refined) == order and refined[0] == 0 and refined[-1] == n - 1
+    assert cost(refined) < cost(order)
+
+
+# Same stops in another order reuse the cached route; other options warm-start from it
+def test_result_cache(monkeypatch):
+    import numpy as np
+
+    import main
+    from metrics import RESULT_CACHE_LOOKUPS
+    from models import OptimizeRequest
+    from result_cache import RESULT_CACHE, ResultCache, Signature
+
+    RESULT_CACHE.clear()
+    rng = np.random.default_rng(11)
+    points = rng.uniform((6.5, 79.9), (7.5, 80.9), (30, 2))
+    itinerary = [
+        {"id": f"s{i}", "name": str(i), "location": {"lat": float(lat), "lng": float(lng)}}
+        for i, (lat, lng) in enumerate(points)
+    ]
+    first = client.post("/optimize", json={"itinerary": itinerary}).json()
+    assert first["result_cache"] == "miss"
+
+    # The same places shuffled (and relabelled): no solve, same route in the caller's indices.
+    perm = rng.permutation(30)
+    shuffled = [{**itinerary[k], "id": f"x{k}"} for k in perm]
+    hits = RESULT_CACHE_LOOKUPS.value(outcome="hit")
+    second = client.post("/optimize", json={"itinerary": shuffled}).json()
+    assert second["result_cache"] == "hit"
+    assert RESULT_CACHE_LOOKUPS.value(outcome="hit") == hits + 1
+    assert second["solver"] == first["solver"]
+    assert [int(perm[i]) for i in second["optimized_order"]] == first["optimized_order"]
+    assert np.isclose(second["total_distance_km"], first["total_distance_km"])
+
+    # Other options for the same stops: local search starts from the cached route.
+    loop = client.post("/optimize", json={"itinerary": shuffled, "return_to_start": True}).json()
+    assert loop["result_cache"] == "warm_start"
+    assert loop["solver"] == "warm_start_2opt"
+    assert sorted(loop["optimized_order"]) == list(range(30))
+    # The parallel solver is seeded the same way.
+    monkeypatch.setattr(main, "available_cpus", lambda: 4)
+    parallel = client.post("/optimize", json={"itinerary": shuffled, "improvement": "or_opt", "workers": 2}).json()
+    assert parallel["result_cache"] == "warm_start"
+    assert parallel["solver"] == "warm_start_multistart_or_opt"
+    assert sorted(parallel["optimized_order"]) == list(range(30))
+    # A pinned start is part of the stop set, so it never reuses an unpinned route.
+    pinned = client.post("/optimize", json={"itinerary": itinerary, "try_all_starts": False}).json()
+    assert pinned["result_cache"] == "miss" and pinned["optimized_order"][0] == 0
+
+    # Routes cut short by the time budget only seed later solves.
+    cache = ResultCache(ttl_s=60)
+    req = OptimizeRequest.model_validate({"itinerary": itinerary})
+    signature = Signature(req)
+    cache.put(signature, list(range(30)), solver="greedy_2opt", optimal=False, complete=False)
+    assert not cache.get(signature).exact
+    cache.put(signature, list(range(30)), solver="greedy_2opt", optimal=False, complete=True)
+    assert cache.get(signature).exact
+    assert Signature(req.model_copy(update={"optimize_for": "time"})).options != signature.options
+    expired = ResultCache(ttl_s=0)
+    expired.put(signature, list(range(30)), solver="greedy_2opt", optimal=False, complete=True)
+    assert expired.get(signature) is None
@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass
+from typing import Sequence
+
+import numpy as np
+
+try:
+    from .local_search import IMPROVEMENT_EPS, deadline_passed, improve
+except ImportError:  # pragma: no cover
+    from local_search import IMPROVEMENT_EPS, deadline_passed, improve
+
+# Length of one departure-time slice. Slices start on the hour, so requests
+# departing within the same hour share matrices (and matrix cache entries).
+SLICE_S = 3600
+# Re-solves on the matrices of the legs' departure slices (see `refine`).
+REFINE_ROUNDS = 3
+
+
+def max_time_slices(requested: int | None) -> int:
+    """Slices (upstream matrix fetches) allowed for one request: the
+    requested number, capped by MATRIX_MAX_TIME_SLICES (default 4)."""
+    cap = int(os.getenv("MATRIX_MAX_TIME_SLICES") or 4)
+    return max(1, min(requested or cap, cap))
+
+
+def slice_starts(departure_epoch: float, horizon_s: float, limit: int) -> list[float]:
+    """Start times of the hourly slices a route leaving at `departure_epoch`
+    and driving for `horizon_s` passes through, at most `limit`."""
+    first = departure_epoch - departure_epoch % SLICE_S
+    count = int((departure_epoch - first + max(horizon_s, 0.0)) // SLICE_S) + 1
+    return [first + k * SLICE_S for k in range(max(1, min(count, limit)))]
+
+
+@dataclass
+class TimeSlices:
+    """Travel-time matrices for consecutive hourly departure slices.
+
+    `layers` maps the keys of `fetch_distance_matrix` (`distance_km`,
+    `duration_s`, `duration_in_traffic_s` and the `failed` mask) to
+    (slices, n, n) stacks; slice k covers departures in
+    [start_epoch + k * SLICE_S, + SLICE_S). Departures after the last slice
+    use the last one.
+    """
+
+    departure_epoch: float
+    start_epoch: float
+    layers: dict[str, np.ndarray]
+
+    @classmethod
+    def stack(
+        cls, departure_epoch: float, starts: Sequence[float], matrices: Sequence[dict[str, np.ndarray]]
+    ) -> TimeSlices:
+        keys = ("distance_km", "duration_s", "duration_in_traffic_s", "failed")
+        return cls(departure_epoch, starts[0], {key: np.stack([m[key] for m in matrices]) for key in keys})
+
+    def __len__(self) -> int:
+        return len(self.layers["duration_in_traffic_s"])
+
+    def first(self) -> dict[str, np.ndarray]:
+        """The departure slice, in the `fetch_distance_matrix` layout."""
+        return {key: stack[0] for key, stack in self.layers.items()}
+
+    def index(self, elapsed_s: float) -> int:
+        """Slice of a departure `elapsed_s` seconds after `departure_epoch`."""
+        k = int((self.departure_epoch - self.start_epoch + elapsed_s) // SLICE_S)
+        return min(max(k, 0), len(self) - 1)
+
+    def leg_slices(
+        self,
+        order: Sequence[int],
+        *,
+        return_to_start: bool,
+        service_s: Sequence[float] | None = None,
+        day_starts: Sequence[int] = (),
+    ) -> list[int]:
+        """Departure slice of every leg of `order` (the closing leg last when
+        `return_to_start`). Each leg departs after the previous legs' traffic
+        durations and visits; at the positions in `day_starts` the clock
+        goes back to the departure time of day."""
+        travel = self.layers["duration_in_traffic_s"]
+        resets = set(day_starts)
+        legs = list(zip(order, order[1:]))
+        if return_to_start and len(order) > 1:
+            legs.append((order[-1], order[0]))
+        slices: list[int] = []
+        elapsed = 0.0
+        for position, (i, j) in enumerate(legs, start=1):
+            # The leg to the first stop of a day is driven that morning.
+            if position in resets:
+                elapsed = 0.0
+            k = self.index(elapsed)
+            slices.append(k)
+            elapsed += float(travel[k, i, j])
+            if service_s is not None:
+                elapsed += service_s[j]
+        return slices
+
+    def route_cost(self, cost: np.ndarray, order: Sequence[int], legs: Sequence[int], return_to_start: bool) -> float:
+        """Sum of `cost` (a (slices, n, n) stack) over the legs of `order` at `legs` slices."""
+        if len(order) < 2:
+            return 0.0
+        tail = np.asarray(order[:-1] + ([order[-1]] if return_to_start else []), dtype=np.intp)
+        head = np.asarray(order[1:] + ([order[0]] if return_to_start else []), dtype=np.intp)
+        return float(cost[np.asarray(legs, dtype=np.intp), tail, head].sum())
+
+    def refine(
+        self,
+        cost: np.ndarray,
+        order: list[int],
+        *,
+        return_to_start: bool,
+        service_s: Sequence[float] | None = None,
+        improvement: str = "2opt",
+        deadline: float | None = None,
+    ) -> list[int]:
+        """Improve `order` for legs priced at their departure slices.
+
+        Each round gives every stop the slice its departure falls in on the
+        current route, builds the matrix whose row i comes from stop i's
+        slice, and runs local search (route ends fixed) on it. The new route
+        is kept if its time-dependent cost is lower; rounds stop when it is
+        not, at the deadline or after `REFINE_ROUNDS`.
+        """
+        n = len(order)
+        if len(self) == 1 or n < 4:
+            return order
+        rows = np.arange(cost.shape[1])
+
+        def route_cost(route: list[int]) -> float:
+            legs = self.leg_slices(route, return_to_start=return_to_start, service_s=service_s)
+            return self.route_cost(cost, route, legs, return_to_start)
+
+        best = list(order)
+        best_cost = route_cost(best)
+        for _ in range(REFINE_ROUNDS):
+            if deadline_passed(deadline):
+                break
+            node_slice = np.zeros(cost.shape[1], dtype=np.intp)
+            legs = self.leg_slices(best, return_to_start=return_to_start, service_s=service_s)
+            node_slice[np.asarray(best[: len(legs)], dtype=np.intp)] = legs
+            blended = cost[node_slice[:, None], rows[:, None], rows[None, :]]
+            candidate = improve(blended, best, improvement=improvement, deadline=deadline)
+            candidate_cost = route_cost(candidate)
+            if candidate_cost >= best_cost - IMPROVEMENT_EPS:
+                break
+            best, best_cost = candidate, candidate_cost
+        return best
@@ -0,0 +1,394 @@
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Sequence
+
+import numpy as np
+
+try:
+    from .local_search import deadline_passed
+except ImportError:  # pragma: no cover
+    from local_search import deadline_passed
+
+# A visiting window in seconds after midnight: (open, close).
+Window = tuple[float, float]
+
+DAY_S = 24 * 3600.0
+ALL_DAY: tuple[Window, ...] = ((0.0, DAY_S),)
+
+# Used when a text names a time without a closing time ("5:00 PM onwards").
+_LONE_TIME_WINDOW_S = 2 * 3600.0
+
+# Travel-time differences below this are rounding, not improvements.
+_TRAVEL_EPS_S = 1e-6
+
+_CLOCK = r"(\d{1,2})(?:[:.](\d{2}))?\s*(?:([AaPp])\.?\s*[Mm]\b\.?)?"
+_NAMED = r"\b(sunrise|sunset|noon|midnight)\b"
+# A lone time must carry AM/PM so that plain numbers are not read as times.
+_LONE_TIME_RE = re.compile(r"(\d{1,2})(?:[:.](\d{2}))?\s*([AaPp])\.?\s*[Mm]\b\.?")
+# In a range the first time may borrow AM/PM from the second ("7:00–9:00 AM").
+_RANGE_RE = re.compile(
+    rf"(?:{_CLOCK}|{_NAMED})\s*(?:-|–|—|to|until)\s*(?:{_LONE_TIME_RE.pattern}|{_NAMED})",
+    re.IGNORECASE,
+)
+
+_NAMED_TIMES_S = {
+    "sunrise": 6 * 3600.0,
+    "sunset": 18.5 * 3600.0,
+    "noon": 12 * 3600.0,
+    "midnight": DAY_S,
+}
+
+# Phrases without explicit times, longest first so "early morning" wins over
+# "morning". Anything unrecognised is treated as unconstrained.
+_OPEN_PHRASES: tuple[tuple[str, tuple[Window, ...]], ...] = (
+    ("24 hours", ALL_DAY),
+    ("all day", ALL_DAY),
+    ("all times", ALL_DAY),
+    ("daylight", ((6 * 3600.0, 18 * 3600.0),)),
+    ("daytime", ((6 * 3600.0, 18 * 3600.0),)),
+)
+_BEST_TIME_PHRASES: tuple[tuple[str, Window], ...] = (
+    ("early morning", (6 * 3600.0, 9 * 3600.0)),
+    ("mid-morning", (9 * 3600.0, 11 * 3600.0)),
+    ("late afternoon", (15.5 * 3600.0, 18 * 3600.0)),
+    ("morning", (6 * 3600.0, 12 * 3600.0)),
+    ("afternoon", (12 * 3600.0, 17 * 3600.0)),
+    ("evening", (16 * 3600.0, 19 * 3600.0)),
+    ("sunrise", (5.5 * 3600.0, 8 * 3600.0)),
+    ("sunset", (17 * 3600.0, 19 * 3600.0)),
+    ("daytime", (6 * 3600.0, 18 * 3600.0)),
+)
+
+
+def _clock_s(hour: str | None, minute: str | None, meridiem: str | None, named: str | None = None) -> float:
+    if named:
+        return _NAMED_TIMES_S[named.lower()]
+    h = int(hour or 0) % 12
+    if (meridiem or "a").lower() == "p":
+        h += 12
+    return h * 3600.0 + int(minute or 0) * 60.0
+
+
+def _merge(windows: list[Window]) -> tuple[Window, ...]:
+    merged: list[Window] = []
+    for start, end in sorted(windows):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return tuple(merged)
+
+
+def _time_ranges(text: str) -> list[Window]:
+    windows: list[Window] = []
+    for m in _RANGE_RE.finditer(text):
+        h0, m0, mer0, named0, h1, m1, mer1, named1 = m.groups()
+        end = _clock_s(h1, m1, mer1, named1)
+        start = _clock_s(h0, m0, mer0 or mer1, named0)
+        if mer0 is None and named0 is None and start > end:
+            # "11:00–1:00 PM": the first time is in the morning.
+            start = _clock_s(h0, m0, "a")
+        if end <= start:
+            # Closes after midnight ("6 PM - 2 AM") or at midnight ("12 AM").
+            end += DAY_S
+        windows.append((start, min(end, DAY_S)))
+    return windows
+
+
+@lru_cache(maxsize=4096)
+def parse_opening_hours(text: str | None) -> tuple[Window, ...]:
+    """Opening windows of a catalog `opening_hours` string.
+
+    Understands "6.00 AM - 10.00 PM", "5:00 AM - 12:00 PM, 4:00 PM - 9:00 PM",
+    "Open 24 hours", "Daytime", ... Day-of-week notes are ignored. Unknown or
+    empty text means open all day. Cached, so each distinct string is parsed
+    once per process.
+    """
+    if not text:
+        return ALL_DAY
+    windows = _time_ranges(text)
+    if windows:
+        return _merge(windows)
+    lower = text.lower()
+    for phrase, phrase_windows in _OPEN_PHRASES:
+        if phrase in lower:
+            return phrase_windows
+    return ALL_DAY
+
+
+@lru_cache(maxsize=4096)
+def parse_best_time(text: str | None) -> tuple[Window, ...]:
+    """Preferred windows of a `crowd_info.best_time_to_visit` string, or ()
+    if it names no time of day ("After rainfall")."""
+    if not text:
+        return ()
+    windows = _time_ranges(text)
+    remainder = _RANGE_RE.sub(" ", text)
+    for m in _LONE_TIME_RE.finditer(remainder):
+        start = _clock_s(*m.groups())
+        windows.append((start, min(start + _LONE_TIME_WINDOW_S, DAY_S)))
+    if windows:
+        return _merge(windows)
+    lower = text.lower()
+    for phrase, window in _BEST_TIME_PHRASES:
+        if phrase in lower:
+            windows.append(window)
+            lower = lower.replace(phrase, " ")
+    return _merge(windows)
+
+
+def intersect(a: Sequence[Window], b: Sequence[Window]) -> tuple[Window, ...]:
+    out: list[Window] = []
+    for a0, a1 in a:
+        for b0, b1 in b:
+            lo, hi = max(a0, b0), min(a1, b1)
+            if lo < hi:
+                out.append((lo, hi))
+    return _merge(out)
+
+
+def parse_clock(text: str) -> float:
+    """'HH:MM' (24-hour) to seconds after midnight."""
+    hours, minutes = text.split(":")
+    return int(hours) * 3600.0 + int(minutes) * 60.0
+
+
+def format_clock(seconds: float) -> str:
+    """Seconds after midnight as 'HH:MM'; hours run past 24 on the next day."""
+    minutes = int(round(seconds / 60.0))
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+@dataclass
+class Visit:
+    node: int
+    arrival_s: float
+    start_s: float
+    departure_s: float
+    # False if the stop could not be reached inside any of its windows; such
+    # stops are visited after all feasible ones.
+    feasible: bool
+
+
+@dataclass
+class TimeWindowSchedule:
+    visits: list[Visit] = field(default_factory=list)
+
+    @property
+    def order(self) -> list[int]:
+        return [v.node for v in self.visits]
+
+    @property
+    def infeasible(self) -> list[int]:
+        return [v.node for v in self.visits if not v.feasible]
+
+
+def _serve(arrival: float, windows: Sequence[Window], service: float) -> float | None:
+    """Earliest start of service at or after `arrival` that finishes inside a window."""
+    for open_s, close_s in windows:
+        start = max(arrival, open_s)
+        if start + service <= close_s:
+            return start
+    return None
+
+
+def _evaluate(
+    order: Sequence[int],
+    travel_s: np.ndarray | Sequence[Sequence[float]],
+    windows: Sequence[Sequence[Window]],
+    service_s: Sequence[float],
+    start_s: float,
+    origin: int | None,
+) -> tuple[int, float, float]:
+    """(stops missed, finish time, travel time) of visiting `order`; missed
+    stops are skipped, so one unreachable stop does not delay the rest."""
+    t = start_s
+    prev = origin
+    missed = 0
+    travel = 0.0
+    for v in order:
+        leg = float(travel_s[prev][v]) if prev is not None else 0.0
+        start = _serve(t + leg, windows[v], service_s[v])
+        if start is None:
+            missed += 1
+            continue
+        travel += leg
+        t = start + service_s[v]
+        prev = v
+    return missed, t, travel
+
+
+def schedule(
+    order: Sequence[int],
+    travel_s: np.ndarray | Sequence[Sequence[float]],
+    windows: Sequence[Sequence[Window]],
+    service_s: Sequence[float],
+    *,
+    start_s: float,
+    origin: int | None = None,
+) -> TimeWindowSchedule:
+    """Arrival and departure times for `order`, with missed stops moved to the end."""
+    visits: list[Visit] = []
+    missed: list[int] = []
+    t = start_s
+    prev = origin
+    for v in order:
+        arrival = t + (float(travel_s[prev][v]) if prev is not None else 0.0)
+        start = _serve(arrival, windows[v], service_s[v])
+        if start is None:
+            missed.append(v)
+            continue
+        t = start + service_s[v]
+        visits.append(Visit(v, arrival, start, t, True))
+        prev = v
+    for v in missed:
+        arrival = t + (float(travel_s[prev][v]) if prev is not None else 0.0)
+        t = arrival + service_s[v]
+        visits.append(Visit(v, arrival, arrival, t, False))
+        prev = v
+    return TimeWindowSchedule(visits)
+
+
+# Scoring state along a route: time, previous stop, stops missed, travel.
+_State = tuple[float, int | None, int, float]
+
+
+def _better(a: tuple[int, float, float], b: tuple[int, float, float]) -> bool:
+    """`a` < `b`, ignoring travel differences that are only rounding (travel
+    totals are summed in different orders)."""
+    if a[:2] != b[:2]:
+        return a[:2] < b[:2]
+    return a[2] < b[2] - _TRAVEL_EPS_S
+
+
+def solve_time_windows(
+    stops: Sequence[int],
+    travel_s: np.ndarray | Sequence[Sequence[float]],
+    windows: Sequence[Sequence[Window]],
+    service_s: Sequence[float],
+    *,
+    start_s: float,
+    origin: int | None = None,
+    pin_first: bool = False,
+    deadline: float | None = None,
+    max_passes: int = 50,
+) -> TimeWindowSchedule:
+    """Order `stops` so that as many as possible are visited inside their
+    windows, then finishing as early as possible, then driving least (TSPTW).
+
+    `travel_s` and the per-node `windows`/`service_s` are indexed by node;
+    `origin` is where the traveller is at `start_s` (None: at the first stop).
+    Seeds are the given order (usually the distance-optimal route) and the
+    stops sorted by closing / opening time; the best is improved by
+    relocating single stops until no move helps or `deadline` passes.
+    Stops that cannot be served are reported, never raised.
+
+    A relocation is scored from the cached state of the best route before
+    the first changed position, stops as soon as it cannot beat that route,
+    and reuses its cached ending once the traveller is at the same stop at
+    the same time as on it.
+    """
+    stops = list(stops)
+    # Python lists index faster than NumPy scalars in the scoring loop.
+    if isinstance(travel_s, np.ndarray):
+        travel_s = travel_s.tolist()
+    fixed = 1 if pin_first and stops else 0
+    head, rest = stops[:fixed], stops[fixed:]
+
+    def evaluate(order: list[int]) -> tuple[int, float, float]:
+        return _evaluate(order, travel_s, windows, service_s, start_s, origin)
+
+    seeds = [
+        stops,
+        head + sorted(rest, key=lambda v: (windows[v][-1][1] if windows[v] else DAY_S)),
+        head + sorted(rest, key=lambda v: (windows[v][0][0] if windows[v] else 0.0)),
+    ]
+    best = min(seeds, key=evaluate)
+    best_score = evaluate(best)
+
+    def visit(state: _State, v: int) -> _State:
+        """(time, previous stop, missed, travel) after trying to visit `v`."""
+        t, prev, missed, travel = state
+        leg = travel_s[prev][v] if prev is not None else 0.0
+        start = _serve(t + leg, windows[v], service_s[v])
+        if start is None:
+            return t, prev, missed + 1, travel
+        return start + service_s[v], v, missed, travel + leg
+
+    def relocation(state: _State, v: int, pos: int, skip: int) -> tuple[int, float, float] | None:
+        """Score of visiting `v` from `state`, then `best[pos:]` without
+        `best[skip]`; None when it is not better than `best`."""
+        t, prev, missed, travel = visit(state, v)
+        bound_missed, bound_t = best_score[0], best_score[1]
+        for p in range(pos, n + 1):
+            # Missed stops and the finish time never decrease along a route.
+            if missed > bound_missed or (missed == bound_missed and t > bound_t):
+                return None
+            if p > skip:
+                # The rest is `best`'s; at the same stop at the same time, it
+                # ends the same way.
+                best_t, best_prev, best_missed, best_travel = states[p]
+                if t == best_t and prev == best_prev:
+                    final = states[-1]
+                    candidate = (missed + final[2] - best_missed, final[0], travel + final[3] - best_travel)
+                    return candidate if _better(candidate, best_score) else None
+            if p == n:
+                break
+            if p != skip:
+                # `visit`, inlined: this is the innermost loop.
+                w = best[p]
+                leg = travel_s[prev][w] if prev is not None else 0.0
+                start = _serve(t + leg, windows[w], service_s[w])
+                if start is None:
+                    missed += 1
+                else:
+                    t, prev, travel = start + service_s[w], w, travel + leg
+        candidate = (missed, t, travel)
+        return candidate if _better(candidate, best_score) else None
+
+    def prefix_states(order: list[int]) -> list[_State]:
+        """_State on `order` after each of its prefixes."""
+        result = [(start_s, origin, 0, 0.0)]
+        for v in order:
+            result.append(visit(result[-1], v))
+        return result
+
+    n = len(best)
+    states = prefix_states(best)
+    for _ in range(max_passes):
+        improved = False
+        for i in range(fixed, n):
+            if deadline_passed(deadline):
+                break
+            v = best[i]
+            found: tuple[int, tuple[int, float, float]] | None = None
+            # Earlier slots: v, then best[j:] without best[i].
+            for j in range(fixed, i):
+                candidate = relocation(states[j], v, j, i)
+                if candidate is not None:
+                    found = (j, candidate)
+                    break
+            # Later slots: best[:j + 1] without best[i], then v, then best[j + 1:].
+            if found is None:
+                state = states[i]
+                for j in range(i + 1, n):
+                    state = visit(state, best[j])
+                    if state[2] > best_score[0] or (state[2] == best_score[0] and state[0] > best_score[1]):
+                        break
+                    candidate = relocation(state, v, j + 1, -1)
+                    if candidate is not None:
+                        found = (j, candidate)
+                        break
+            if found is not None:
+                j, best_score = found
+                without = best[:i] + best[i + 1 :]
+                best = without[:j] + [v] + without[j:]
+                states = prefix_states(best)
+                improved = True
+        if not improved or deadline_passed(deadline):
+            break
+
+    return schedule(best, travel_s, windows, service_s, start_s=start_s, origin=origin)